@@ -0,0 +1,75 @@
+import re
+
+# Spelling variants that show up between SAM.gov office names and our agency list.
+ABBREVIATIONS = {
+    'dept': 'department', 'dep': 'department', 'dot': 'department of transportation',
+    'govt': 'government', 'gov': 'government', 'natl': 'national', 'cnty': 'county',
+    'co': 'county', 'twp': 'township', 'auth': 'authority', 'admin': 'administration',
+    'transp': 'transportation', 'trans': 'transportation', 'metro': 'metropolitan',
+    'mpo': 'metropolitan planning organization', 'cog': 'council of governments',
+    'st': 'state', 'us': 'united states', 'usa': 'united states', '&': 'and',
+}
+
+def normalize_name(name):
+    """Lower-cases a name, strips punctuation and expands common abbreviations."""
+    if not name: return ""
+    tokens = re.findall(r"[a-z0-9&]+", name.lower())
+    return " ".join(ABBREVIATIONS.get(token, token) for token in tokens)
+
+class AgencyNameIndex:
+    """
+    In-memory index for resolving free-text agency names (e.g. SAM.gov's
+    fullParentPathName) to agency_ids. Built once per run from the agencies and
+    agency_aliases tables, it keeps the original "agency name contains the query"
+    semantics on normalized names, using a token inverted index to find candidates
+    instead of a leading-wildcard scan per lookup.
+    """
+
+    def __init__(self, names):
+        """names: iterable of (agency_id, name); aliases are simply extra names."""
+        self._exact = {}
+        self._names = {}
+        self._postings = {}
+        self._memo = {}
+        for agency_id, name in names:
+            normalized = normalize_name(name)
+            if not normalized: continue
+            self._exact.setdefault(normalized, agency_id)
+            key = len(self._names)
+            self._names[key] = (agency_id, f" {normalized} ")
+            for token in set(normalized.split()):
+                self._postings.setdefault(token, set()).add(key)
+
+    @classmethod
+    def build(cls, conn):
+        cur = conn.cursor()
+        cur.execute("SELECT agency_id, name FROM agencies ORDER BY agency_id")
+        names = cur.fetchall()
+        cur.execute("SELECT agency_id, alias FROM agency_aliases")
+        names += cur.fetchall()
+        return cls(names)
+
+    def match(self, name):
+        """Returns the agency_id whose name (or alias) contains the given name, or None."""
+        if name in self._memo: return self._memo[name]
+        normalized = normalize_name(name)
+        agency_id = self._exact.get(normalized)
+        if agency_id is None and normalized:
+            agency_id = self._match_containing(normalized)
+        self._memo[name] = agency_id
+        return agency_id
+
+    def _match_containing(self, normalized):
+        tokens = sorted(set(normalized.split()), key=lambda t: len(self._postings.get(t, ())))
+        candidates = None
+        for token in tokens:
+            postings = self._postings.get(token)
+            if not postings: return None
+            candidates = set(postings) if candidates is None else candidates & postings
+            if not candidates: return None
+        needle = f" {normalized} "
+        # Lowest key first keeps the result stable and prefers canonical names over aliases.
+        for key in sorted(candidates):
+            agency_id, haystack = self._names[key]
+            if needle in haystack: return agency_id
+        return None
@@ -1,13 +1,14 @@
 import pandas as pd
 import random
 from datetime import datetime
-from app import database
+from app import database, feature_store
 
 def run_guardian_agent():
     """Main orchestration function for all agentic tasks."""
     print("\\n--- [Guardian Agent] Starting Integrity and Learning Cycle ---")
     agent_create_feedback_loop()
     agent_detect_data_anomalies()
+    agent_reconcile_feature_store()
     print("--- [Guardian Agent] Cycle Complete ---")
 
 def agent_create_feedback_loop():
@@ -18,7 +19,7 @@ def agent_create_feedback_loop():
 
     try:
         query = """
-        SELECT p.agency_id, a.name, a.procurement_url FROM predictions p
+        SELECT p.agency_id, a.name, a.procurement_url FROM current_predictions p
         JOIN agencies a ON p.agency_id = a.agency_id
         WHERE p.prob_12_months > 0.75 AND NOT EXISTS (
             SELECT 1 FROM historical_solicitations hs
@@ -53,9 +54,15 @@ def agent_detect_data_anomalies():
     conn = database.get_db_connection()
     if not conn: return
     try:
-        query = "SELECT document_id FROM documents WHERE (raw_text IS NULL OR LENGTH(raw_text) < 100) AND scraped_date > (NOW() - INTERVAL '7 days');"
+        query = "SELECT document_id FROM documents WHERE (raw_text IS NULL OR LENGTH(raw_text) < 100) AND canonical_document_id IS NULL AND scraped_date > (NOW() - INTERVAL '7 days');"
         df_failed = pd.read_sql_query(query, conn)
         if not df_failed.empty:
             print(f"    - ALERT: Found {len(df_failed)} documents scraped in the last week with little or no text.")
     finally:
         if conn: conn.close()
+
+def agent_reconcile_feature_store():
+    """Full feature store refresh, catching entity and document edits made outside the application."""
+    print("  - Agent Task: Reconciling the signal feature store...")
+    added, removed = feature_store.refresh()
+    print(f"    - {added} signals added, {removed} removed.")
@@ -3,16 +3,18 @@ from dash import dcc, html, Input, Output, State, ALL, callback_context, dash_ta
 import dash_bootstrap_components as dbc
 import plotly.express as px
 import pandas as pd
-from app import database, report_generator, briefing_generator, conversation_agent
+from app import database, report_generator, briefing_generator, conversation_agent, llm_jobs
 
 app = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP], suppress_callback_exceptions=True)
 server = app.server
+# LLM answers stream into the chat and report panels; the browser polls for new text at this interval.
+STREAM_POLL_MS = 300
 
 @dash.callback_cache.memoize()
 def load_all_data():
     conn = database.get_db_connection()
     if not conn: return pd.DataFrame(), pd.DataFrame()
-    agencies_q = "SELECT a.agency_id, a.name, a.state, a.agency_type, a.latitude, a.longitude, COALESCE(p.prob_12_months, 0) as prob_12_months FROM agencies a LEFT JOIN predictions p ON a.agency_id = p.agency_id WHERE a.latitude IS NOT NULL;"
+    agencies_q = "SELECT a.agency_id, a.name, a.state, a.agency_type, a.latitude, a.longitude, COALESCE(p.prob_12_months, 0) as prob_12_months FROM agencies a LEFT JOIN current_predictions p ON a.agency_id = p.agency_id WHERE a.latitude IS NOT NULL;"
     agencies_df = pd.read_sql(agencies_q, conn)
     rels_q = "SELECT parent_agency_id, child_agency_id FROM agency_relationships;"
     rels_df = pd.read_sql(rels_q, conn)
@@ -42,12 +44,20 @@ app.layout = dbc.Container([
             html.H4("Conversational Assistant"),
             dcc.Textarea(id='chat-input', style={'width': '100%'}, placeholder="Query your selection, e.g., 'Which members are putting out RFPs soon?'"),
             dbc.Button("Submit Query", id='chat-submit-button', className="mt-2"),
-            dcc.Loading(dcc.Markdown(id='chat-output', className="mt-2", style={'maxHeight': '300px', 'overflowY': 'auto', 'border': '1px solid #ddd', 'padding': '10px'}))
+            dbc.Button("Cancel", id='chat-cancel-button', color="secondary", outline=True, className="mt-2 ms-2"),
+            html.Small(id='chat-status', className="text-muted ms-2"),
+            dcc.Store(id='chat-job-store'),
+            dcc.Interval(id='chat-stream-interval', interval=STREAM_POLL_MS, disabled=True),
+            dcc.Markdown(id='chat-output', className="mt-2", style={'maxHeight': '300px', 'overflowY': 'auto', 'border': '1px solid #ddd', 'padding': '10px'})
         ], width=6),
         dbc.Col([
             html.H4("On-Demand Report Preview"),
             dbc.Button("Generate Report from Top Selection", id="generate-preview-button", className="mb-2"),
-            dcc.Loading(dcc.Markdown(id='report-preview-content', style={'maxHeight': '300px', 'overflowY': 'auto', 'border': '1px solid #ddd', 'padding': '10px'}))
+            dbc.Button("Cancel", id='report-cancel-button', color="secondary", outline=True, className="mb-2 ms-2"),
+            html.Small(id='report-status', className="text-muted ms-2"),
+            dcc.Store(id='report-job-store'),
+            dcc.Interval(id='report-stream-interval', interval=STREAM_POLL_MS, disabled=True),
+            dcc.Markdown(id='report-preview-content', style={'maxHeight': '300px', 'overflowY': 'auto', 'border': '1px solid #ddd', 'padding': '10px'})
         ], width=6)
     ])
 ], fluid=True)
@@ -80,11 +90,71 @@ def update_table_on_click(clickData):
 def initial_map(data):
     agencies_df, _ = load_all_data()
     fig = px.scatter_mapbox(agencies_df, lat="latitude", lon="longitude", hover_name="name",
-                            color="prob_12_months", color_continuous_scale=px.colors.sequential.YlOrRd",
+                            color="prob_12_months", color_continuous_scale=px.colors.sequential.YlOrRd,
                             mapbox_style="carto-positron", zoom=3.5,
                             custom_data=['agency_id'])
     fig.update_layout(margin={"r":0,"t":0,"l":0,"b":0})
     return fig
 
+def get_selected_agencies(agency_ids, table_rows):
+    """The current selection: the stored agency ids, or the agencies shown in the table."""
+    agencies_df, _ = load_all_data()
+    ids = agency_ids or [row['agency_id'] for row in (table_rows or [])]
+    return agencies_df[agencies_df['agency_id'].isin(ids)]
+
+def render_stream_job(job_id):
+    """Returns (markdown, status, interval_disabled, job_id) for a streaming panel."""
+    job = llm_jobs.snapshot(job_id) if job_id else None
+    if not job: return dash.no_update, "", True, None
+    status = []
+    if job['ttft_seconds'] is not None: status.append(f"first token {job['ttft_seconds']:.1f}s")
+    status.append(f"{'total' if job['done'] else 'elapsed'} {job['elapsed_seconds']:.1f}s")
+    if job['cancelled']: status.append("cancelled")
+    if job['error']: status.append(f"error: {job['error']}")
+    text = job['text'] if job['done'] else job['text'] + " ▌"
+    return text, " · ".join(status), job['done'], job_id
+
+def triggered_component():
+    return callback_context.triggered[0]['prop_id'].split('.')[0] if callback_context.triggered else None
+
+@app.callback(
+    Output('chat-output', 'children'), Output('chat-status', 'children'),
+    Output('chat-stream-interval', 'disabled'), Output('chat-job-store', 'data'),
+    Input('chat-submit-button', 'n_clicks'), Input('chat-cancel-button', 'n_clicks'), Input('chat-stream-interval', 'n_intervals'),
+    State('chat-input', 'value'), State('selected-agency-ids-store', 'data'), State('agency-table', 'data'), State('chat-job-store', 'data'),
+    prevent_initial_call=True
+)
+def stream_chat_answer(submit_clicks, cancel_clicks, n_intervals, query, agency_ids, table_rows, job_id):
+    trigger = triggered_component()
+    if trigger == 'chat-submit-button':
+        if not query: return dash.no_update, "Type a question first.", True, job_id
+        if job_id: llm_jobs.cancel(job_id)
+        selection = get_selected_agencies(agency_ids, table_rows)
+        job_id = llm_jobs.start(lambda cancel_event: conversation_agent.stream_query(query, selection, cancel_event))
+        return "", "waiting for the model...", False, job_id
+    if trigger == 'chat-cancel-button' and job_id:
+        llm_jobs.cancel(job_id)
+    return render_stream_job(job_id)
+
+@app.callback(
+    Output('report-preview-content', 'children'), Output('report-status', 'children'),
+    Output('report-stream-interval', 'disabled'), Output('report-job-store', 'data'),
+    Input('generate-preview-button', 'n_clicks'), Input('report-cancel-button', 'n_clicks'), Input('report-stream-interval', 'n_intervals'),
+    State('selected-agency-ids-store', 'data'), State('agency-table', 'data'), State('report-job-store', 'data'),
+    prevent_initial_call=True
+)
+def stream_report_preview(generate_clicks, cancel_clicks, n_intervals, agency_ids, table_rows, job_id):
+    trigger = triggered_component()
+    if trigger == 'generate-preview-button':
+        selection = get_selected_agencies(agency_ids, table_rows)
+        if selection.empty: return dash.no_update, "Select an agency on the map first.", True, job_id
+        if job_id: llm_jobs.cancel(job_id)
+        top_agency_id = int(selection.sort_values(by='prob_12_months', ascending=False).iloc[0]['agency_id'])
+        job_id = llm_jobs.start(lambda cancel_event: report_generator.stream_report_markdown(top_agency_id, cancel_event=cancel_event))
+        return "", "waiting for the model...", False, job_id
+    if trigger == 'report-cancel-button' and job_id:
+        llm_jobs.cancel(job_id)
+    return render_stream_job(job_id)
+
 if __name__ == '__main__':
     app.run_server(debug=True)
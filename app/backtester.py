@@ -0,0 +1,134 @@
+import os
+import sys
+import time
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
+import pandas as pd
+from app import database, training_data
+
+# Walk-forward backtest: for each simulation date a model is trained only on snapshots
+# whose 12-month outcome was already known by that date, then scores every agency as
+# of that date. Simulation dates run in parallel; each worker maps the feature panel
+# from shared memory instead of receiving a copy, and each finished date is written in
+# one transaction so an interrupted run resumes where it stopped.
+BACKTEST_START = os.environ.get('BACKTEST_START', '2015-01-01')
+BACKTEST_END = os.environ.get('BACKTEST_END', '2022-01-01')
+BACKTEST_FREQ = os.environ.get('BACKTEST_FREQ', 'QS')
+# Training snapshots are taken at this cadence from HISTORY_START onwards.
+HISTORY_START = os.environ.get('BACKTEST_HISTORY_START', '2011-01-01')
+TRAINING_FREQ = os.environ.get('BACKTEST_TRAINING_FREQ', '3MS')
+PREDICTION_WINDOW_DAYS = 365
+BACKTEST_WORKERS = int(os.environ.get('BACKTEST_WORKERS', max(1, (os.cpu_count() or 2) - 1)))
+MODEL_PARAMS = {'n_estimators': 200, 'max_depth': 4, 'learning_rate': 0.1, 'eval_metric': 'logloss'}
+
+_shared = {}  # worker-side views of the shared arrays, set up by _attach_shared
+
+def _share(arrays):
+    """Copies arrays into shared memory blocks; returns the blocks and the specs workers attach with."""
+    blocks, specs = [], {}
+    for name, array in arrays.items():
+        block = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+        np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+        blocks.append(block)
+        specs[name] = (block.name, array.shape, array.dtype.str)
+    return blocks, specs
+
+def _attach_shared(specs, threads):
+    for name, (block_name, shape, dtype) in specs.items():
+        block = shared_memory.SharedMemory(name=block_name)
+        _shared[name] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+        _shared[name + '_block'] = block  # keeps the mapping alive
+    _shared['threads'] = threads
+
+def simulate_date(grid_index):
+    """
+    Trains on the training snapshots whose outcome window closed by the simulation
+    date at grid_index and returns (grid_index, probabilities for every agency).
+    """
+    import xgboost as xgb
+    features, labels, days = _shared['features'], _shared['labels'], _shared['days']
+    known = np.flatnonzero(_shared['is_training'] & (days + PREDICTION_WINDOW_DAYS <= days[grid_index]))
+    X = features[known].reshape(-1, features.shape[2])
+    y = labels[known].ravel()
+    positives = int(y.sum())
+    if positives == 0 or positives == len(y):
+        # Nothing to learn from yet: the observed base rate is the best available forecast.
+        return grid_index, np.full(features.shape[1], positives / len(y) if len(y) else 0.0, dtype=np.float32)
+    model = xgb.XGBClassifier(scale_pos_weight=(len(y) - positives) / positives, n_jobs=_shared['threads'], **MODEL_PARAMS)
+    model.fit(X, y)
+    return grid_index, model.predict_proba(features[grid_index])[:, 1].astype(np.float32)
+
+def completed_dates(cur):
+    cur.execute("SELECT DISTINCT simulation_date FROM backtest_results")
+    return {str(row[0])[:10] for row in cur.fetchall()}
+
+def run_backtest(start=BACKTEST_START, end=BACKTEST_END, freq=BACKTEST_FREQ, workers=BACKTEST_WORKERS, reset=False):
+    """
+    Runs the walk-forward backtest over simulation dates from start to end and writes
+    backtest_results. Dates already in backtest_results are skipped unless reset,
+    which first deletes the results in the range.
+    """
+    print("--- Walk-Forward Backtest ---")
+    conn = database.get_db_connection()
+    if not conn: return
+    p_style = database.get_param_style()
+    simulation_dates = pd.date_range(start=start, end=end, freq=freq)
+    blocks, pool = [], None
+    try:
+        cur = conn.cursor()
+        if reset:
+            cur.execute(f"DELETE FROM backtest_results WHERE simulation_date >= {p_style} AND simulation_date <= {p_style}", (simulation_dates.min().date().isoformat(), simulation_dates.max().date().isoformat()))
+            conn.commit()
+        done = completed_dates(cur)
+        pending = [date for date in simulation_dates if date.date().isoformat() not in done]
+        print(f"  - {len(simulation_dates)} simulation dates ({freq}), {len(simulation_dates) - len(pending)} already completed.")
+        if not pending: return
+
+        history = training_data.load_history(conn)
+        agency_ids = history['agencies']['agency_id'].to_numpy()
+        if len(agency_ids) == 0:
+            print("    - No agencies to simulate.")
+            return
+        training_dates = pd.date_range(start=HISTORY_START, end=end, freq=TRAINING_FREQ)
+        grid_dates = training_dates.union(pd.DatetimeIndex(pending))
+        grid_days = training_data.day_numbers(grid_dates)
+
+        # Every array is (dates x agencies [x features]), so a simulation date's rows are one slice.
+        panel = training_data.feature_panel(history, grid_days)
+        features = np.ascontiguousarray(np.stack(list(panel.values()), axis=-1).transpose(1, 0, 2))
+        labels = training_data.outcome_labels(agency_ids, grid_days, history['solicitations'], PREDICTION_WINDOW_DAYS).reshape(len(agency_ids), -1).T.copy()
+        time_to_event = training_data.days_to_next_release(agency_ids, grid_days, history['solicitations']).reshape(len(agency_ids), -1).T
+        blocks, specs = _share({'features': features, 'labels': labels, 'days': grid_days, 'is_training': grid_dates.isin(training_dates)})
+        print(f"  - Feature panel: {len(grid_dates)} dates x {len(agency_ids)} agencies x {features.shape[2]} features ({features.nbytes / 1e6:.0f} MB shared).")
+
+        workers = max(1, min(workers, len(pending)))
+        threads = max(1, (os.cpu_count() or 1) // workers)
+        context = multiprocessing.get_context('spawn')
+        pool = context.Pool(workers, initializer=_attach_shared, initargs=(specs, threads))
+        started = time.monotonic()
+        tasks = [int(grid_dates.get_loc(date)) for date in pending]
+        for finished, (grid_index, probabilities) in enumerate(pool.imap_unordered(simulate_date, tasks), start=1):
+            simulation_date = grid_dates[grid_index].date().isoformat()
+            outcomes = labels[grid_index]
+            days = time_to_event[grid_index]
+            rows = [
+                (simulation_date, int(agency_id), float(prob), bool(outcome), None if np.isnan(day) else int(day))
+                for agency_id, prob, outcome, day in zip(agency_ids, probabilities, outcomes, days)
+            ]
+            database.bulk_insert(cur, 'backtest_results', ('simulation_date', 'agency_id', 'predicted_prob_12m', 'actual_outcome_12m', 'time_to_event_days'), rows, ignore_conflicts=True)
+            conn.commit()
+            print(f"    - [{finished}/{len(tasks)}] {simulation_date}: {len(rows)} agencies scored ({time.monotonic() - started:.0f}s elapsed).")
+        pool.close()
+        pool.join()
+        pool = None
+    finally:
+        if pool: pool.terminate()
+        for block in blocks:
+            block.close()
+            block.unlink()
+        conn.close()
+    print("--- Backtest Complete ---")
+
+if __name__ == '__main__':
+    run_backtest(reset='--reset' in sys.argv)
@@ -1,10 +1,6 @@
-import os
-import requests
 import json
 from app import database
-
-OLLAMA_URL = os.environ.get('OLLAMA_URL', 'http://ollama:11434')
-OLLAMA_MODEL = os.environ.get('OLLAMA_MODEL', 'llama3')
+from app import llm_client
 
 def generate_state_brief(state_name):
     """Generates an informative brief about a state's transportation structure."""
@@ -25,8 +21,6 @@ Use this list of known agencies as context: {agency_list_str}
 Explain the roles of the State DOT, MPOs, COGs, and local entities and how projects flow from planning to solicitation.
 """
     try:
-        response = requests.post(f"{OLLAMA_URL}/api/generate", json={"model": OLLAMA_MODEL, "prompt": prompt, "stream": False}, headers={'Content-Type': 'application/json'})
-        response.raise_for_status()
-        return response.json().get('response', 'Failed to generate brief.')
-    except requests.exceptions.RequestException as e:
+        return llm_client.generate(prompt, purpose='state_brief') or 'Failed to generate brief.'
+    except llm_client.LLMError as e:
         return f"Error connecting to the AI model: {e}"
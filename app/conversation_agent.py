@@ -1,11 +1,19 @@
 import pandas as pd
 import json
 import os
-import requests
+import re
 from app import database
+from app import llm_client
+from app import search
 
-OLLAMA_URL = os.environ.get('OLLAMA_URL', 'http://ollama:11434')
-OLLAMA_MODEL = os.environ.get('OLLAMA_MODEL', 'llama3')
+# Free-form questions are answered from retrieved passages, not the whole selection,
+# so the prompt (and latency) stays the same size whatever is selected on the map.
+RAG_TOP_K = int(os.environ.get('RAG_TOP_K', 8))
+RAG_TOKEN_BUDGET = int(os.environ.get('RAG_TOKEN_BUDGET', 3000))
+RAG_MAX_AGENCY_ROWS = 15
+RAG_SNIPPET_WORDS = 48
+SOURCE_LABELS = {'documents': 'document', 'entities': 'extracted mention', 'news': 'news'}
+OPPORTUNITY_KEYWORDS = ["rfp", "soon", "opportunity", "high probability"]
 
 def handle_query(query, selected_agencies_df):
     if selected_agencies_df.empty:
@@ -13,7 +21,7 @@ def handle_query(query, selected_agencies_df):
 
     query_lower = query.lower()
 
-    if any(keyword in query_lower for keyword in ["rfp", "soon", "opportunity", "high probability"]):
+    if any(keyword in query_lower for keyword in OPPORTUNITY_KEYWORDS):
         return answer_top_opportunities(selected_agencies_df)
 
     if "summarize" in query_lower:
@@ -45,18 +53,79 @@ def answer_summary(df):
 - **Average 12-Month Likelihood:** {avg_prob:.1%}
 """
 
-def answer_with_rag(query, df):
-    prompt = f"""You are an AI assistant for a business intelligence platform. A user has selected a group of transportation agencies and has asked a question. Use ONLY the provided data (in JSON format) to formulate a concise, professional answer. If the data cannot answer the question, state that clearly.
+def selection_summary(df, query):
+    """
+    Compact, size-independent projection of the selection: aggregate figures plus
+    the highest-probability agencies and any agency named in the question.
+    """
+    query_lower = query.lower()
+    names = df['name'].fillna('').str.lower()
+    named = df[names.apply(lambda name: bool(name) and re.search(rf"\b{re.escape(name)}\b", query_lower) is not None)].head(RAG_MAX_AGENCY_ROWS)
+    top = df.sort_values(by='prob_12_months', ascending=False).head(RAG_MAX_AGENCY_ROWS)
+    rows = pd.concat([named, top]).drop_duplicates(subset='agency_id')
+    lines = [f"Selection: {len(df)} agencies, average 12-month likelihood {df['prob_12_months'].mean():.1%}, "
+             f"{int((df['prob_12_months'] > 0.5).sum())} above 50%."]
+    if 'agency_type' in df:
+        counts = df['agency_type'].fillna('Unknown').value_counts()
+        lines.append("By type: " + ", ".join(f"{agency_type} {count}" for agency_type, count in counts.items()))
+    lines.append(f"Agencies (highest likelihood first{', plus those named in the question' if not named.empty else ''}):")
+    for _, row in rows.iterrows():
+        lines.append(f"- {row['name']} | {row.get('agency_type', '')} | {row.get('state', '')} | 12-mo likelihood {row['prob_12_months']:.1%}")
+    return "\n".join(lines)
+
+def retrieve_passages(query, df, budget_tokens):
+    """Top-ranked full-text passages for the selected agencies, trimmed to the token budget."""
+    agency_names = dict(zip(df['agency_id'], df['name']))
+    hits = search.search(query, agency_ids=list(agency_names), limit=RAG_TOP_K, match_any=True, snippet_words=RAG_SNIPPET_WORDS)
+    passages, used = [], 0
+    for hit in hits[:RAG_TOP_K]:
+        passage = f"[{len(passages) + 1}] {agency_names.get(hit['agency_id'], 'Unknown agency')} - {SOURCE_LABELS[hit['source']]}: {hit['title'] or ''}\n{hit['snippet'] or ''}"
+        cost = estimate_tokens(passage)
+        if used + cost > budget_tokens: break
+        passages.append(passage)
+        used += cost
+    return passages
+
+def estimate_tokens(text):
+    return len(text) // 4 + 1
+
+def build_rag_prompt(query, df):
+    """
+    Builds the prompt for a free-form question from retrieved evidence rather than the
+    raw selection: a compact summary of the selection plus the top-k matching passages
+    from documents, entity context sentences and news, within RAG_TOKEN_BUDGET.
+    """
+    summary = selection_summary(df, query)
+    passages = retrieve_passages(query, df, RAG_TOKEN_BUDGET - estimate_tokens(summary))
+    evidence = "\n\n".join(passages) if passages else "(No matching documents, entities or news were found for the selected agencies.)"
+    return f"""You are an AI assistant for a business intelligence platform. A user has selected a group of transportation agencies and has asked a question. Use ONLY the selection summary and the numbered source passages below to formulate a concise, professional answer, citing passages by number. If they cannot answer the question, state that clearly.
 
 USER QUERY:
 "{query}"
 
-AVAILABLE DATA:
-{df.to_json(orient='records', indent=2)}
+SELECTION SUMMARY:
+{summary}
+
+SOURCE PASSAGES:
+{evidence}
 """
+
+def answer_with_rag(query, df):
     try:
-        response = requests.post(f"{OLLAMA_URL}/api/generate", json={"model": OLLAMA_MODEL, "prompt": prompt, "stream": False}, headers={'Content-Type': 'application/json'})
-        response.raise_for_status()
-        return response.json().get('response', "I was unable to process this query.")
-    except Exception as e:
+        return llm_client.generate(build_rag_prompt(query, df), purpose='chat') or "I was unable to process this query."
+    except llm_client.LLMError as e:
         return f"Error connecting to the AI model: {e}"
+
+def stream_query(query, selected_agencies_df, cancel_event=None):
+    """
+    Streaming counterpart of handle_query for the dashboard: yields the answer in
+    pieces. Questions answered from the data alone are yielded in one piece.
+    """
+    query_lower = query.lower()
+    if selected_agencies_df.empty or any(keyword in query_lower for keyword in OPPORTUNITY_KEYWORDS) or "summarize" in query_lower:
+        yield handle_query(query, selected_agencies_df)
+        return
+    try:
+        yield from llm_client.stream_generate(build_rag_prompt(query, selected_agencies_df), purpose='chat', cancel_event=cancel_event)
+    except llm_client.LLMError as e:
+        yield f"\n\nError connecting to the AI model: {e}"
@@ -0,0 +1,120 @@
+import os
+import random
+from datetime import datetime, timedelta
+from app import database
+
+# Per-page revisit intervals adapt to how often a page has been seen to change:
+# halved after a change, stretched after an unchanged visit, within these bounds.
+INITIAL_REVISIT_HOURS = 24.0
+MIN_REVISIT_HOURS = 20.0  # just under a day so nightly runs pick up fast-moving pages
+MAX_REVISIT_HOURS = 24.0 * 30
+CHANGED_FACTOR = 0.5
+UNCHANGED_FACTOR = 1.5
+
+# How strongly the 12-month forecast pulls an agency's pages forward in the queue.
+PREDICTION_BOOST = float(os.environ.get('CRAWL_PREDICTION_BOOST', 2.0))
+NEVER_CRAWLED_OVERDUE = 10.0
+# Every agency keeps at least this sampling weight for news, so low-probability agencies still get looked at.
+NEWS_BASE_WEIGHT = 0.1
+
+def _parse_timestamp(value):
+    if value is None or isinstance(value, datetime): return value
+    return datetime.fromisoformat(str(value))
+
+def load_prediction_scores(cur):
+    """Returns {agency_id: prob_12_months} from the current prediction run."""
+    cur.execute("SELECT agency_id, MAX(prob_12_months) FROM current_predictions GROUP BY agency_id")
+    return {agency_id: prob or 0.0 for agency_id, prob in cur.fetchall()}
+
+def plan_crawl(pages, page_budget=None, due_only=True, now=None):
+    """
+    Orders candidate pages by crawl priority and trims them to the page budget.
+
+    pages: list of (agency_id, name, page_url, doc_type). Priority is how overdue a
+    page is relative to its learned revisit interval, boosted by the agency's
+    predicted 12-month solicitation probability. With due_only, pages whose revisit
+    interval has not yet elapsed are left out.
+    """
+    now = now or datetime.now()
+    conn = database.get_db_connection()
+    if not conn: return pages[:page_budget] if page_budget else pages
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT page_url, revisit_interval_hours, last_crawled_at FROM crawl_frontier")
+        frontier = {url: (interval, _parse_timestamp(last)) for url, interval, last in cur.fetchall()}
+        scores = load_prediction_scores(cur)
+    finally:
+        conn.close()
+
+    ranked = []
+    for page in pages:
+        agency_id, _, page_url, _ = page
+        interval, last_crawled = frontier.get(page_url, (INITIAL_REVISIT_HOURS, None))
+        if last_crawled is None:
+            overdue = NEVER_CRAWLED_OVERDUE
+        else:
+            overdue = (now - last_crawled).total_seconds() / 3600.0 / max(interval, 1e-6)
+        if due_only and overdue < 1.0: continue
+        ranked.append((overdue * (1.0 + PREDICTION_BOOST * scores.get(agency_id, 0.0)), page))
+
+    ranked.sort(key=lambda item: item[0], reverse=True)
+    planned = [page for _, page in ranked]
+    if page_budget: planned = planned[:page_budget]
+    print(f"    - Crawl plan: {len(planned)} of {len(pages)} pages ({len(ranked)} due).")
+    return planned
+
+def record_visits(visits, now=None):
+    """
+    Updates the frontier after a crawl. visits: {page_url: (agency_id, changed)}.
+    A changed page is revisited sooner next time; an unchanged one later.
+    """
+    if not visits: return
+    now = now or datetime.now()
+    conn = database.get_db_connection()
+    if not conn: return
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT page_url, revisit_interval_hours, change_count, visit_count FROM crawl_frontier")
+        frontier = {url: (interval, changes, count) for url, interval, changes, count in cur.fetchall()}
+        rows = []
+        for page_url, (agency_id, changed) in visits.items():
+            interval, changes, count = frontier.get(page_url, (None, 0, 0))
+            if interval is None:
+                interval = INITIAL_REVISIT_HOURS
+            else:
+                interval *= CHANGED_FACTOR if changed else UNCHANGED_FACTOR
+            interval = min(MAX_REVISIT_HOURS, max(MIN_REVISIT_HOURS, interval))
+            next_due = now + timedelta(hours=interval)
+            last_changed = now if changed else None
+            rows.append((page_url, agency_id, interval, now, last_changed, next_due, changes + int(changed), count + 1))
+
+        p_style = database.get_param_style()
+        columns = "page_url, agency_id, revisit_interval_hours, last_crawled_at, last_changed_at, next_due_at, change_count, visit_count"
+        values = ', '.join(p_style for _ in range(8))
+        if database.get_db_type() == 'postgres':
+            sql = (f"INSERT INTO crawl_frontier ({columns}) VALUES ({values}) ON CONFLICT (page_url) DO UPDATE SET "
+                   "agency_id = EXCLUDED.agency_id, revisit_interval_hours = EXCLUDED.revisit_interval_hours, last_crawled_at = EXCLUDED.last_crawled_at, "
+                   "last_changed_at = COALESCE(EXCLUDED.last_changed_at, crawl_frontier.last_changed_at), next_due_at = EXCLUDED.next_due_at, "
+                   "change_count = EXCLUDED.change_count, visit_count = EXCLUDED.visit_count")
+        else:
+            sql = (f"INSERT INTO crawl_frontier ({columns}) VALUES ({values}) ON CONFLICT (page_url) DO UPDATE SET "
+                   "agency_id = excluded.agency_id, revisit_interval_hours = excluded.revisit_interval_hours, last_crawled_at = excluded.last_crawled_at, "
+                   "last_changed_at = COALESCE(excluded.last_changed_at, crawl_frontier.last_changed_at), next_due_at = excluded.next_due_at, "
+                   "change_count = excluded.change_count, visit_count = excluded.visit_count")
+            rows = [tuple(v.isoformat(sep=' ') if isinstance(v, datetime) else v for v in row) for row in rows]
+        cur.executemany(sql, rows)
+        conn.commit()
+    finally:
+        conn.close()
+
+def pick_news_agencies(cur, limit=20):
+    """
+    Samples agencies for the news harvest, weighted by predicted 12-month probability
+    (weighted sampling without replacement), instead of a uniform random pick.
+    """
+    cur.execute("SELECT agency_id, name FROM agencies")
+    agencies = cur.fetchall()
+    scores = load_prediction_scores(cur)
+    keyed = [(random.random() ** (1.0 / (NEWS_BASE_WEIGHT + scores.get(agency_id, 0.0))), (agency_id, name)) for agency_id, name in agencies]
+    keyed.sort(key=lambda item: item[0], reverse=True)
+    return [agency for _, agency in keyed[:limit]]
@@ -39,3 +39,29 @@ def get_param_style():
 def get_on_conflict_clause():
     """Returns the appropriate ON CONFLICT clause for the current DB type."""
     return 'ON CONFLICT DO NOTHING' if DB_TYPE == 'postgres' else 'OR IGNORE'
+
+def bulk_insert(cur, table, columns, rows, ignore_conflicts=False, page_size=1000, on_conflict=None):
+    """
+    Inserts many rows in as few round trips as the driver allows: execute_values
+    on PostgreSQL, executemany on SQLite. With ignore_conflicts, rows violating a
+    unique constraint are skipped. on_conflict is an upsert clause written in the
+    syntax both databases share, e.g. "ON CONFLICT (key) DO UPDATE SET n = excluded.n".
+    Returns the number of rows inserted or updated, not counting skipped ones.
+    """
+    if not rows: return 0
+    column_list = ', '.join(columns)
+    if DB_TYPE == 'postgres':
+        from psycopg2.extras import execute_values
+        conflict = f" {on_conflict}" if on_conflict else " ON CONFLICT DO NOTHING" if ignore_conflicts else ""
+        # execute_values only reports the rowcount of its last page, so page here instead.
+        written = 0
+        for start in range(0, len(rows), page_size):
+            execute_values(cur, f"INSERT INTO {table} ({column_list}) VALUES %s{conflict}", rows[start:start + page_size], page_size=page_size)
+            written += cur.rowcount
+        return written
+    else:
+        placeholders = ', '.join('?' for _ in columns)
+        verb = "INSERT OR IGNORE" if ignore_conflicts and not on_conflict else "INSERT"
+        conflict = f" {on_conflict}" if on_conflict else ""
+        cur.executemany(f"{verb} INTO {table} ({column_list}) VALUES ({placeholders}){conflict}", rows)
+        return cur.rowcount
@@ -4,7 +4,7 @@ import random
 import json
 import pandas as pd
 from faker import Faker
-from app import database
+from app import database, dedupe, feature_store
 
 def create_enhanced_tables():
     """Creates the full database schema for the configured DB_TYPE."""
@@ -18,32 +18,113 @@ def create_enhanced_tables():
         commands = [
             "DO $$ BEGIN CREATE TYPE validation_status AS ENUM ('unverified', 'correct', 'incorrect'); EXCEPTION WHEN duplicate_object THEN null; END $$;",
             "CREATE TABLE IF NOT EXISTS agencies ( agency_id SERIAL PRIMARY KEY, name VARCHAR(255) NOT NULL, state VARCHAR(100), agency_type VARCHAR(100), procurement_url TEXT, planning_url TEXT, minutes_url TEXT, latitude FLOAT, longitude FLOAT );",
-            "CREATE TABLE IF NOT EXISTS documents ( document_id SERIAL PRIMARY KEY, agency_id INTEGER REFERENCES agencies(agency_id), document_type VARCHAR(50), url TEXT, local_path VARCHAR(255), scraped_date TIMESTAMP, publication_date DATE, raw_text TEXT );",
+            "CREATE TABLE IF NOT EXISTS documents ( document_id SERIAL PRIMARY KEY, agency_id INTEGER REFERENCES agencies(agency_id), document_type VARCHAR(50), url TEXT, local_path VARCHAR(255), scraped_date TIMESTAMP, publication_date DATE, raw_text TEXT, canonical_document_id INTEGER REFERENCES documents(document_id) );",
             "CREATE TABLE IF NOT EXISTS extracted_entities ( entity_id SERIAL PRIMARY KEY, source_id INTEGER, source_type VARCHAR(50), entity_text TEXT, entity_label VARCHAR(100), context_sentence TEXT, validation_status validation_status NOT NULL DEFAULT 'unverified' );",
             "CREATE TABLE IF NOT EXISTS news_articles ( article_id SERIAL PRIMARY KEY, agency_id INTEGER REFERENCES agencies(agency_id) ON DELETE CASCADE, article_url TEXT UNIQUE NOT NULL, title TEXT, source_name VARCHAR(255), published_date TIMESTAMP WITH TIME ZONE, content TEXT );",
-            "CREATE TABLE IF NOT EXISTS predictions ( prediction_id SERIAL PRIMARY KEY, agency_id INTEGER REFERENCES agencies(agency_id), prediction_date DATE, prob_6_months FLOAT, prob_12_months FLOAT, supporting_evidence JSONB );",
+            "CREATE TABLE IF NOT EXISTS prediction_runs ( run_id SERIAL PRIMARY KEY, created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP, model_version TEXT, agency_count INTEGER );",
+            "CREATE TABLE IF NOT EXISTS predictions ( prediction_id SERIAL PRIMARY KEY, agency_id INTEGER REFERENCES agencies(agency_id), prediction_date DATE, prob_6_months FLOAT, prob_12_months FLOAT, supporting_evidence JSONB, run_id INTEGER REFERENCES prediction_runs(run_id) ON DELETE CASCADE );",
+            "CREATE TABLE IF NOT EXISTS current_prediction_run ( singleton INTEGER PRIMARY KEY CHECK (singleton = 1), run_id INTEGER NOT NULL REFERENCES prediction_runs(run_id) );",
             "CREATE TABLE IF NOT EXISTS governmental_structures ( structure_id SERIAL PRIMARY KEY, name VARCHAR(255) UNIQUE NOT NULL, description TEXT, influence_weight FLOAT NOT NULL DEFAULT 0.5 );",
             "CREATE TABLE IF NOT EXISTS agency_relationships ( relationship_id SERIAL PRIMARY KEY, parent_agency_id INTEGER NOT NULL REFERENCES agencies(agency_id) ON DELETE CASCADE, child_agency_id INTEGER NOT NULL REFERENCES agencies(agency_id) ON DELETE CASCADE, structure_id INTEGER NOT NULL REFERENCES governmental_structures(structure_id) ON DELETE CASCADE, UNIQUE(parent_agency_id, child_agency_id, structure_id) );",
             "CREATE TABLE IF NOT EXISTS historical_solicitations ( solicitation_id SERIAL PRIMARY KEY, agency_id INTEGER REFERENCES agencies(agency_id), release_date DATE NOT NULL, title TEXT, url TEXT UNIQUE, keywords TEXT[] );",
             "CREATE TABLE IF NOT EXISTS backtest_results ( result_id SERIAL PRIMARY KEY, simulation_date DATE NOT NULL, agency_id INTEGER REFERENCES agencies(agency_id), predicted_prob_12m FLOAT, actual_outcome_12m BOOLEAN, time_to_event_days INTEGER, UNIQUE(simulation_date, agency_id) );",
             "CREATE TABLE IF NOT EXISTS quality_review_cases ( case_id SERIAL PRIMARY KEY, entity_id INTEGER NOT NULL REFERENCES extracted_entities(entity_id) ON DELETE CASCADE, reason_for_review TEXT, created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP, UNIQUE(entity_id) );",
-            "CREATE TABLE IF NOT EXISTS agency_context_briefs ( agency_id INT PRIMARY KEY REFERENCES agencies(agency_id) ON DELETE CASCADE, brief_markdown TEXT, last_updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP );"
+            "CREATE TABLE IF NOT EXISTS agency_context_briefs ( agency_id INT PRIMARY KEY REFERENCES agencies(agency_id) ON DELETE CASCADE, brief_markdown TEXT, last_updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP );",
+            "CREATE TABLE IF NOT EXISTS page_render_modes ( page_url TEXT PRIMARY KEY, agency_id INTEGER REFERENCES agencies(agency_id) ON DELETE CASCADE, render_mode VARCHAR(20) NOT NULL, updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP );",
+            "CREATE TABLE IF NOT EXISTS http_fetch_cache ( url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, content_hash CHAR(64), processed BOOLEAN NOT NULL DEFAULT TRUE, fetched_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP );",
+            "CREATE TABLE IF NOT EXISTS agency_aliases ( alias TEXT PRIMARY KEY, agency_id INTEGER NOT NULL REFERENCES agencies(agency_id) ON DELETE CASCADE );",
+            "CREATE TABLE IF NOT EXISTS sam_backfill_checkpoints ( target_year INTEGER NOT NULL, ncode VARCHAR(10) NOT NULL, next_offset INTEGER NOT NULL DEFAULT 0, completed BOOLEAN NOT NULL DEFAULT FALSE, updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP, PRIMARY KEY(target_year, ncode) );",
+            "CREATE TABLE IF NOT EXISTS ai_link_cache ( page_hash CHAR(64) PRIMARY KEY, document_urls TEXT NOT NULL, created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP );",
+            "CREATE TABLE IF NOT EXISTS document_nlp_state ( document_id INTEGER PRIMARY KEY REFERENCES documents(document_id) ON DELETE CASCADE, nlp_version INTEGER NOT NULL, entity_count INTEGER NOT NULL DEFAULT 0, processed_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP );",
+            "CREATE TABLE IF NOT EXISTS document_fingerprints ( document_id INTEGER PRIMARY KEY REFERENCES documents(document_id) ON DELETE CASCADE, signature BYTEA NOT NULL );",
+            "CREATE TABLE IF NOT EXISTS document_lsh_bands ( bucket TEXT NOT NULL, document_id INTEGER NOT NULL REFERENCES documents(document_id) ON DELETE CASCADE );",
+            "CREATE TABLE IF NOT EXISTS llm_response_cache ( prompt_hash CHAR(64) PRIMARY KEY, model VARCHAR(100), response TEXT NOT NULL, created_at DOUBLE PRECISION NOT NULL, last_used_at DOUBLE PRECISION NOT NULL );",
+            "CREATE TABLE IF NOT EXISTS llm_call_log ( call_id SERIAL PRIMARY KEY, called_at DOUBLE PRECISION NOT NULL, purpose VARCHAR(50), model VARCHAR(100), latency_ms DOUBLE PRECISION, ttft_ms DOUBLE PRECISION, prompt_tokens INTEGER, completion_tokens INTEGER, cache_hit INTEGER NOT NULL DEFAULT 0, cancelled INTEGER NOT NULL DEFAULT 0, error TEXT );",
+            "CREATE TABLE IF NOT EXISTS agency_signal_counts ( agency_id INTEGER NOT NULL REFERENCES agencies(agency_id) ON DELETE CASCADE, signal_date DATE NOT NULL, feature VARCHAR(100) NOT NULL, signal_count INTEGER NOT NULL, PRIMARY KEY(agency_id, signal_date, feature) );",
+            "CREATE TABLE IF NOT EXISTS feature_store_ledger ( entity_id INTEGER NOT NULL, feature VARCHAR(100) NOT NULL, agency_id INTEGER NOT NULL, signal_date DATE NOT NULL, document_id INTEGER, PRIMARY KEY(entity_id, feature) );",
+            "CREATE TABLE IF NOT EXISTS rollup_operators ( edge_hash CHAR(40) PRIMARY KEY, operator BYTEA NOT NULL, created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP );",
+            "CREATE TABLE IF NOT EXISTS crawl_frontier ( page_url TEXT PRIMARY KEY, agency_id INTEGER REFERENCES agencies(agency_id) ON DELETE CASCADE, revisit_interval_hours FLOAT NOT NULL, last_crawled_at TIMESTAMP, last_changed_at TIMESTAMP, next_due_at TIMESTAMP, change_count INTEGER NOT NULL DEFAULT 0, visit_count INTEGER NOT NULL DEFAULT 0 );"
         ]
     else: # SQLite
         commands = [
             "CREATE TABLE IF NOT EXISTS agencies ( agency_id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, state TEXT, agency_type TEXT, procurement_url TEXT, planning_url TEXT, minutes_url TEXT, latitude REAL, longitude REAL );",
-            "CREATE TABLE IF NOT EXISTS documents ( document_id INTEGER PRIMARY KEY AUTOINCREMENT, agency_id INTEGER, raw_text TEXT, document_type TEXT, url TEXT, local_path TEXT, scraped_date TEXT, publication_date TEXT, FOREIGN KEY(agency_id) REFERENCES agencies(agency_id) );",
+            "CREATE TABLE IF NOT EXISTS documents ( document_id INTEGER PRIMARY KEY AUTOINCREMENT, agency_id INTEGER, raw_text TEXT, document_type TEXT, url TEXT, local_path TEXT, scraped_date TEXT, publication_date TEXT, canonical_document_id INTEGER, FOREIGN KEY(agency_id) REFERENCES agencies(agency_id), FOREIGN KEY(canonical_document_id) REFERENCES documents(document_id) );",
             "CREATE TABLE IF NOT EXISTS extracted_entities ( entity_id INTEGER PRIMARY KEY AUTOINCREMENT, source_id INTEGER, source_type TEXT, entity_text TEXT, entity_label TEXT, context_sentence TEXT, validation_status TEXT NOT NULL DEFAULT 'unverified' );",
             "CREATE TABLE IF NOT EXISTS news_articles ( article_id INTEGER PRIMARY KEY AUTOINCREMENT, agency_id INTEGER, article_url TEXT UNIQUE NOT NULL, title TEXT, source_name TEXT, published_date TEXT, content TEXT, FOREIGN KEY(agency_id) REFERENCES agencies(agency_id) ON DELETE CASCADE );",
-            "CREATE TABLE IF NOT EXISTS predictions ( prediction_id INTEGER PRIMARY KEY AUTOINCREMENT, agency_id INTEGER, prediction_date TEXT, prob_6_months REAL, prob_12_months REAL, supporting_evidence TEXT, FOREIGN KEY(agency_id) REFERENCES agencies(agency_id) );",
+            "CREATE TABLE IF NOT EXISTS prediction_runs ( run_id INTEGER PRIMARY KEY AUTOINCREMENT, created_at TEXT DEFAULT (datetime('now')), model_version TEXT, agency_count INTEGER );",
+            "CREATE TABLE IF NOT EXISTS predictions ( prediction_id INTEGER PRIMARY KEY AUTOINCREMENT, agency_id INTEGER, prediction_date TEXT, prob_6_months REAL, prob_12_months REAL, supporting_evidence TEXT, run_id INTEGER, FOREIGN KEY(agency_id) REFERENCES agencies(agency_id), FOREIGN KEY(run_id) REFERENCES prediction_runs(run_id) ON DELETE CASCADE );",
+            "CREATE TABLE IF NOT EXISTS current_prediction_run ( singleton INTEGER PRIMARY KEY CHECK (singleton = 1), run_id INTEGER NOT NULL, FOREIGN KEY(run_id) REFERENCES prediction_runs(run_id) );",
             "CREATE TABLE IF NOT EXISTS governmental_structures ( structure_id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT UNIQUE NOT NULL, description TEXT, influence_weight REAL NOT NULL DEFAULT 0.5 );",
             "CREATE TABLE IF NOT EXISTS agency_relationships ( relationship_id INTEGER PRIMARY KEY AUTOINCREMENT, parent_agency_id INTEGER NOT NULL, child_agency_id INTEGER NOT NULL, structure_id INTEGER NOT NULL, FOREIGN KEY(parent_agency_id) REFERENCES agencies(agency_id) ON DELETE CASCADE, FOREIGN KEY(child_agency_id) REFERENCES agencies(agency_id) ON DELETE CASCADE, FOREIGN KEY(structure_id) REFERENCES governmental_structures(structure_id) ON DELETE CASCADE, UNIQUE(parent_agency_id, child_agency_id, structure_id) );",
             "CREATE TABLE IF NOT EXISTS historical_solicitations ( solicitation_id INTEGER PRIMARY KEY AUTOINCREMENT, agency_id INTEGER, release_date TEXT NOT NULL, title TEXT, url TEXT UNIQUE, keywords TEXT, FOREIGN KEY(agency_id) REFERENCES agencies(agency_id) );",
             "CREATE TABLE IF NOT EXISTS backtest_results ( result_id INTEGER PRIMARY KEY AUTOINCREMENT, simulation_date TEXT NOT NULL, agency_id INTEGER, predicted_prob_12m REAL, actual_outcome_12m INTEGER, time_to_event_days INTEGER, UNIQUE(simulation_date, agency_id), FOREIGN KEY(agency_id) REFERENCES agencies(agency_id) );",
             "CREATE TABLE IF NOT EXISTS quality_review_cases ( case_id INTEGER PRIMARY KEY AUTOINCREMENT, entity_id INTEGER NOT NULL, reason_for_review TEXT, created_at TEXT DEFAULT (datetime('now')), UNIQUE(entity_id), FOREIGN KEY(entity_id) REFERENCES extracted_entities(entity_id) ON DELETE CASCADE );",
-            "CREATE TABLE IF NOT EXISTS agency_context_briefs ( agency_id INTEGER PRIMARY KEY, brief_markdown TEXT, last_updated_at TEXT DEFAULT (datetime('now')), FOREIGN KEY(agency_id) REFERENCES agencies(agency_id) ON DELETE CASCADE );"
+            "CREATE TABLE IF NOT EXISTS agency_context_briefs ( agency_id INTEGER PRIMARY KEY, brief_markdown TEXT, last_updated_at TEXT DEFAULT (datetime('now')), FOREIGN KEY(agency_id) REFERENCES agencies(agency_id) ON DELETE CASCADE );",
+            "CREATE TABLE IF NOT EXISTS page_render_modes ( page_url TEXT PRIMARY KEY, agency_id INTEGER, render_mode TEXT NOT NULL, updated_at TEXT DEFAULT (datetime('now')), FOREIGN KEY(agency_id) REFERENCES agencies(agency_id) ON DELETE CASCADE );",
+            "CREATE TABLE IF NOT EXISTS http_fetch_cache ( url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, content_hash TEXT, processed INTEGER NOT NULL DEFAULT 1, fetched_at TEXT DEFAULT (datetime('now')) );",
+            "CREATE TABLE IF NOT EXISTS agency_aliases ( alias TEXT PRIMARY KEY, agency_id INTEGER NOT NULL, FOREIGN KEY(agency_id) REFERENCES agencies(agency_id) ON DELETE CASCADE );",
+            "CREATE TABLE IF NOT EXISTS sam_backfill_checkpoints ( target_year INTEGER NOT NULL, ncode TEXT NOT NULL, next_offset INTEGER NOT NULL DEFAULT 0, completed INTEGER NOT NULL DEFAULT 0, updated_at TEXT DEFAULT (datetime('now')), PRIMARY KEY(target_year, ncode) );",
+            "CREATE TABLE IF NOT EXISTS ai_link_cache ( page_hash TEXT PRIMARY KEY, document_urls TEXT NOT NULL, created_at TEXT DEFAULT (datetime('now')) );",
+            "CREATE TABLE IF NOT EXISTS document_nlp_state ( document_id INTEGER PRIMARY KEY, nlp_version INTEGER NOT NULL, entity_count INTEGER NOT NULL DEFAULT 0, processed_at TEXT DEFAULT (datetime('now')), FOREIGN KEY(document_id) REFERENCES documents(document_id) ON DELETE CASCADE );",
+            "CREATE TABLE IF NOT EXISTS document_fingerprints ( document_id INTEGER PRIMARY KEY, signature BLOB NOT NULL, FOREIGN KEY(document_id) REFERENCES documents(document_id) ON DELETE CASCADE );",
+            "CREATE TABLE IF NOT EXISTS document_lsh_bands ( bucket TEXT NOT NULL, document_id INTEGER NOT NULL, FOREIGN KEY(document_id) REFERENCES documents(document_id) ON DELETE CASCADE );",
+            "CREATE TABLE IF NOT EXISTS llm_response_cache ( prompt_hash TEXT PRIMARY KEY, model TEXT, response TEXT NOT NULL, created_at REAL NOT NULL, last_used_at REAL NOT NULL );",
+            "CREATE TABLE IF NOT EXISTS llm_call_log ( call_id INTEGER PRIMARY KEY AUTOINCREMENT, called_at REAL NOT NULL, purpose TEXT, model TEXT, latency_ms REAL, ttft_ms REAL, prompt_tokens INTEGER, completion_tokens INTEGER, cache_hit INTEGER NOT NULL DEFAULT 0, cancelled INTEGER NOT NULL DEFAULT 0, error TEXT );",
+            "CREATE TABLE IF NOT EXISTS agency_signal_counts ( agency_id INTEGER NOT NULL, signal_date TEXT NOT NULL, feature TEXT NOT NULL, signal_count INTEGER NOT NULL, PRIMARY KEY(agency_id, signal_date, feature), FOREIGN KEY(agency_id) REFERENCES agencies(agency_id) ON DELETE CASCADE );",
+            "CREATE TABLE IF NOT EXISTS feature_store_ledger ( entity_id INTEGER NOT NULL, feature TEXT NOT NULL, agency_id INTEGER NOT NULL, signal_date TEXT NOT NULL, document_id INTEGER, PRIMARY KEY(entity_id, feature) );",
+            "CREATE TABLE IF NOT EXISTS rollup_operators ( edge_hash TEXT PRIMARY KEY, operator BLOB NOT NULL, created_at TEXT DEFAULT (datetime('now')) );",
+            "CREATE TABLE IF NOT EXISTS crawl_frontier ( page_url TEXT PRIMARY KEY, agency_id INTEGER, revisit_interval_hours REAL NOT NULL, last_crawled_at TEXT, last_changed_at TEXT, next_due_at TEXT, change_count INTEGER NOT NULL DEFAULT 0, visit_count INTEGER NOT NULL DEFAULT 0, FOREIGN KEY(agency_id) REFERENCES agencies(agency_id) ON DELETE CASCADE );"
         ]
 
+    # Columns added after their table was first created, for databases set up before them.
+    commands += add_column_commands(cur, db_type, 'documents', 'canonical_document_id', "INTEGER REFERENCES documents(document_id)")
+    commands += add_column_commands(cur, db_type, 'llm_call_log', 'ttft_ms', "DOUBLE PRECISION" if db_type == 'postgres' else "REAL")
+    commands += add_column_commands(cur, db_type, 'llm_call_log', 'cancelled', "INTEGER NOT NULL DEFAULT 0")
+    commands += add_column_commands(cur, db_type, 'predictions', 'run_id', "INTEGER REFERENCES prediction_runs(run_id) ON DELETE CASCADE")
+    commands += add_column_commands(cur, db_type, 'feature_store_ledger', 'document_id', "INTEGER")
+    commands += add_column_commands(cur, db_type, 'http_fetch_cache', 'processed', "BOOLEAN NOT NULL DEFAULT TRUE" if db_type == 'postgres' else "INTEGER NOT NULL DEFAULT 1")
+    commands.append("CREATE INDEX IF NOT EXISTS idx_documents_canonical ON documents (canonical_document_id);")
+    commands.append("CREATE INDEX IF NOT EXISTS idx_lsh_bands_bucket ON document_lsh_bands (bucket);")
+    commands.append("CREATE INDEX IF NOT EXISTS idx_llm_cache_last_used ON llm_response_cache (last_used_at);")
+
+    # Enforce one row per document URL. Duplicates left behind by earlier runs are
+    # removed first (along with their entities), keeping the oldest copy.
+    if db_type == 'postgres':
+        commands += [
+            "DELETE FROM extracted_entities ee USING documents a, documents b WHERE ee.source_type = 'document' AND ee.source_id = a.document_id AND a.url = b.url AND a.document_id > b.document_id;",
+            "DELETE FROM documents a USING documents b WHERE a.url = b.url AND a.document_id > b.document_id;",
+        ]
+    else:
+        duplicate_ids = "SELECT document_id FROM documents WHERE url IS NOT NULL AND document_id NOT IN (SELECT MIN(document_id) FROM documents WHERE url IS NOT NULL GROUP BY url)"
+        commands += [
+            f"DELETE FROM extracted_entities WHERE source_type = 'document' AND source_id IN ({duplicate_ids});",
+            f"DELETE FROM documents WHERE document_id IN ({duplicate_ids});",
+        ]
+    commands.append("CREATE UNIQUE INDEX IF NOT EXISTS idx_documents_url ON documents (url);")
+    commands.append("CREATE INDEX IF NOT EXISTS idx_entities_source ON extracted_entities (source_type, source_id);")
+    commands.append("CREATE INDEX IF NOT EXISTS idx_document_nlp_state_version ON document_nlp_state (nlp_version);")
+    commands.append("CREATE INDEX IF NOT EXISTS idx_entities_validation ON extracted_entities (validation_status);")
+    commands.append("CREATE INDEX IF NOT EXISTS idx_agency_signal_counts_date ON agency_signal_counts (signal_date);")
+    commands.append("CREATE INDEX IF NOT EXISTS idx_feature_store_ledger_document ON feature_store_ledger (document_id);")
+    commands.append("UPDATE feature_store_ledger SET document_id = (SELECT e.source_id FROM extracted_entities e WHERE e.entity_id = feature_store_ledger.entity_id) WHERE document_id IS NULL;")
+    # Documents that already have entities were processed before document_nlp_state existed;
+    # record them as NLP version 1 so they aren't triaged (and their entities duplicated) again.
+    on_conflict = "ON CONFLICT (document_id) DO NOTHING" if db_type == 'postgres' else ""
+    or_ignore = "" if db_type == 'postgres' else "OR IGNORE"
+    commands.append(f"INSERT {or_ignore} INTO document_nlp_state (document_id, nlp_version, entity_count) SELECT source_id, 1, COUNT(*) FROM extracted_entities WHERE source_type = 'document' AND source_id IN (SELECT document_id FROM documents) GROUP BY source_id {on_conflict};")
+
+    # Readers only ever see the run current_prediction_run points at; a new run becomes
+    # visible in one commit. Predictions written before runs existed become run 0.
+    commands.append("CREATE INDEX IF NOT EXISTS idx_predictions_run ON predictions (run_id, agency_id);")
+    commands += [
+        "INSERT INTO prediction_runs (run_id, model_version, agency_count) SELECT 0, 'legacy', (SELECT COUNT(*) FROM predictions WHERE run_id IS NULL) WHERE EXISTS (SELECT 1 FROM predictions WHERE run_id IS NULL) AND NOT EXISTS (SELECT 1 FROM prediction_runs WHERE run_id = 0);",
+        "UPDATE predictions SET run_id = 0 WHERE run_id IS NULL AND EXISTS (SELECT 1 FROM prediction_runs WHERE run_id = 0);",
+        "INSERT INTO current_prediction_run (singleton, run_id) SELECT 1, 0 WHERE EXISTS (SELECT 1 FROM prediction_runs WHERE run_id = 0) AND NOT EXISTS (SELECT 1 FROM current_prediction_run);",
+        f"{'CREATE OR REPLACE VIEW' if db_type == 'postgres' else 'CREATE VIEW IF NOT EXISTS'} current_predictions AS SELECT p.prediction_id, p.agency_id, p.prediction_date, p.prob_6_months, p.prob_12_months, p.supporting_evidence, p.run_id FROM predictions p JOIN current_prediction_run c ON p.run_id = c.run_id;",
+    ]
+
+    commands += full_text_search_commands(cur, db_type)
+
     for command in commands:
         cur.execute(command)
 
@@ -51,6 +132,52 @@ def create_enhanced_tables():
     conn.close()
     print(f"  - All tables created successfully for {db_type}.")
 
+def add_column_commands(cur, db_type, table, column, definition):
+    """Returns the ALTER TABLE needed to add a column to an existing table, if any."""
+    if db_type == 'postgres':
+        return [f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {column} {definition};"]
+    cur.execute(f"PRAGMA table_info({table})")
+    existing_columns = [row[1] for row in cur.fetchall()]
+    # A table that doesn't exist yet is created with the column.
+    if existing_columns and column not in existing_columns:
+        return [f"ALTER TABLE {table} ADD COLUMN {column} {definition};"]
+    return []
+
+# (index name, table, key column, indexed columns, PostgreSQL tsvector expression)
+FULL_TEXT_INDEXES = [
+    # tsvector values are capped at 1 MB, so very long documents are indexed on their first 500k characters.
+    ('documents_fts', 'documents', 'document_id', ('raw_text',), "to_tsvector('english', left(coalesce(raw_text, ''), 500000))"),
+    ('entities_fts', 'extracted_entities', 'entity_id', ('entity_text', 'context_sentence'), "to_tsvector('english', coalesce(entity_text, '') || ' ' || coalesce(context_sentence, ''))"),
+    ('news_fts', 'news_articles', 'article_id', ('title', 'content'), "setweight(to_tsvector('english', coalesce(title, '')), 'A') || setweight(to_tsvector('english', left(coalesce(content, ''), 500000)), 'B')"),
+]
+
+def full_text_search_commands(cur, db_type):
+    """
+    Full-text indexes used by app.search. PostgreSQL gets a generated tsvector column
+    with a GIN index per table; SQLite gets an external-content FTS5 table kept in
+    sync by triggers, populated from existing rows when first created.
+    """
+    commands = []
+    for fts_table, table, key, columns, tsvector in FULL_TEXT_INDEXES:
+        if db_type == 'postgres':
+            commands.append(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS ({tsvector}) STORED;")
+            commands.append(f"CREATE INDEX IF NOT EXISTS idx_{table}_search ON {table} USING GIN (search_vector);")
+            continue
+        cur.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (fts_table,))
+        exists = cur.fetchone() is not None
+        column_list = ', '.join(columns)
+        new_values = ', '.join(f"new.{column}" for column in columns)
+        old_values = ', '.join(f"old.{column}" for column in columns)
+        commands += [
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts_table} USING fts5({column_list}, content='{table}', content_rowid='{key}', tokenize='porter unicode61');",
+            f"CREATE TRIGGER IF NOT EXISTS {fts_table}_insert AFTER INSERT ON {table} BEGIN INSERT INTO {fts_table} (rowid, {column_list}) VALUES (new.{key}, {new_values}); END;",
+            f"CREATE TRIGGER IF NOT EXISTS {fts_table}_delete AFTER DELETE ON {table} BEGIN INSERT INTO {fts_table} ({fts_table}, rowid, {column_list}) VALUES ('delete', old.{key}, {old_values}); END;",
+            f"CREATE TRIGGER IF NOT EXISTS {fts_table}_update AFTER UPDATE OF {column_list} ON {table} BEGIN INSERT INTO {fts_table} ({fts_table}, rowid, {column_list}) VALUES ('delete', old.{key}, {old_values}); INSERT INTO {fts_table} (rowid, {column_list}) VALUES (new.{key}, {new_values}); END;",
+        ]
+        if not exists:
+            commands.append(f"INSERT INTO {fts_table} ({fts_table}) VALUES ('rebuild');")
+    return commands
+
 def seed_agencies():
     conn = database.get_db_connection()
     if not conn: return
@@ -121,12 +248,15 @@ def generate_mock_data():
     conn = database.get_db_connection()
     if not conn: return
     with conn.cursor() as cur:
-        cur.execute("TRUNCATE predictions, extracted_entities, documents, news_articles RESTART IDENTITY;")
+        cur.execute("TRUNCATE current_prediction_run, predictions, prediction_runs, extracted_entities, documents, news_articles RESTART IDENTITY;")
         cur.execute("SELECT agency_id FROM agencies;")
         agency_ids = [row[0] for row in cur.fetchall()]
+        cur.execute("INSERT INTO prediction_runs (model_version, agency_count) VALUES ('mock', %s) RETURNING run_id;", (len(agency_ids),))
+        run_id = cur.fetchone()[0]
+        cur.execute("INSERT INTO current_prediction_run (singleton, run_id) VALUES (1, %s);", (run_id,))
     for agency_id in agency_ids:
         with conn.cursor() as cur:
-            cur.execute("INSERT INTO predictions (agency_id, prediction_date, prob_12_months) VALUES (%s, NOW(), %s);", (agency_id, random.uniform(0.05, 0.95)))
+            cur.execute("INSERT INTO predictions (agency_id, prediction_date, prob_12_months, run_id) VALUES (%s, NOW(), %s, %s);", (agency_id, random.uniform(0.05, 0.95), run_id))
             cur.execute("INSERT INTO documents (agency_id, document_type, raw_text, scraped_date) VALUES (%s, 'Planning Document', %s, NOW()) RETURNING document_id;", (agency_id, fake.paragraph()))
             doc_id = cur.fetchone()[0]
             cur.execute("INSERT INTO extracted_entities (source_id, source_type, entity_text, entity_label, context_sentence) VALUES (%s, 'document', %s, 'ITS_TECHNOLOGY', %s);", (doc_id, random.choice(['V2X', 'Smart Corridor']), fake.sentence()))
@@ -137,4 +267,7 @@ def generate_mock_data():
 if __name__ == '__main__':
     if len(sys.argv) > 1 and sys.argv[1] == '--setup': initial_setup()
     elif len(sys.argv) > 1 and sys.argv[1] == '--mock': generate_mock_data()
-    else: print("Usage: python -m app.database_setup [--setup | --mock]")
+    elif len(sys.argv) > 1 and sys.argv[1] == '--dedupe': dedupe.fingerprint_existing_documents()
+    elif len(sys.argv) > 1 and sys.argv[1] == '--refresh-features': feature_store.refresh()
+    elif len(sys.argv) > 1 and sys.argv[1] == '--rebuild-features': feature_store.rebuild()
+    else: print("Usage: python -m app.database_setup [--setup | --mock | --dedupe | --refresh-features | --rebuild-features]")
@@ -0,0 +1,163 @@
+import os
+import re
+import zlib
+import hashlib
+import numpy as np
+from app import database, feature_store
+
+# MinHash signatures are split into LSH bands; two documents become candidates when
+# any band matches. With 16 bands of 8 rows the candidate curve rises around a
+# Jaccard similarity of ~0.7, and candidates are then confirmed against DEDUPE_THRESHOLD.
+# Only documents of the same agency are compared: a document another agency republishes
+# is still a signal for the republishing agency.
+NUM_PERMUTATIONS = 128
+LSH_BANDS = 16
+ROWS_PER_BAND = NUM_PERMUTATIONS // LSH_BANDS
+DEDUPE_THRESHOLD = float(os.environ.get('DEDUPE_THRESHOLD', 0.85))
+SHINGLE_WORDS = 5
+MIN_WORDS = 50  # shorter texts are mostly boilerplate and are never treated as duplicates
+HASH_CHUNK = 20000  # shingles hashed per step, bounding the (chunk x permutations) matrix
+
+_MERSENNE_PRIME = np.uint64(4294967291)  # largest prime below 2**32, so hash values fit in uint32
+_rng = np.random.RandomState(1)
+# Fixed seed: signatures are stored, so the permutations must be identical across runs.
+_A = _rng.randint(1, 2 ** 31, size=NUM_PERMUTATIONS).astype(np.uint64)
+_B = _rng.randint(0, 2 ** 31, size=NUM_PERMUTATIONS).astype(np.uint64)
+
+def shingle_hashes(text):
+    """Returns the unique 32-bit hashes of the text's overlapping word 5-grams."""
+    words = re.findall(r"[a-z0-9]+", (text or "").lower())
+    if len(words) < MIN_WORDS: return None
+    shingles = {" ".join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)}
+    return np.fromiter((zlib.crc32(s.encode('utf-8')) for s in shingles), dtype=np.uint64, count=len(shingles))
+
+def minhash_signature(text):
+    """Returns the MinHash signature (uint32 array) of a text, or None when it is too short."""
+    hashes = shingle_hashes(text)
+    if hashes is None: return None
+    signature = np.full(NUM_PERMUTATIONS, np.iinfo(np.uint32).max, dtype=np.uint64)
+    for i in range(0, len(hashes), HASH_CHUNK):
+        chunk = hashes[i:i + HASH_CHUNK, None]
+        np.minimum(signature, ((chunk * _A + _B) % _MERSENNE_PRIME).min(axis=0), out=signature)
+    return signature.astype(np.uint32)
+
+def band_keys(signature):
+    """Returns one bucket key per LSH band, e.g. '3:9f2c...'."""
+    return [f"{band}:{hashlib.blake2b(signature[band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND].tobytes(), digest_size=8).hexdigest()}"
+            for band in range(LSH_BANDS)]
+
+def similarity(signature_a, signature_b):
+    """Estimated Jaccard similarity of two documents from their signatures."""
+    return float(np.mean(signature_a == signature_b))
+
+def to_bytes(signature):
+    return signature.astype('<u4').tobytes()
+
+def from_bytes(data):
+    return np.frombuffer(bytes(data), dtype='<u4')
+
+def find_canonical(cur, signature, agency_id, threshold=DEDUPE_THRESHOLD):
+    """
+    Looks the signature up in the LSH index. Returns the document_id of the most
+    similar canonical document of the same agency at or above the threshold, or None.
+    """
+    keys = band_keys(signature)
+    p_style = database.get_param_style()
+    placeholders = ', '.join(p_style for _ in keys)
+    agency_filter, agency_params = ("d.agency_id IS NULL", []) if agency_id is None else (f"d.agency_id = {p_style}", [agency_id])
+    cur.execute(f"""
+        SELECT f.document_id, f.signature FROM document_fingerprints f
+        JOIN documents d ON d.document_id = f.document_id
+        WHERE f.document_id IN (SELECT DISTINCT document_id FROM document_lsh_bands WHERE bucket IN ({placeholders}))
+        AND {agency_filter}
+        ORDER BY f.document_id
+    """, keys + agency_params)
+    best_id, best_score = None, threshold
+    for document_id, stored in cur.fetchall():
+        score = similarity(signature, from_bytes(stored))
+        if score > best_score or (best_id is None and score == best_score):
+            best_id, best_score = document_id, score
+    return best_id
+
+def index_document(cur, document_id, signature):
+    """Adds a canonical document to the LSH index."""
+    p_style = database.get_param_style()
+    data = to_bytes(signature)
+    if database.get_db_type() == 'postgres':
+        import psycopg2
+        data = psycopg2.Binary(data)
+    cur.execute(f"INSERT INTO document_fingerprints (document_id, signature) VALUES ({p_style}, {p_style})", (document_id, data))
+    database.bulk_insert(cur, 'document_lsh_bands', ('bucket', 'document_id'), [(key, document_id) for key in band_keys(signature)])
+
+def repair_cross_agency_links(conn):
+    """
+    Undoes links that point at another agency's document, made before matching was
+    limited to the same agency. Copies that still have their entities are unlinked and
+    count again; copies that never kept any text are deleted, together with their fetch
+    cache entry, so the next crawl downloads them again. Returns (unlinked, deleted).
+    """
+    cur = conn.cursor()
+    is_distinct = "IS DISTINCT FROM" if database.get_db_type() == 'postgres' else "IS NOT"
+    cur.execute(f"""
+        SELECT d.document_id, d.url, EXISTS (
+            SELECT 1 FROM extracted_entities e WHERE e.source_type = 'document' AND e.source_id = d.document_id
+        ) FROM documents d JOIN documents c ON c.document_id = d.canonical_document_id
+        WHERE c.agency_id {is_distinct} d.agency_id
+    """)
+    links = cur.fetchall()
+    if not links: return 0, 0
+    p_style = database.get_param_style()
+    unlinked = [document_id for document_id, _, has_entities in links if has_entities]
+    deleted = [(document_id, url) for document_id, url, has_entities in links if not has_entities]
+    cur.executemany(f"UPDATE documents SET canonical_document_id = NULL WHERE document_id = {p_style}", [(document_id,) for document_id in unlinked])
+    cur.executemany(f"DELETE FROM http_fetch_cache WHERE url = {p_style}", [(url,) for _, url in deleted])
+    cur.executemany(f"DELETE FROM documents WHERE document_id = {p_style}", [(document_id,) for document_id, _ in deleted])
+    conn.commit()
+    feature_store.refresh(conn, unlinked)
+    return len(unlinked), len(deleted)
+
+def fingerprint_existing_documents(batch_size=200):
+    """
+    One-off backfill: fingerprints stored documents that are not in the index yet, in
+    document_id order, so the oldest copy of each near-duplicate group stays canonical.
+    Later copies are linked to it and their raw_text is dropped.
+    """
+    print("--- Fingerprinting stored documents for near-duplicate detection ---")
+    conn = database.get_db_connection()
+    if not conn: return
+    p_style = database.get_param_style()
+    indexed = linked = 0
+    try:
+        unlinked, deleted = repair_cross_agency_links(conn)
+        if unlinked or deleted:
+            print(f"  - Undid {unlinked + deleted} links to other agencies' documents ({deleted} copies without text will be downloaded again).")
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT d.document_id FROM documents d
+            LEFT JOIN document_fingerprints f ON f.document_id = d.document_id
+            WHERE f.document_id IS NULL AND d.canonical_document_id IS NULL AND d.raw_text IS NOT NULL
+            ORDER BY d.document_id
+        """)
+        pending_ids = [row[0] for row in cur.fetchall()]
+        for i in range(0, len(pending_ids), batch_size):
+            batch = pending_ids[i:i + batch_size]
+            placeholders = ', '.join(p_style for _ in batch)
+            cur.execute(f"SELECT document_id, agency_id, raw_text FROM documents WHERE document_id IN ({placeholders}) ORDER BY document_id", batch)
+            linked_ids = []
+            for document_id, agency_id, text in cur.fetchall():
+                signature = minhash_signature(text)
+                if signature is None: continue
+                canonical_id = find_canonical(cur, signature, agency_id)
+                if canonical_id is None:
+                    index_document(cur, document_id, signature)
+                    indexed += 1
+                else:
+                    cur.execute(f"UPDATE documents SET canonical_document_id = {p_style}, raw_text = NULL WHERE document_id = {p_style}", (canonical_id, document_id))
+                    linked_ids.append(document_id)
+            conn.commit()
+            # A linked copy's mentions no longer count towards its agency's signals.
+            feature_store.refresh(conn, linked_ids)
+            linked += len(linked_ids)
+    finally:
+        conn.close()
+    print(f"--- Indexed {indexed} documents; linked {linked} near-duplicates to their canonical copy. ---")
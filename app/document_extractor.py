@@ -0,0 +1,187 @@
+import os
+import time
+import signal
+import tempfile
+import threading
+import multiprocessing
+
+# Limits that keep one pathological document from stalling or exhausting a worker.
+MAX_DOCUMENT_BYTES = int(os.environ.get('EXTRACTION_MAX_BYTES', 100 * 1024 * 1024))
+MAX_PDF_PAGES = int(os.environ.get('EXTRACTION_MAX_PAGES', 500))
+EXTRACTION_TIMEOUT_SECONDS = int(os.environ.get('EXTRACTION_TIMEOUT', 120))
+EXTRACTION_MEMORY_LIMIT_MB = int(os.environ.get('EXTRACTION_MEMORY_LIMIT_MB', 1024))
+EXTRACTION_WORKERS = int(os.environ.get('EXTRACTION_WORKERS', max(1, (os.cpu_count() or 2) - 1)))
+TASKS_PER_WORKER = 50  # workers are replaced periodically to return fragmented memory
+STREAM_CHUNK_BYTES = 64 * 1024
+
+CONTENT_TYPES = {
+    'application/pdf': 'pdf',
+    'application/vnd.openxmlformats-officedocument.wordprocessingml.document': 'docx',
+    'application/vnd.openxmlformats-officedocument.presentationml.presentation': 'pptx',
+}
+SUPPORTED_EXTENSIONS = ('.pdf', '.docx', '.pptx')
+
+class ExtractionTimeout(Exception):
+    pass
+
+def detect_format(content_type, url):
+    """Returns 'pdf', 'docx' or 'pptx' for a supported document, otherwise None."""
+    content_type = (content_type or '').split(';')[0].strip().lower()
+    if content_type in CONTENT_TYPES:
+        return CONTENT_TYPES[content_type]
+    # Many agency servers label every download as a generic binary; trust the extension then.
+    if content_type in ('', 'application/octet-stream', 'binary/octet-stream', 'application/download'):
+        path = url.split('?')[0].lower()
+        for ext in SUPPORTED_EXTENSIONS:
+            if path.endswith(ext): return ext[1:]
+    return None
+
+def stream_to_tempfile(response, suffix, hasher=None, max_bytes=MAX_DOCUMENT_BYTES):
+    """
+    Writes a streamed HTTP response body to a temporary file without holding it in memory.
+    Returns (path, size), or (None, size) when the body exceeds max_bytes.
+    """
+    declared = response.headers.get('Content-Length', '')
+    if declared.isdigit() and int(declared) > max_bytes:
+        response.close()
+        return None, int(declared)
+    size = 0
+    fd, path = tempfile.mkstemp(suffix=f".{suffix}", prefix="doc_")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in response.iter_content(chunk_size=STREAM_CHUNK_BYTES):
+                size += len(chunk)
+                if size > max_bytes:
+                    os.remove(path)
+                    return None, size
+                if hasher: hasher.update(chunk)
+                f.write(chunk)
+    except Exception:
+        if os.path.exists(path): os.remove(path)
+        raise
+    finally:
+        response.close()
+    return path, size
+
+def _extract_pdf(path):
+    import PyPDF2
+    reader = PyPDF2.PdfReader(path)
+    parts = []
+    for i, page in enumerate(reader.pages):
+        if i >= MAX_PDF_PAGES: break
+        parts.append(page.extract_text() or "")
+    return "".join(parts)
+
+def _extract_docx(path):
+    import docx
+    document = docx.Document(path)
+    parts = [p.text for p in document.paragraphs]
+    for table in document.tables:
+        for row in table.rows:
+            parts.append(" | ".join(cell.text for cell in row.cells))
+    return "\n".join(parts)
+
+def _extract_pptx(path):
+    from pptx import Presentation
+    presentation = Presentation(path)
+    parts = []
+    for slide in presentation.slides:
+        for shape in slide.shapes:
+            if shape.has_text_frame:
+                parts.append(shape.text_frame.text)
+    return "\n".join(parts)
+
+EXTRACTORS = {'pdf': _extract_pdf, 'docx': _extract_docx, 'pptx': _extract_pptx}
+
+def _raise_timeout(signum, frame):
+    raise ExtractionTimeout()
+
+def _init_worker(memory_limit_mb):
+    """Caps the address space of an extraction worker so a runaway parse fails with MemoryError."""
+    if memory_limit_mb:
+        try:
+            import resource
+            limit = memory_limit_mb * 1024 * 1024
+            resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+        except (ImportError, ValueError, OSError):
+            pass
+    if hasattr(signal, 'SIGALRM'):
+        signal.signal(signal.SIGALRM, _raise_timeout)
+
+def extract_text(path, fmt, timeout=EXTRACTION_TIMEOUT_SECONDS):
+    """Extracts the text of a PDF/DOCX/PPTX file. Returns None on failure, timeout or empty text."""
+    use_alarm = hasattr(signal, 'SIGALRM') and timeout
+    if use_alarm: signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        text = EXTRACTORS[fmt](path)
+        return text.strip() or None
+    except ExtractionTimeout:
+        print(f"          - Text extraction timed out after {timeout}s: {os.path.basename(path)}")
+        return None
+    except MemoryError:
+        print(f"          - Text extraction exceeded the memory limit: {os.path.basename(path)}")
+        return None
+    except Exception:
+        return None
+    finally:
+        if use_alarm: signal.setitimer(signal.ITIMER_REAL, 0)
+
+class ExtractionPool:
+    """
+    Process pool that parses downloaded documents off the crawler threads. Each task
+    reads a temp file written by the download stage and the file is removed once the
+    task finishes. Callbacks run on the pool's result thread.
+    """
+
+    def __init__(self, workers=EXTRACTION_WORKERS, memory_limit_mb=EXTRACTION_MEMORY_LIMIT_MB):
+        # 'spawn' keeps workers independent of the crawler's threads and open sockets.
+        context = multiprocessing.get_context('spawn')
+        self._pool = context.Pool(workers, initializer=_init_worker, initargs=(memory_limit_mb,), maxtasksperchild=TASKS_PER_WORKER)
+        self._pending = {}
+        self._idle = threading.Condition()
+
+    def submit(self, path, fmt, on_done):
+        """Queues a file for extraction; on_done(text_or_None) is called when it completes."""
+        with self._idle:
+            self._pending[path] = on_done
+
+        def _finish(text):
+            with self._idle:
+                callback = self._pending.pop(path, None)
+                self._idle.notify_all()
+            try:
+                if callback: callback(text)
+            finally:
+                if os.path.exists(path): os.remove(path)
+
+        def _fail(error):
+            print(f"          - Extraction worker failed: {error}")
+            _finish(None)
+
+        self._pool.apply_async(extract_text, (path, fmt), callback=_finish, error_callback=_fail)
+
+    def close(self, grace_seconds=EXTRACTION_TIMEOUT_SECONDS * 2):
+        """
+        Waits for queued extractions to finish and shuts the workers down. A task whose
+        worker died outright never reports back, so after the last progress plus a grace
+        period the pool is terminated and the stragglers are reported as failed.
+        """
+        self._pool.close()
+        with self._idle:
+            remaining = len(self._pending)
+            deadline = time.monotonic() + grace_seconds
+            while self._pending and time.monotonic() < deadline:
+                self._idle.wait(timeout=1)
+                if len(self._pending) < remaining:
+                    remaining = len(self._pending)
+                    deadline = time.monotonic() + grace_seconds
+            stragglers, self._pending = self._pending, {}
+        if stragglers:
+            print(f"          - Terminating extraction pool with {len(stragglers)} unfinished documents.")
+            self._pool.terminate()
+        self._pool.join()
+        for path, callback in stragglers.items():
+            try:
+                callback(None)
+            finally:
+                if os.path.exists(path): os.remove(path)
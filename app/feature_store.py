@@ -0,0 +1,147 @@
+import pandas as pd
+from collections import Counter
+from app import database
+
+# Signal features: validated entity mentions counted per agency, by document type and label.
+FEATURE_CONDITIONS = {
+    'planning_doc_its_mentions': "d.document_type = 'Planning Document' AND e.entity_label = 'ITS_TECHNOLOGY'",
+    'planning_doc_budget_mentions': "d.document_type = 'Planning Document' AND e.entity_label = 'MONEY'",
+    'its_arch_its_mentions': "d.document_type = 'ITS Architecture' AND e.entity_label = 'ITS_TECHNOLOGY'",
+}
+# Near-duplicates are linked to a canonical copy and would otherwise count the same mentions twice.
+SIGNAL_SOURCE_SQL = """
+    FROM documents d JOIN extracted_entities e ON d.document_id = e.source_id
+    WHERE e.validation_status = 'correct' AND d.canonical_document_id IS NULL AND d.agency_id IS NOT NULL
+"""
+# Mentions in undated documents are stored under this date: they count towards current
+# features but never towards an "as of" read, as before the store existed.
+UNDATED_SIGNAL_DATE = '9999-12-31'
+SIGNAL_DATE_SQL = f"COALESCE(d.publication_date, '{UNDATED_SIGNAL_DATE}')"
+
+# agency_signal_counts holds one row per agency, publication day and feature.
+# feature_store_ledger records which entity is counted where, so refresh() only
+# touches entities that started or stopped qualifying since the last run.
+# Scoring only reads. Near-duplicate linking refreshes the documents it changes (new
+# entities start 'unverified' and never count). Validation status is set outside the
+# application, so the Guardian agent and training runs reconcile the whole store.
+
+def _date_param(value):
+    return pd.Timestamp(value).date().isoformat()
+
+def refresh(conn=None, document_ids=None):
+    """
+    Brings agency_signal_counts up to date. Newly validated entities are added;
+    entities that were deleted, are no longer 'correct', moved to another agency,
+    date or document type, or whose document became a duplicate are subtracted.
+    With document_ids, only the entities of those documents are checked.
+    Returns (added, removed) entity counts.
+    """
+    if document_ids is not None:
+        document_ids = list(document_ids)
+        if not document_ids: return 0, 0
+    own_conn = conn is None
+    conn = conn or database.get_db_connection()
+    if not conn: return 0, 0
+    p_style = database.get_param_style()
+    if document_ids is None:
+        ledger_scope = source_scope = ""
+        scope_params = []
+    else:
+        document_placeholders = ', '.join(p_style for _ in document_ids)
+        ledger_scope = f"AND l.document_id IN ({document_placeholders})"
+        source_scope = f"AND d.document_id IN ({document_placeholders})"
+        scope_params = document_ids
+    is_postgres = database.get_db_type() == 'postgres'
+    deltas = Counter()
+    added, removed = [], []
+    try:
+        cur = conn.cursor()
+        # Concurrent refreshes would both apply the same deltas.
+        if is_postgres: cur.execute("LOCK TABLE feature_store_ledger IN EXCLUSIVE MODE")
+        elif not conn.in_transaction: cur.execute("BEGIN IMMEDIATE")
+        features = list(FEATURE_CONDITIONS)
+        feature_placeholders = ', '.join(p_style for _ in features)
+        cur.execute(f"SELECT entity_id, agency_id, signal_date, feature FROM feature_store_ledger l WHERE feature NOT IN ({feature_placeholders}) {ledger_scope}", features + scope_params)
+        removed += cur.fetchall()
+        for feature, condition in FEATURE_CONDITIONS.items():
+            cur.execute(f"""
+                SELECT l.entity_id, l.agency_id, l.signal_date, l.feature FROM feature_store_ledger l
+                WHERE l.feature = {p_style} {ledger_scope} AND NOT EXISTS (
+                    SELECT 1 {SIGNAL_SOURCE_SQL}
+                    AND e.entity_id = l.entity_id AND d.agency_id = l.agency_id
+                    AND {SIGNAL_DATE_SQL} = l.signal_date AND ({condition})
+                )
+            """, [feature] + scope_params)
+            removed += cur.fetchall()
+            cur.execute(f"""
+                SELECT e.entity_id, d.agency_id, {SIGNAL_DATE_SQL}, {p_style}, d.document_id
+                {SIGNAL_SOURCE_SQL} {source_scope} AND ({condition})
+                AND NOT EXISTS (
+                    SELECT 1 FROM feature_store_ledger l WHERE l.entity_id = e.entity_id AND l.feature = {p_style}
+                    AND l.agency_id = d.agency_id AND l.signal_date = {SIGNAL_DATE_SQL}
+                )
+            """, [feature] + scope_params + [feature])
+            added += cur.fetchall()
+
+        for _, agency_id, signal_date, feature in removed:
+            deltas[(agency_id, signal_date, feature)] -= 1
+        for _, agency_id, signal_date, feature, _ in added:
+            deltas[(agency_id, signal_date, feature)] += 1
+        cur.executemany(f"DELETE FROM feature_store_ledger WHERE entity_id = {p_style} AND feature = {p_style}",
+                        [(entity_id, feature) for entity_id, _, _, feature in removed])
+        database.bulk_insert(cur, 'feature_store_ledger', ('entity_id', 'agency_id', 'signal_date', 'feature', 'document_id'), added)
+        database.bulk_insert(cur, 'agency_signal_counts', ('agency_id', 'signal_date', 'feature', 'signal_count'),
+                             [key + (delta,) for key, delta in deltas.items() if delta],
+                             on_conflict="ON CONFLICT (agency_id, signal_date, feature) DO UPDATE SET signal_count = agency_signal_counts.signal_count + excluded.signal_count")
+        cur.execute("DELETE FROM agency_signal_counts WHERE signal_count <= 0")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        if own_conn: conn.close()
+    if added or removed:
+        print(f"  - Feature store: counted {len(added)} new signals, removed {len(removed)} stale ones.")
+    return len(added), len(removed)
+
+def rebuild():
+    """Empties the store and recounts every signal from scratch."""
+    print("--- Rebuilding the agency signal feature store ---")
+    conn = database.get_db_connection()
+    if not conn: return
+    try:
+        cur = conn.cursor()
+        cur.execute("DELETE FROM feature_store_ledger")
+        cur.execute("DELETE FROM agency_signal_counts")
+        conn.commit()
+        added, _ = refresh(conn)
+    finally:
+        conn.close()
+    print(f"--- Feature store rebuilt from {added} validated signals. ---")
+
+def read_features(as_of_date=None, conn=None):
+    """
+    Signal counts per agency as of a date (publications strictly before it), or
+    all of them when as_of_date is None. Returns one row per agency with its name
+    and a column per feature, zero-filled.
+    """
+    own_conn = conn is None
+    conn = conn or database.get_db_connection()
+    if not conn: return pd.DataFrame()
+    p_style = database.get_param_style()
+    date_filter, params = (f"WHERE signal_date < {p_style}", [_date_param(as_of_date)]) if as_of_date is not None else ("", [])
+    try:
+        counts_df = pd.read_sql_query(f"SELECT agency_id, feature, SUM(signal_count) AS signal_count FROM agency_signal_counts {date_filter} GROUP BY agency_id, feature", conn, params=params)
+        agencies_df = pd.read_sql("SELECT agency_id, name FROM agencies", conn, index_col='agency_id')
+    finally:
+        if own_conn: conn.close()
+    features_df = counts_df.pivot(index='agency_id', columns='feature', values='signal_count').reindex(columns=list(FEATURE_CONDITIONS))
+    return agencies_df.join(features_df).fillna(0).reset_index()
+
+def read_daily_counts(conn):
+    """Per-agency, per-day counts of dated signals, one column per feature, for building training sets."""
+    counts_df = pd.read_sql_query(f"SELECT agency_id, signal_date, feature, signal_count FROM agency_signal_counts WHERE signal_date < '{UNDATED_SIGNAL_DATE}'", conn)
+    daily_df = counts_df.pivot_table(index=['agency_id', 'signal_date'], columns='feature', values='signal_count', aggfunc='sum', fill_value=0)
+    daily_df = daily_df.reindex(columns=list(FEATURE_CONDITIONS), fill_value=0).reset_index()
+    daily_df.columns.name = None
+    return daily_df
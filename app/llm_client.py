@@ -0,0 +1,304 @@
+import os
+import time
+import json
+import queue
+import socket
+import hashlib
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from app import database
+
+# Every module talks to the model through this client. OLLAMA_URL defaults to a local
+# Ollama; docker-compose.yml points it at the ollama service. Point it at
+# scripts/ollama_stub_server.py to exercise the client without a real model.
+OLLAMA_URL = os.environ.get('OLLAMA_URL', 'http://localhost:11434')
+OLLAMA_MODEL = os.environ.get('OLLAMA_MODEL', 'llama3')
+LLM_CONNECT_TIMEOUT_SECONDS = float(os.environ.get('LLM_CONNECT_TIMEOUT', 5))
+LLM_READ_TIMEOUT_SECONDS = float(os.environ.get('LLM_READ_TIMEOUT', 300))
+# Ollama serves a model a few requests at a time; extra callers wait in a bounded queue
+# and are turned away once it is full rather than piling up on the server.
+LLM_MAX_CONCURRENCY = int(os.environ.get('LLM_MAX_CONCURRENCY', 2))
+LLM_MAX_QUEUED = int(os.environ.get('LLM_MAX_QUEUED', 16))
+LLM_QUEUE_TIMEOUT_SECONDS = float(os.environ.get('LLM_QUEUE_TIMEOUT', 600))
+LLM_CACHE_TTL_SECONDS = int(os.environ.get('LLM_CACHE_TTL', 7 * 24 * 3600))
+LLM_CACHE_MAX_ENTRIES = int(os.environ.get('LLM_CACHE_MAX_ENTRIES', 5000))
+# How often a streaming call checks its cancel_event while waiting for the next token.
+LLM_CANCEL_POLL_SECONDS = float(os.environ.get('LLM_CANCEL_POLL', 0.2))
+
+class LLMError(Exception):
+    pass
+
+_session = None
+_session_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(LLM_MAX_CONCURRENCY)
+_queue_lock = threading.Lock()
+_queued = 0
+_metrics_lock = threading.Lock()
+_metrics = {}
+
+def get_session():
+    """Returns the process-wide HTTP session, whose connection pool matches the concurrency limit."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=LLM_MAX_CONCURRENCY)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            session.headers['Content-Type'] = 'application/json'
+            _session = session
+        return _session
+
+def prompt_hash(model, prompt, options=None):
+    key = json.dumps({'model': model, 'prompt': prompt, 'options': options or {}}, sort_keys=True)
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+def _load_cached(key):
+    conn = database.get_db_connection()
+    if not conn: return None
+    p_style = database.get_param_style()
+    try:
+        cur = conn.cursor()
+        cur.execute(f"SELECT response, created_at FROM llm_response_cache WHERE prompt_hash = {p_style}", (key,))
+        row = cur.fetchone()
+        if not row: return None
+        response, created_at = row
+        now = time.time()
+        if now - created_at > LLM_CACHE_TTL_SECONDS:
+            cur.execute(f"DELETE FROM llm_response_cache WHERE prompt_hash = {p_style}", (key,))
+            conn.commit()
+            return None
+        cur.execute(f"UPDATE llm_response_cache SET last_used_at = {p_style} WHERE prompt_hash = {p_style}", (now, key))
+        conn.commit()
+        return response
+    except Exception as e:  # the cache is an optimisation; never fail a call because of it
+        print(f"    - LLM cache lookup failed: {e}")
+        return None
+    finally:
+        conn.close()
+
+def _store(key, model, response, call):
+    """Caches a response (when key is given), logs the call, and evicts expired and least recently used entries."""
+    conn = database.get_db_connection()
+    if not conn: return
+    p_style = database.get_param_style()
+    now = time.time()
+    try:
+        cur = conn.cursor()
+        if key is not None:
+            values = ', '.join(p_style for _ in range(5))
+            if database.get_db_type() == 'postgres':
+                sql = f"INSERT INTO llm_response_cache (prompt_hash, model, response, created_at, last_used_at) VALUES ({values}) ON CONFLICT (prompt_hash) DO UPDATE SET response = EXCLUDED.response, created_at = EXCLUDED.created_at, last_used_at = EXCLUDED.last_used_at"
+            else:
+                sql = f"INSERT OR REPLACE INTO llm_response_cache (prompt_hash, model, response, created_at, last_used_at) VALUES ({values})"
+            cur.execute(sql, (key, model, response, now, now))
+            cur.execute(f"DELETE FROM llm_response_cache WHERE created_at < {p_style}", (now - LLM_CACHE_TTL_SECONDS,))
+            # LIMIT -1 is SQLite's spelling of "no limit"; PostgreSQL accepts OFFSET on its own.
+            overflow = f"LIMIT -1 OFFSET {int(LLM_CACHE_MAX_ENTRIES)}" if database.get_db_type() == 'sqlite' else f"OFFSET {int(LLM_CACHE_MAX_ENTRIES)}"
+            cur.execute(f"DELETE FROM llm_response_cache WHERE prompt_hash IN (SELECT prompt_hash FROM llm_response_cache ORDER BY last_used_at DESC {overflow})")
+        _log_call(cur, call)
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        print(f"    - LLM cache write failed: {e}")
+    finally:
+        conn.close()
+
+def _log_call(cur, call):
+    database.bulk_insert(cur, 'llm_call_log', ('called_at', 'purpose', 'model', 'latency_ms', 'ttft_ms', 'prompt_tokens', 'completion_tokens', 'cache_hit', 'cancelled', 'error'),
+                         [(call['called_at'], call['purpose'], call['model'], call['latency_ms'], call['ttft_ms'], call['prompt_tokens'], call['completion_tokens'], int(call['cache_hit']), int(call['cancelled']), call['error'])])
+
+def _record(call):
+    with _metrics_lock:
+        totals = _metrics.setdefault(call['purpose'], {'calls': 0, 'cache_hits': 0, 'cancelled': 0, 'errors': 0, 'latency_ms': 0.0, 'streamed': 0, 'ttft_ms': 0.0, 'prompt_tokens': 0, 'completion_tokens': 0})
+        totals['calls'] += 1
+        if call['ttft_ms'] is not None:
+            totals['streamed'] += 1
+            totals['ttft_ms'] += call['ttft_ms']
+        totals['cache_hits'] += int(call['cache_hit'])
+        totals['cancelled'] += int(call['cancelled'])
+        totals['errors'] += int(call['error'] is not None)
+        totals['latency_ms'] += call['latency_ms']
+        totals['prompt_tokens'] += call['prompt_tokens'] or 0
+        totals['completion_tokens'] += call['completion_tokens'] or 0
+
+def get_metrics():
+    """
+    Returns per-purpose call counts, cache hits, cancellations, errors, total latency
+    and token counts for this process; for streamed calls, also their count and total
+    time to first token.
+    """
+    with _metrics_lock:
+        return {purpose: dict(totals) for purpose, totals in _metrics.items()}
+
+def _acquire_slot():
+    global _queued
+    with _queue_lock:
+        if _queued >= LLM_MAX_QUEUED:
+            raise LLMError(f"LLM request queue is full ({LLM_MAX_QUEUED} waiting).")
+        _queued += 1
+    try:
+        if not _slots.acquire(timeout=LLM_QUEUE_TIMEOUT_SECONDS):
+            raise LLMError(f"Timed out after {LLM_QUEUE_TIMEOUT_SECONDS:.0f}s waiting for the LLM.")
+    finally:
+        with _queue_lock:
+            _queued -= 1
+
+def _new_call(purpose, model):
+    return {'called_at': time.time(), 'purpose': purpose, 'model': model, 'latency_ms': 0.0, 'ttft_ms': None,
+            'prompt_tokens': None, 'completion_tokens': None, 'cache_hit': False, 'cancelled': False, 'error': None}
+
+def generate(prompt, purpose='general', model=None, options=None, use_cache=True):
+    """
+    Returns the model's completion for a prompt. Responses are served from the cache
+    when an identical model+prompt was answered within the TTL. Every call is timed and
+    logged with its token counts. Raises LLMError when the model can't be reached.
+    """
+    model = model or OLLAMA_MODEL
+    key = prompt_hash(model, prompt, options) if use_cache else None
+    call = _new_call(purpose, model)
+    started = time.perf_counter()
+
+    cached = _load_cached(key) if key else None
+    if cached is not None:
+        call['cache_hit'] = True
+        call['latency_ms'] = (time.perf_counter() - started) * 1000
+        _record(call)
+        _store(None, model, None, call)
+        return cached
+
+    payload = {"model": model, "prompt": prompt, "stream": False}
+    if options: payload["options"] = options
+    try:
+        _acquire_slot()
+        try:
+            response = get_session().post(f"{OLLAMA_URL}/api/generate", json=payload, timeout=(LLM_CONNECT_TIMEOUT_SECONDS, LLM_READ_TIMEOUT_SECONDS))
+        finally:
+            _slots.release()
+        response.raise_for_status()
+        body = response.json()
+    except (LLMError, requests.RequestException, ValueError) as e:
+        call['error'] = str(e)[:500]
+        call['latency_ms'] = (time.perf_counter() - started) * 1000
+        _record(call)
+        _store(None, model, None, call)
+        if isinstance(e, LLMError): raise
+        raise LLMError(str(e)) from e
+
+    text = body.get('response', '')
+    call['latency_ms'] = (time.perf_counter() - started) * 1000
+    call['prompt_tokens'] = body.get('prompt_eval_count')
+    call['completion_tokens'] = body.get('eval_count')
+    _record(call)
+    _store(key if text else None, model, text, call)
+    return text
+
+def _read_stream(payload, chunks, stream):
+    """
+    Reader thread of stream_generate(): posts the request and puts each decoded NDJSON
+    chunk on the chunks queue, then None. An exception is put on the queue instead of
+    being raised. Stops once stream['stop'] is set; holds the concurrency slot until
+    the connection is closed.
+    """
+    response = None
+    try:
+        response = get_session().post(f"{OLLAMA_URL}/api/generate", json=payload, stream=True, timeout=(LLM_CONNECT_TIMEOUT_SECONDS, LLM_READ_TIMEOUT_SECONDS))
+        stream['response'] = response
+        if stream['stop'].is_set(): return
+        response.raise_for_status()
+        for line in response.iter_lines():
+            if stream['stop'].is_set(): return
+            if line: chunks.put(json.loads(line))
+    except Exception as e:
+        if not stream['stop'].is_set(): chunks.put(e)
+    finally:
+        if response is not None: response.close()
+        _slots.release()
+        chunks.put(None)
+
+def _interrupt(response):
+    """
+    Shuts down a streaming response's socket, which wakes the reader thread if it is
+    blocked on the next token (closing the response alone would wait for that read)
+    and makes Ollama abandon the generation.
+    """
+    connection = response.raw.connection
+    sock = getattr(connection, 'sock', None) if connection is not None else None
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+def stream_generate(prompt, purpose='general', model=None, options=None, use_cache=True, cancel_event=None):
+    """
+    Like generate(), but yields the completion in pieces as the model produces them.
+    Setting cancel_event (a threading.Event) stops the generation within
+    LLM_CANCEL_POLL_SECONDS, even before the first token, and closes the connection,
+    which makes Ollama abandon it too. Time to first token is logged with the call.
+    A cached answer is yielded in one piece.
+    """
+    model = model or OLLAMA_MODEL
+    key = prompt_hash(model, prompt, options) if use_cache else None
+    call = _new_call(purpose, model)
+    started = time.perf_counter()
+
+    cached = _load_cached(key) if key else None
+    if cached is not None:
+        call['cache_hit'] = True
+        call['latency_ms'] = call['ttft_ms'] = (time.perf_counter() - started) * 1000
+        _record(call)
+        _store(None, model, None, call)
+        yield cached
+        return
+
+    payload = {"model": model, "prompt": prompt, "stream": True}
+    if options: payload["options"] = options
+    pieces = []
+    completed = False
+    try:
+        _acquire_slot()
+        # The request is read on its own thread, so a cancel is noticed while the model
+        # is still working on the first token, not only when the next line arrives.
+        chunks = queue.Queue()
+        stream = {'stop': threading.Event(), 'response': None}
+        threading.Thread(target=_read_stream, args=(payload, chunks, stream), daemon=True).start()
+        try:
+            while True:
+                try:
+                    chunk = chunks.get(timeout=LLM_CANCEL_POLL_SECONDS)
+                except queue.Empty:
+                    chunk = False
+                if cancel_event is not None and cancel_event.is_set():
+                    call['cancelled'] = True
+                    break
+                if chunk is False: continue
+                if chunk is None: break
+                if isinstance(chunk, Exception): raise chunk
+                if chunk.get('error'): raise LLMError(chunk['error'])
+                piece = chunk.get('response', '')
+                if piece:
+                    if call['ttft_ms'] is None: call['ttft_ms'] = (time.perf_counter() - started) * 1000
+                    pieces.append(piece)
+                    yield piece
+                if chunk.get('done'):
+                    call['prompt_tokens'] = chunk.get('prompt_eval_count')
+                    call['completion_tokens'] = chunk.get('eval_count')
+                    completed = True
+                    break
+        finally:
+            stream['stop'].set()
+            if stream['response'] is not None: _interrupt(stream['response'])
+    except (LLMError, requests.RequestException, ValueError) as e:
+        call['error'] = str(e)[:500]
+        if isinstance(e, LLMError): raise
+        raise LLMError(str(e)) from e
+    except GeneratorExit:
+        call['cancelled'] = True
+        raise
+    finally:
+        call['latency_ms'] = (time.perf_counter() - started) * 1000
+        _record(call)
+        text = "".join(pieces)
+        _store(key if completed and text else None, model, text, call)
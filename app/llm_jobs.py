@@ -0,0 +1,86 @@
+import time
+import uuid
+import threading
+
+# Streamed LLM answers for the dashboard. A job runs its generator on a background
+# thread and accumulates the text; Dash callbacks poll snapshot() from a dcc.Interval.
+# Jobs live in this process, so the dashboard must run as a single gunicorn worker
+# (the default) or with sticky sessions.
+JOB_RETENTION_SECONDS = 600
+
+_jobs = {}
+_jobs_lock = threading.Lock()
+
+class StreamJob:
+    def __init__(self):
+        self.pieces = []
+        self.done = False
+        self.error = None
+        self.cancel_event = threading.Event()
+        self.started = time.monotonic()
+        self.first_piece_at = None
+        self.cancelled_at = None
+        self.finished_at = None
+        self.lock = threading.Lock()
+
+    def run(self, stream_factory):
+        try:
+            for piece in stream_factory(self.cancel_event):
+                with self.lock:
+                    if self.first_piece_at is None: self.first_piece_at = time.monotonic()
+                    self.pieces.append(piece)
+                if self.cancel_event.is_set(): break
+        except Exception as e:  # surfaced in the UI instead of killing the thread silently
+            self.error = str(e)
+        finally:
+            with self.lock:
+                self.done = True
+                self.finished_at = time.monotonic()
+
+def _prune():
+    now = time.monotonic()
+    with _jobs_lock:
+        for job_id in [job_id for job_id, job in _jobs.items() if job.done and now - job.finished_at > JOB_RETENTION_SECONDS]:
+            del _jobs[job_id]
+
+def start(stream_factory):
+    """
+    Starts a streamed job and returns its id. stream_factory(cancel_event) must return
+    an iterable of text pieces and should stop early once cancel_event is set.
+    """
+    _prune()
+    job = StreamJob()
+    job_id = uuid.uuid4().hex
+    with _jobs_lock:
+        _jobs[job_id] = job
+    threading.Thread(target=job.run, args=(stream_factory,), daemon=True).start()
+    return job_id
+
+def cancel(job_id):
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+    if not job: return
+    with job.lock:
+        if job.done or job.cancelled_at is not None: return
+        job.cancelled_at = time.monotonic()
+    job.cancel_event.set()
+
+def snapshot(job_id):
+    """
+    Returns the job's progress as a dict (text, done, cancelled, error,
+    ttft_seconds, elapsed_seconds), or None for an unknown or expired job. A cancelled
+    job reports done at once; its thread stops when the next token arrives.
+    """
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+    if not job: return None
+    with job.lock:
+        end = job.finished_at or job.cancelled_at or time.monotonic()
+        return {
+            'text': "".join(job.pieces),
+            'done': job.done or job.cancelled_at is not None,
+            'cancelled': job.cancel_event.is_set(),
+            'error': job.error,
+            'ttft_seconds': job.first_piece_at - job.started if job.first_piece_at else None,
+            'elapsed_seconds': end - job.started,
+        }
@@ -1,65 +1,268 @@
-import os, spacy, requests, json
-from app import database
+import os, re, time, threading, requests, json
+from app import database, llm_client
 
-OLLAMA_URL = os.environ.get('OLLAMA_URL', 'http://ollama:11434')
-OLLAMA_MODEL = os.environ.get('OLLAMA_MODEL', 'llama3')
+# Batch processing: documents are streamed from the database and fed through nlp.pipe.
+NLP_BATCH_SIZE = int(os.environ.get('NLP_BATCH_SIZE', 32))
+NLP_N_PROCESS = int(os.environ.get('NLP_N_PROCESS', os.cpu_count() or 1))
+NLP_FETCH_SIZE = 200
+NLP_COMMIT_BATCH = int(os.environ.get('NLP_COMMIT_BATCH', 100))
+# Bump whenever the ontology or triage logic changes: documents processed under an
+# older version are picked up again (see process_unprocessed_documents).
+NLP_VERSION = 1
+# Long documents are processed as overlapping, sentence-aligned windows so the size of
+# any single spaCy Doc (and so peak memory per worker) is bounded.
+NLP_WINDOW_CHARS = int(os.environ.get('NLP_WINDOW_CHARS', 100000))
+NLP_WINDOW_OVERLAP_SENTENCES = 2
+SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?])\s+|\n\s*\n')
+# Tier 1 triage only needs entities, sentence boundaries and the phrase matcher.
+UNUSED_PIPES = ["tagger", "attribute_ruler", "lemmatizer"]
+ENTITY_LABELS = ("MONEY", "DATE", "ORG")
 ITS_KEYWORD_ONTOLOGY = [
     "Intelligent Transportation Systems", "ITS", "Advanced Traffic Management", "ATMS",
     "V2X", "V2V", "V2I", "Connected Vehicles", "Traffic Signal Priority", "TSP",
     "LIDAR", "ADAS", "Smart Corridor", "MaaS", "Mobility as a Service", "ANPR"
 ]
 
+_model = None
+_model_lock = threading.Lock()
+
 def load_spacy_model():
-    print(f"  - NLP Engine using LLM: '{OLLAMA_MODEL}' for Tier 2 tasks.")
+    import spacy
+    from spacy.matcher import PhraseMatcher
+    print(f"  - NLP Engine using LLM: '{llm_client.OLLAMA_MODEL}' for Tier 2 tasks.")
     try:
-        nlp = spacy.load("en_core_web_sm")
+        nlp = spacy.load("en_core_web_sm", exclude=UNUSED_PIPES)
     except OSError:
         print("    - Downloading spaCy model...")
         spacy.cli.download("en_core_web_sm")
-        nlp = spacy.load("en_core_web_sm")
-    matcher = spacy.matcher.PhraseMatcher(nlp.vocab, attr="LOWER")
+        nlp = spacy.load("en_core_web_sm", exclude=UNUSED_PIPES)
+    matcher = PhraseMatcher(nlp.vocab, attr="LOWER")
     patterns = [nlp.make_doc(text) for text in ITS_KEYWORD_ONTOLOGY]
     matcher.add("ITS_KEYWORDS", patterns)
     return nlp, matcher
 
-nlp, matcher = load_spacy_model()
+def get_model():
+    """
+    Returns the process-wide (nlp, matcher) pair, loading it on first use. Importing
+    this module stays cheap; only code that actually runs triage pays for spaCy.
+    """
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                started = time.perf_counter()
+                _model = load_spacy_model()
+                print(f"    - spaCy model loaded in {time.perf_counter() - started:.2f}s.")
+    return _model
 
-def tier1_triage_text(text):
-    if not isinstance(text, str): return 0, []
-    doc = nlp(text)
+def prewarm():
+    """Loads the model ahead of the first request, e.g. when a long-lived worker starts."""
+    get_model()
+
+def sentence_spans(text, max_chars=NLP_WINDOW_CHARS):
+    """
+    Yields (start, end) offsets of rough sentences, found with a cheap regex. Runs of
+    text longer than max_chars without a boundary are cut at whitespace.
+    """
+    def _bounded(start, end):
+        while end - start > max_chars:
+            cut = text.rfind(' ', start + 1, start + max_chars)
+            if cut <= start: cut = start + max_chars
+            yield start, cut
+            start = cut
+        if end > start: yield start, end
+
+    start = 0
+    for boundary in SENTENCE_BOUNDARY.finditer(text):
+        yield from _bounded(start, boundary.start())
+        start = boundary.end()
+    yield from _bounded(start, len(text))
+
+def iter_text_windows(text, window_chars=NLP_WINDOW_CHARS, overlap_sentences=NLP_WINDOW_OVERLAP_SENTENCES):
+    """
+    Splits text into sentence-aligned windows of at most window_chars characters, each
+    repeating the last overlap_sentences sentences of the previous one. Yields
+    (offset, window_text); a short text is a single window.
+    """
+    if len(text) <= window_chars:
+        yield 0, text
+        return
+    spans = list(sentence_spans(text, window_chars))
+    i = 0
+    while i < len(spans):
+        j = i + 1
+        while j < len(spans) and spans[j][1] - spans[i][0] <= window_chars:
+            j += 1
+        yield spans[i][0], text[spans[i][0]:spans[j - 1][1]]
+        if j >= len(spans): return
+        i = max(i + 1, j - overlap_sentences)
+
+def entities_from_doc(doc, offset=0):
+    """
+    Collects Tier 1 entities (ITS keyword matches plus money/date/org mentions) from a
+    parsed Doc. start_char/end_char are absolute when the Doc is a window at offset.
+    """
+    _, matcher = get_model()
     entities = []
+    sentences = {}
+
+    def _context(span):
+        sent = span.sent
+        if sent.start not in sentences: sentences[sent.start] = sent.text.strip()
+        return sentences[sent.start]
 
     matches = matcher(doc)
     for _, start, end in matches:
         span = doc[start:end]
-        entities.append({"entity_text": span.text, "entity_label": "ITS_TECHNOLOGY", "context_sentence": span.sent.text.strip()})
+        entities.append({"entity_text": span.text, "entity_label": "ITS_TECHNOLOGY", "context_sentence": _context(span),
+                         "start_char": offset + span.start_char, "end_char": offset + span.end_char})
 
     for ent in doc.ents:
-        if ent.label_ in ["MONEY", "DATE", "ORG"]:
-            entities.append({"entity_text": ent.text, "entity_label": ent.label_, "context_sentence": ent.sent.text.strip()})
+        if ent.label_ in ENTITY_LABELS:
+            entities.append({"entity_text": ent.text, "entity_label": ent.label_, "context_sentence": _context(ent),
+                             "start_char": offset + ent.start_char, "end_char": offset + ent.end_char})
+
+    return entities
+
+def merge_window_entities(merged, previous_window, entities):
+    """
+    Adds one window's entities to a document's results, dropping any that repeat (or
+    overlap, with the same label) an entity found in the previous window. Only the
+    previous window can overlap, so only its entities are kept for checking; the
+    return value is this window's entities, to check the next window against.
+    """
+    accepted = []
+    for entity in entities:
+        duplicate = any(
+            other["entity_label"] == entity["entity_label"] and other["start_char"] < entity["end_char"] and entity["start_char"] < other["end_char"]
+            for other in previous_window
+        )
+        if not duplicate:
+            accepted.append(entity)
+    merged.extend(accepted)
+    return entities
 
-    return len(entities), entities
+def tier1_triage_text(text):
+    if not isinstance(text, str): return 0, []
+    for _, entities in triage_documents([(None, text)], n_process=1):
+        return len(entities), entities
+    return 0, []
+
+def triage_documents(documents, batch_size=NLP_BATCH_SIZE, n_process=NLP_N_PROCESS):
+    """
+    Runs Tier 1 triage over a stream of (document_id, raw_text) pairs, yielding
+    (document_id, entities) in input order. Every document is split into bounded
+    windows and all windows are streamed through a single nlp.pipe, so peak memory
+    doesn't depend on the size of the largest document.
+    """
+    nlp, _ = get_model()
+    windows = (
+        (window_text, (doc_id, offset, index == 0))
+        for doc_id, text in documents if isinstance(text, str)
+        for index, (offset, window_text) in enumerate(iter_text_windows(text))
+    )
+    current_id, merged, previous_window = None, None, []
+    for doc, (doc_id, offset, first_window) in nlp.pipe(windows, as_tuples=True, batch_size=batch_size, n_process=n_process):
+        if first_window:
+            if merged is not None: yield current_id, merged
+            current_id, merged, previous_window = doc_id, [], []
+        previous_window = merge_window_entities(merged, previous_window, entities_from_doc(doc, offset))
+    if merged is not None: yield current_id, merged
+
+def stream_pending_documents(conn, max_documents=None):
+    """
+    Yields (document_id, raw_text) for documents not yet processed under the current
+    NLP_VERSION, skipping near-duplicates of an already stored document, without
+    holding every raw_text in memory. PostgreSQL uses a server-side cursor; SQLite
+    fetches the pending ids first and then the texts in small batches, so no read
+    lock is held while results are being written.
+    """
+    p_style = database.get_param_style()
+    limit = f"LIMIT {int(max_documents)}" if max_documents else ""
+    query = f"""
+        SELECT d.document_id{{text_column}} FROM documents d
+        LEFT JOIN document_nlp_state s ON s.document_id = d.document_id
+        WHERE d.raw_text IS NOT NULL AND d.canonical_document_id IS NULL AND (s.document_id IS NULL OR s.nlp_version < {p_style})
+        ORDER BY d.document_id {limit}
+    """
+    if database.get_db_type() == 'postgres':
+        cur = conn.cursor(name='nlp_pending_documents')
+        cur.itersize = NLP_FETCH_SIZE
+        try:
+            cur.execute(query.format(text_column=", d.raw_text"), (NLP_VERSION,))
+            yield from cur
+        finally:
+            cur.close()
+        return
+
+    cur = conn.cursor()
+    cur.execute(query.format(text_column=""), (NLP_VERSION,))
+    pending_ids = [row[0] for row in cur.fetchall()]
+    for i in range(0, len(pending_ids), NLP_FETCH_SIZE):
+        batch = pending_ids[i:i + NLP_FETCH_SIZE]
+        placeholders = ','.join('?' for _ in batch)
+        cur.execute(f"SELECT document_id, raw_text FROM documents WHERE document_id IN ({placeholders}) ORDER BY document_id", batch)
+        yield from cur.fetchall()
 
-def process_unprocessed_documents():
+def write_entity_batch(conn, results):
+    """
+    Stores the triage results for a batch of documents in one transaction: bulk-inserts
+    the entities and records each document's NLP_VERSION. When a document is being
+    reprocessed, its unverified entities are replaced; entities a reviewer has already
+    validated are kept and not inserted again.
+    """
+    cur = conn.cursor()
+    p_style = database.get_param_style()
+    doc_ids = [doc_id for doc_id, _ in results]
+    placeholders = ','.join(p_style for _ in doc_ids)
+    cur.execute(f"DELETE FROM extracted_entities WHERE source_type = 'document' AND validation_status = 'unverified' AND source_id IN ({placeholders})", doc_ids)
+    cur.execute(f"SELECT source_id, entity_text, entity_label, context_sentence FROM extracted_entities WHERE source_type = 'document' AND source_id IN ({placeholders})", doc_ids)
+    reviewed = set(cur.fetchall())
+
+    rows = [
+        (doc_id, 'document', e['entity_text'], e['entity_label'], e['context_sentence'])
+        for doc_id, entities in results for e in entities
+        if (doc_id, e['entity_text'], e['entity_label'], e['context_sentence']) not in reviewed
+    ]
+    database.bulk_insert(cur, 'extracted_entities', ('source_id', 'source_type', 'entity_text', 'entity_label', 'context_sentence'), rows)
+
+    now_func = "NOW()" if database.get_db_type() == 'postgres' else "datetime('now')"
+    state_rows = [(doc_id, NLP_VERSION, len(entities)) for doc_id, entities in results]
+    if database.get_db_type() == 'postgres':
+        sql = f"INSERT INTO document_nlp_state (document_id, nlp_version, entity_count, processed_at) VALUES ({p_style}, {p_style}, {p_style}, {now_func}) ON CONFLICT (document_id) DO UPDATE SET nlp_version = EXCLUDED.nlp_version, entity_count = EXCLUDED.entity_count, processed_at = EXCLUDED.processed_at"
+    else:
+        sql = f"INSERT OR REPLACE INTO document_nlp_state (document_id, nlp_version, entity_count, processed_at) VALUES ({p_style}, {p_style}, {p_style}, {now_func})"
+    cur.executemany(sql, state_rows)
+    conn.commit()
+    return len(rows)
+
+def process_unprocessed_documents(batch_size=NLP_BATCH_SIZE, n_process=NLP_N_PROCESS, max_documents=None):
+    """
+    Runs Tier 1 triage over every document not yet processed under the current
+    NLP_VERSION (new documents, or all of them after a version bump). Documents that
+    yield no entities are marked processed too, so each run only pays for new work.
+    max_documents caps a run, e.g. to spread a reprocess over several nights.
+    """
     print("  - NLP Engine: Processing new documents...")
-    conn = database.get_db_connection()
-    if not conn: return
-
-    with conn.cursor() as cur:
-        cur.execute("""
-            SELECT d.document_id, d.raw_text FROM documents d
-            LEFT JOIN extracted_entities ee ON d.document_id = ee.source_id AND ee.source_type = 'document'
-            WHERE d.raw_text IS NOT NULL AND ee.entity_id IS NULL
-        """)
-        docs_to_process = cur.fetchall()
-
-    print(f"    - Found {len(docs_to_process)} new documents for NLP analysis.")
-    for doc_id, raw_text in docs_to_process:
-        _, tier1_entities = tier1_triage_text(raw_text)
-
-        with conn.cursor() as cur_insert:
-            for entity in tier1_entities:
-                cur_insert.execute("INSERT INTO extracted_entities (source_id, source_type, entity_text, entity_label, context_sentence) VALUES (%s, 'document', %s, %s, %s);",
-                                   (doc_id, entity['entity_text'], entity['entity_label'], entity['context_sentence']))
-        conn.commit()
-    conn.close()
+    # Reads and writes use separate connections: committing on the reader would close
+    # its server-side cursor.
+    read_conn = database.get_db_connection()
+    write_conn = database.get_db_connection()
+    if not read_conn or not write_conn: return
+
+    processed = stored = 0
+    pending = []
+    try:
+        for result in triage_documents(stream_pending_documents(read_conn, max_documents), batch_size, n_process):
+            pending.append(result)
+            if len(pending) >= NLP_COMMIT_BATCH:
+                stored += write_entity_batch(write_conn, pending)
+                processed += len(pending)
+                pending = []
+        if pending:
+            stored += write_entity_batch(write_conn, pending)
+            processed += len(pending)
+    finally:
+        read_conn.close()
+        write_conn.close()
+    print(f"    - Processed {processed} documents (NLP version {NLP_VERSION}); stored {stored} entities.")
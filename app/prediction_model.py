@@ -2,9 +2,11 @@ import pandas as pd
 import xgboost as xgb
 import os
 from datetime import datetime
-from app import database
+from app import database, feature_store, rollup
 
 MODEL_PATH = '/app/app/xgb_model.json'
+# 0 keeps every prediction run.
+PREDICTION_RUNS_TO_KEEP = int(os.environ.get('PREDICTION_RUNS_TO_KEEP', 0))
 
 def load_model_for_prediction():
     if not os.path.exists(MODEL_PATH):
@@ -15,27 +17,17 @@ def load_model_for_prediction():
     return model
 
 def engineer_features(as_of_date=None):
+    """
+    Signal counts per agency, read from the feature store (kept up to date by
+    near-duplicate linking and periodic reconciliation), plus their roll-ups from
+    member and parent agencies; with as_of_date, only publications strictly before
+    that date count.
+    """
     conn = database.get_db_connection()
     if not conn: return pd.DataFrame()
-    date_filter = f"AND d.publication_date < '{as_of_date}'" if as_of_date else ""
-
     try:
-        query = f"""
-        SELECT
-            d.agency_id,
-            COUNT(CASE WHEN d.document_type = 'Planning Document' AND e.entity_label = 'ITS_TECHNOLOGY' THEN 1 END) AS planning_doc_its_mentions,
-            COUNT(CASE WHEN d.document_type = 'Planning Document' AND e.entity_label = 'MONEY' THEN 1 END) AS planning_doc_budget_mentions,
-            COUNT(CASE WHEN d.document_type = 'ITS Architecture' AND e.entity_label = 'ITS_TECHNOLOGY' THEN 1 END) AS its_arch_its_mentions
-        FROM documents d JOIN extracted_entities e ON d.document_id = e.source_id
-        WHERE e.validation_status = 'correct' {date_filter}
-        GROUP BY d.agency_id;
-        """
-        base_features_df = pd.read_sql_query(query, conn, index_col='agency_id')
-
-        all_agencies_df = pd.read_sql("SELECT agency_id, name FROM agencies", conn, index_col='agency_id')
-        final_df = all_agencies_df.join(base_features_df).fillna(0)
-
-        return final_df.reset_index()
+        features_df = feature_store.read_features(as_of_date, conn)
+        return rollup.add_rollup_features(features_df, list(feature_store.FEATURE_CONDITIONS), conn)
     finally:
         if conn: conn.close()
 
@@ -49,24 +41,62 @@ def generate_predictions():
         print("    - No feature data available to generate predictions.")
         return
 
-    feature_names = [col for col in features_df.columns if col.endswith('_mentions')]
     # Ensure all model features are present, even if all zero
     for f in model.get_booster().feature_names:
-        if f not in feature_names:
+        if f not in features_df.columns:
             features_df[f] = 0
     X = features_df[model.get_booster().feature_names]
 
     probabilities = model.predict_proba(X)[:, 1]
     features_df['prob_12_months'] = probabilities
 
+    save_prediction_run(features_df[['agency_id', 'prob_12_months']], model_version(model))
+
+def model_version(model):
+    """
+    Identifies the model a run was scored with: the version train.py --tune stores on
+    the booster, or else the artifact's file name and modification time.
+    """
+    version = model.get_booster().attr('version')
+    if version: return version
+    modified = datetime.fromtimestamp(os.path.getmtime(MODEL_PATH)).isoformat(timespec='seconds')
+    return f"{os.path.basename(MODEL_PATH)}@{modified}"
+
+def save_prediction_run(predictions_df, version=None):
+    """
+    Writes predictions (agency_id, prob_12_months) as a new run and makes it the
+    current one in the same transaction, so readers of current_predictions see either
+    the previous run or the complete new one. Earlier runs are kept for drift
+    analysis; PREDICTION_RUNS_TO_KEEP > 0 prunes all but the newest N.
+    Returns the new run_id.
+    """
     conn = database.get_db_connection()
+    if not conn: return None
+    p_style = database.get_param_style()
+    today = datetime.now().date().isoformat()
     try:
-        with conn.cursor() as cur:
-            cur.execute("TRUNCATE TABLE predictions RESTART IDENTITY;")
-            for _, row in features_df.iterrows():
-                cur.execute("INSERT INTO predictions (agency_id, prediction_date, prob_12_months) VALUES (%s, %s, %s)",
-                            (row['agency_id'], datetime.now().date(), row['prob_12_months']))
-            conn.commit()
-            print(f"    - Successfully saved {len(features_df)} new predictions.")
+        cur = conn.cursor()
+        insert_run = f"INSERT INTO prediction_runs (model_version, agency_count) VALUES ({p_style}, {p_style})"
+        if database.get_db_type() == 'postgres':
+            cur.execute(insert_run + " RETURNING run_id", (version, len(predictions_df)))
+            run_id = cur.fetchone()[0]
+        else:
+            cur.execute(insert_run, (version, len(predictions_df)))
+            run_id = cur.lastrowid
+        rows = [(int(agency_id), today, float(prob), run_id) for agency_id, prob in predictions_df[['agency_id', 'prob_12_months']].itertuples(index=False)]
+        database.bulk_insert(cur, 'predictions', ('agency_id', 'prediction_date', 'prob_12_months', 'run_id'), rows)
+        database.bulk_insert(cur, 'current_prediction_run', ('singleton', 'run_id'), [(1, run_id)],
+                             on_conflict="ON CONFLICT (singleton) DO UPDATE SET run_id = excluded.run_id")
+        if PREDICTION_RUNS_TO_KEEP > 0:
+            cur.execute(f"SELECT run_id FROM prediction_runs WHERE run_id NOT IN (SELECT run_id FROM prediction_runs ORDER BY run_id DESC LIMIT {PREDICTION_RUNS_TO_KEEP})")
+            expired = [(row[0],) for row in cur.fetchall()]
+            cur.executemany(f"DELETE FROM predictions WHERE run_id = {p_style}", expired)
+            cur.executemany(f"DELETE FROM prediction_runs WHERE run_id = {p_style}", expired)
+        conn.commit()
+        print(f"    - Successfully saved {len(rows)} new predictions as run {run_id}.")
+        return run_id
+    except Exception:
+        conn.rollback()
+        raise
     finally:
-        if conn: conn.close()
+        conn.close()
@@ -1,15 +1,15 @@
-import os, pandas as pd, json, requests, time
+import os, pandas as pd, json, time
 from datetime import datetime
 import markdown_pdf
 from app import database
+from app import llm_client
 
-OLLAMA_URL = os.environ.get('OLLAMA_URL', 'http://ollama:11434')
-OLLAMA_MODEL = os.environ.get('OLLAMA_MODEL', 'llama3')
 REPORT_OUTPUT_DIR = "/app/generated_reports"
 
-def generate_report_markdown(agency_id, report_type='single_agency'):
+def build_report_prompt(agency_id, report_type='single_agency'):
+    """Returns (report_header_markdown, prompt), or (error_markdown, None) when the database is unavailable."""
     conn = database.get_db_connection()
-    if not conn: return "# Report Error: Could not connect to the database."
+    if not conn: return "# Report Error: Could not connect to the database.", None
 
     agency_name = pd.read_sql("SELECT name FROM agencies WHERE agency_id = %s", conn, params=(agency_id,)).iloc[0]['name']
 
@@ -22,15 +22,29 @@ def generate_report_markdown(agency_id, report_type='single_agency'):
     prompt = f"""As a BI Analyst, write a professional report for {agency_name}.
     Start with an "Executive Summary". Then create a "Key Findings" section.
     Output must be in clean Markdown. DATA: {json.dumps(gathered_data)}"""
+    header = f"# {report_title}\n**Generated On:** {datetime.now().strftime('%B %d, %Y')}\n\n---\n\n"
+    return header, prompt
+
+def generate_report_markdown(agency_id, report_type='single_agency'):
+    header, prompt = build_report_prompt(agency_id, report_type)
+    if prompt is None: return header
 
     try:
-        response = requests.post(f"{OLLAMA_URL}/api/generate", json={"model": OLLAMA_MODEL, "prompt": prompt, "stream": False})
-        response.raise_for_status()
-        narrative = response.json().get('response', 'Could not generate narrative.')
+        narrative = llm_client.generate(prompt, purpose='report') or 'Could not generate narrative.'
     except Exception as e:
         narrative = f"**Error:** Could not generate AI narrative. {e}"
 
-    return f"# {report_title}\\n**Generated On:** {datetime.now().strftime('%B %d, %Y')}\\n\\n---\\n\\n{narrative}"
+    return f"{header}{narrative}"
+
+def stream_report_markdown(agency_id, report_type='single_agency', cancel_event=None):
+    """Streaming counterpart of generate_report_markdown: yields the header, then the narrative as it is generated."""
+    header, prompt = build_report_prompt(agency_id, report_type)
+    yield header
+    if prompt is None: return
+    try:
+        yield from llm_client.stream_generate(prompt, purpose='report', cancel_event=cancel_event)
+    except llm_client.LLMError as e:
+        yield f"**Error:** Could not generate AI narrative. {e}"
 
 def convert_markdown_to_pdf(markdown_content, agency_id):
     if not os.path.exists(REPORT_OUTPUT_DIR): os.makedirs(REPORT_OUTPUT_DIR)
@@ -0,0 +1,143 @@
+import io
+import os
+import hashlib
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
+from app import database
+
+# Hierarchical roll-up: a member agency's signals flow up to its parents (and their
+# parents), scaled by each relationship's governmental_structures.influence_weight,
+# and a parent's signals flow down to its members the same way. The propagation
+# operator sum(W^k, k=1..ROLLUP_MAX_HOPS) is built per connected group of related
+# agencies and stored in rollup_operators under a hash of that group's edges, so a
+# new relationship only rebuilds the operator of the group it touches, in any process.
+ROLLUP_MAX_HOPS = int(os.environ.get('ROLLUP_MAX_HOPS', 6))
+MEMBERS_SUFFIX = '_from_members'
+PARENTS_SUFFIX = '_from_parents'
+
+_operator_cache = {}  # in-process copy of rollup_operators: edge hash -> (agency ids, up-operator as COO)
+
+def load_edges(conn):
+    """One weighted parent <- child edge per related pair; the strongest structure wins."""
+    return pd.read_sql_query("""
+        SELECT r.parent_agency_id AS parent_id, r.child_agency_id AS child_id, MAX(s.influence_weight) AS weight
+        FROM agency_relationships r JOIN governmental_structures s ON s.structure_id = r.structure_id
+        WHERE r.parent_agency_id <> r.child_agency_id
+        GROUP BY r.parent_agency_id, r.child_agency_id
+    """, conn)
+
+def _propagation_operator(n, rows, cols, weights):
+    """sum(W^k) over 1..ROLLUP_MAX_HOPS hops for W[parent, child] = weight; cycles are cut off by the hop limit."""
+    step = sparse.csr_matrix((weights, (rows, cols)), shape=(n, n))
+    operator, term = step.copy(), step
+    for _ in range(ROLLUP_MAX_HOPS - 1):
+        term = step @ term
+        if term.nnz == 0: break
+        operator = operator + term
+    return operator.tocoo()
+
+def _serialize(agency_ids, operator):
+    buffer = io.BytesIO()
+    np.savez(buffer, agency_ids=agency_ids, row=operator.row, col=operator.col, data=operator.data)
+    data = buffer.getvalue()
+    if database.get_db_type() == 'postgres':
+        import psycopg2
+        data = psycopg2.Binary(data)
+    return data
+
+def _deserialize(data):
+    arrays = np.load(io.BytesIO(bytes(data)))
+    n = len(arrays['agency_ids'])
+    return arrays['agency_ids'], sparse.coo_matrix((arrays['data'], (arrays['row'], arrays['col'])), shape=(n, n))
+
+def _sync_stored_operators(conn, keys):
+    """Loads the stored operators for keys missing from the in-process cache and deletes stored ones no longer in keys."""
+    cur = conn.cursor()
+    cur.execute("SELECT edge_hash FROM rollup_operators")
+    stored = {row[0] for row in cur.fetchall()}
+    p_style = database.get_param_style()
+    wanted = sorted((stored & keys) - set(_operator_cache))
+    if wanted:
+        placeholders = ', '.join(p_style for _ in wanted)
+        cur.execute(f"SELECT edge_hash, operator FROM rollup_operators WHERE edge_hash IN ({placeholders})", wanted)
+        for key, data in cur.fetchall():
+            _operator_cache[key] = _deserialize(data)
+    stale = stored - keys
+    if stale:
+        cur.executemany(f"DELETE FROM rollup_operators WHERE edge_hash = {p_style}", [(key,) for key in stale])
+        conn.commit()
+
+def component_operators(edges_df, conn):
+    """
+    Returns [(agency_ids, up-operator)] for every connected group. Operators are read
+    from rollup_operators; only groups whose edges changed are rebuilt and stored.
+    """
+    if edges_df.empty:
+        _operator_cache.clear()
+        _sync_stored_operators(conn, set())
+        return []
+    nodes, codes = np.unique(edges_df[['parent_id', 'child_id']].to_numpy(), return_inverse=True)
+    parents, children = codes.reshape(-1, 2).T
+    weights = edges_df['weight'].to_numpy(dtype=np.float64)
+    graph = sparse.csr_matrix((np.ones(len(parents)), (parents, children)), shape=(len(nodes), len(nodes)))
+    _, labels = connected_components(graph, directed=True, connection='weak')
+
+    edge_order = np.lexsort((children, parents, labels[parents]))
+    edge_labels = labels[parents][edge_order]
+    boundaries = np.flatnonzero(np.diff(edge_labels)) + 1
+    groups = {}
+    for group in np.split(edge_order, boundaries):
+        edges = np.column_stack([nodes[parents[group]], nodes[children[group]], weights[group]])
+        # The hop limit is part of the key: changing it invalidates every stored operator.
+        key = hashlib.sha1(f"{ROLLUP_MAX_HOPS}:".encode('ascii') + edges.tobytes()).hexdigest()
+        groups[key] = group
+    # Groups that no longer exist (edited or removed relationships) are dropped from the cache and the table.
+    for key in set(_operator_cache) - set(groups):
+        del _operator_cache[key]
+    _sync_stored_operators(conn, set(groups))
+
+    new_rows = []
+    for key, group in groups.items():
+        if key not in _operator_cache:
+            group_nodes = np.unique(np.concatenate([parents[group], children[group]]))
+            local = np.searchsorted(group_nodes, parents[group]), np.searchsorted(group_nodes, children[group])
+            _operator_cache[key] = (nodes[group_nodes], _propagation_operator(len(group_nodes), *local, weights[group]))
+            new_rows.append((key, _serialize(*_operator_cache[key])))
+    if new_rows:
+        database.bulk_insert(conn.cursor(), 'rollup_operators', ('edge_hash', 'operator'), new_rows, ignore_conflicts=True)
+        conn.commit()
+        print(f"  - Roll-up: rebuilt propagation for {len(new_rows)} of {len(groups)} agency groups.")
+    return [_operator_cache[key] for key in groups]
+
+def rollup_operator(conn, agency_ids):
+    """The up-operator over agency_ids as one sparse matrix; its transpose propagates downwards."""
+    position = pd.Index(agency_ids)
+    rows, cols, data = [], [], []
+    for group_ids, operator in component_operators(load_edges(conn), conn):
+        group_position = position.get_indexer(group_ids)
+        keep = (group_position[operator.row] >= 0) & (group_position[operator.col] >= 0)
+        rows.append(group_position[operator.row[keep]])
+        cols.append(group_position[operator.col[keep]])
+        data.append(operator.data[keep])
+    if not rows: return sparse.csr_matrix((len(position), len(position)))
+    return sparse.csr_matrix((np.concatenate(data), (np.concatenate(rows), np.concatenate(cols))), shape=(len(position), len(position)))
+
+def rollup_features(operator, signals):
+    """
+    Given signals as {feature: (n_agencies, ...) array}, returns the weighted signals of
+    each agency's descendants (MEMBERS_SUFFIX) and ancestors (PARENTS_SUFFIX).
+    """
+    rolled = {}
+    for name, values in signals.items():
+        values = np.asarray(values, dtype=np.float64)
+        rolled[name + MEMBERS_SUFFIX] = operator @ values
+        rolled[name + PARENTS_SUFFIX] = operator.T @ values
+    return rolled
+
+def add_rollup_features(features_df, feature_names, conn):
+    """Adds the roll-up columns for feature_names to a one-row-per-agency features frame."""
+    operator = rollup_operator(conn, features_df['agency_id'].to_numpy())
+    rolled = rollup_features(operator, {name: features_df[name].to_numpy() for name in feature_names})
+    return features_df.assign(**rolled)
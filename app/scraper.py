@@ -1,21 +1,73 @@
 import os
 import time
+import random
+import queue
+import threading
 import requests
-import PyPDF2
-import io
+from concurrent.futures import ThreadPoolExecutor
+from bs4 import BeautifulSoup
 import sys
 import json
-from urllib.parse import urljoin
+import hashlib
+from contextlib import contextmanager
+from urllib.parse import urljoin, urlparse
 from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.common.by import By
-from selenium.common.exceptions import WebDriverException
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.common.exceptions import TimeoutException, WebDriverException
 from datetime import datetime, timedelta
 from app import database
+from app import document_extractor
+from app import crawl_scheduler
+from app import dedupe
+from app import llm_client
+from app.agency_matcher import AgencyNameIndex
 
 USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/98.0.4758.102 Safari/537.36"
-OLLAMA_URL = os.environ.get('OLLAMA_URL', 'http://localhost:11434')
-OLLAMA_MODEL = os.environ.get('OLLAMA_MODEL', 'llama3')
+
+# Download stage tuning. The global cap bounds total in-flight downloads; the
+# per-host settings keep us polite towards any single agency web server.
+DOWNLOAD_WORKERS = int(os.environ.get('SCRAPER_DOWNLOAD_WORKERS', 8))
+PER_HOST_CONCURRENCY = int(os.environ.get('SCRAPER_PER_HOST_CONCURRENCY', 2))
+PER_HOST_DELAY_SECONDS = float(os.environ.get('SCRAPER_PER_HOST_DELAY', 1.0))
+DOWNLOAD_RETRIES = int(os.environ.get('SCRAPER_DOWNLOAD_RETRIES', 3))
+DOWNLOAD_BACKOFF_SECONDS = 2.0
+DOWNLOAD_TIMEOUT_SECONDS = 30
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+URL_LOOKUP_BATCH_SIZE = 500  # stays under SQLite's bound-parameter limit
+
+# SAM.gov historical backfill. SAM_API_URL can point at a local stand-in server
+# that replays recorded pages.
+SAM_API_URL = os.environ.get('SAM_API_URL', 'https://api.sam.gov/opportunities/v2/search')
+SAM_PAGE_SIZE = 1000
+SAM_BACKFILL_WORKERS = int(os.environ.get('SAM_BACKFILL_WORKERS', 4))
+SAM_MIN_REQUEST_INTERVAL_SECONDS = float(os.environ.get('SAM_MIN_REQUEST_INTERVAL', 1.0))
+ITS_NAICS_CODES = ["541512", "541330", "541715", "334511"]
+
+# The AI link finder only sees a reduced list of candidate anchors, split into
+# prompts of at most AI_FINDER_MAX_PROMPT_CHARS characters.
+AI_FINDER_MAX_PROMPT_CHARS = int(os.environ.get('AI_FINDER_MAX_PROMPT_CHARS', 12000))
+AI_FINDER_MAX_TEXT_CHARS = 120
+AI_FINDER_PROMPT = """
+You are an expert web scraping assistant. Below is the list of hyperlinks found on a web page, one per line, with each link's text and the heading of the section it appears in. Identify the links that likely lead to transportation planning documents. These documents might be called 'Metropolitan Transportation Plan', 'Transportation Improvement Program', 'Long-Range Plan', 'Meeting Minutes', 'Agendas', 'ITS Architecture', or similar.
+
+Return ONLY a JSON object with a single key "document_urls", where the value is a list of the URLs exactly as they appear below. Do not include duplicates. If no relevant documents are found, return an empty list.
+
+Links:
+{links}
+"""
+
+# Page discovery runs one headless Chrome per crawl worker. Drivers are recycled
+# after DRIVER_MAX_PAGES page loads to keep Chrome's memory growth in check.
+CRAWL_WORKERS = int(os.environ.get('SCRAPER_CRAWL_WORKERS', os.cpu_count() or 2))
+# Per-run crawl budget for the nightly job; pages that don't fit stay due for the next run.
+CRAWL_PAGE_BUDGET = int(os.environ.get('CRAWL_PAGE_BUDGET', 300))
+CRAWL_TIME_BUDGET_SECONDS = int(os.environ.get('CRAWL_TIME_BUDGET_SECONDS', 3 * 3600))
+DRIVER_MAX_PAGES = int(os.environ.get('SCRAPER_DRIVER_MAX_PAGES', 50))
+PAGE_READY_TIMEOUT_SECONDS = 15
+
+_thread_local = threading.local()
 
 def setup_webdriver():
     chrome_options = Options()
@@ -29,106 +81,711 @@ def setup_webdriver():
         print(f"!!! WebDriver initialization error: {e}")
         return None
 
-def extract_text_from_pdf(pdf_content):
-    try:
-        reader = PyPDF2.PdfReader(io.BytesIO(pdf_content))
-        text = "".join(page.extract_text() for page in reader.pages if page.extract_text())
-        return text.strip() or None
-    except Exception:
+class WebDriverPool:
+    """
+    A fixed number of reusable headless Chrome sessions shared by the crawl workers.
+    Drivers are started lazily, and are replaced after DRIVER_MAX_PAGES leases or
+    as soon as a health check after a lease shows the session has crashed.
+    """
+
+    def __init__(self, size=CRAWL_WORKERS, max_pages=DRIVER_MAX_PAGES):
+        self.max_pages = max_pages
+        self._idle = queue.Queue()
+        self._pages = {}
+        self._lock = threading.Lock()
+        self._all = set()
+        for _ in range(size): self._idle.put(None)
+
+    @contextmanager
+    def lease(self):
+        """Checks out a driver for one page load. Yields None if Chrome cannot start."""
+        driver = self._idle.get()
+        if driver is None:
+            driver = setup_webdriver()
+            if driver:
+                with self._lock: self._all.add(driver)
+        try:
+            yield driver
+        finally:
+            self._idle.put(self._release(driver))
+
+    def _release(self, driver):
+        if driver is None: return None
+        with self._lock:
+            pages = self._pages[id(driver)] = self._pages.get(id(driver), 0) + 1
+        try:
+            driver.current_url  # raises if the browser or its session has died
+            if pages < self.max_pages: return driver
+            print("      - Recycling WebDriver after page limit.")
+        except WebDriverException:
+            print("      - WebDriver session crashed. Recycling.")
+        self._discard(driver)
         return None
 
-def find_document_links_with_ai(html_content):
+    def _discard(self, driver):
+        with self._lock:
+            self._pages.pop(id(driver), None)
+            self._all.discard(driver)
+        try:
+            driver.quit()
+        except WebDriverException:
+            pass
+
+    def close(self):
+        with self._lock: drivers = list(self._all)
+        for driver in drivers: self._discard(driver)
+
+def load_page(driver, url):
+    """Navigates to a URL and waits until the document reports it has finished loading."""
+    driver.get(url)
+    try:
+        WebDriverWait(driver, PAGE_READY_TIMEOUT_SECONDS).until(lambda d: d.execute_script("return document.readyState") == "complete")
+    except TimeoutException:
+        print(f"      - Page did not finish loading within {PAGE_READY_TIMEOUT_SECONDS}s, continuing with partial content: {url}")
+
+def get_http_session():
+    """Returns this thread's pooled HTTP session."""
+    if not hasattr(_thread_local, 'session'):
+        _thread_local.session = requests.Session()
+        _thread_local.session.headers['User-Agent'] = USER_AGENT
+    return _thread_local.session
+
+class HostRateLimiter:
+    """Limits concurrent requests and enforces a minimum spacing per host."""
+
+    def __init__(self, max_per_host=PER_HOST_CONCURRENCY, min_delay=PER_HOST_DELAY_SECONDS):
+        self.max_per_host = max_per_host
+        self.min_delay = min_delay
+        self._lock = threading.Lock()
+        self._semaphores = {}
+        self._next_slot = {}
+
+    @contextmanager
+    def slot(self, url):
+        host = urlparse(url).netloc.lower()
+        with self._lock:
+            semaphore = self._semaphores.setdefault(host, threading.BoundedSemaphore(self.max_per_host))
+        with semaphore:
+            with self._lock:
+                now = time.monotonic()
+                start = max(now, self._next_slot.get(host, now))
+                self._next_slot[host] = start + self.min_delay
+            if start > now:
+                time.sleep(start - now)
+            yield
+
+def fetch_with_retries(session, url, limiter, retries=DOWNLOAD_RETRIES, **kwargs):
     """
-    Uses an LLM to find document links in the HTML of a page.
+    GETs a URL under the host rate limiter, retrying connection errors, timeouts
+    and 429/5xx responses with exponential backoff. Other HTTP errors raise immediately.
     """
-    print("      - Using AI to find document links...")
-    prompt = f"""
-    You are an expert web scraping assistant. Analyze the following HTML content and identify all hyperlinks (`<a>` tags) that likely lead to transportation planning documents. These documents might be called 'Metropolitan Transportation Plan', 'Transportation Improvement Program', 'Long-Range Plan', 'Meeting Minutes', 'Agendas', 'ITS Architecture', or similar.
+    kwargs.setdefault('timeout', DOWNLOAD_TIMEOUT_SECONDS)
+    for attempt in range(retries + 1):
+        try:
+            with limiter.slot(url):
+                response = session.get(url, **kwargs)
+            if response.status_code not in RETRYABLE_STATUS_CODES:
+                response.raise_for_status()
+                return response
+            if attempt == retries:
+                response.raise_for_status()
+            retry_after = response.headers.get('Retry-After', '')
+            delay = float(retry_after) if retry_after.isdigit() else DOWNLOAD_BACKOFF_SECONDS * (2 ** attempt)
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt == retries: raise
+            delay = DOWNLOAD_BACKOFF_SECONDS * (2 ** attempt)
+        time.sleep(delay + random.uniform(0, 1))
+
+class FetchCache:
+    """
+    Persistent HTTP validators (ETag / Last-Modified) and content hashes per URL.
+    Used to send conditional requests and to skip re-parsing content that has not
+    changed since the last crawl. check() compares without recording; callers record()
+    an entry once the content it describes has been processed, and save() writes the
+    recorded entries back. Content that was seen but not fully processed is recorded
+    with processed=False: it still counts as seen for change detection, but is sent
+    unconditionally and parsed again until a crawl completes it.
+    """
+
+    def __init__(self, entries=None):
+        self._entries = entries or {}
+        self._dirty = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls):
+        conn = database.get_db_connection()
+        if not conn: return cls()
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT url, etag, last_modified, content_hash, processed FROM http_fetch_cache")
+            return cls({url: (etag, last_modified, content_hash, bool(processed)) for url, etag, last_modified, content_hash, processed in cur.fetchall()})
+        finally:
+            conn.close()
+
+    @staticmethod
+    def rendered_key(url):
+        """Key for a page's browser-rendered content, kept apart from its static HTML under the plain URL."""
+        return f"rendered:{url}"
+
+    def is_processed(self, url):
+        entry = self._entries.get(url)
+        return entry is not None and entry[3]
+
+    def conditional_headers(self, url):
+        # A 304 for content that was never fully processed would leave nothing to parse.
+        if not self.is_processed(url): return {}
+        etag, last_modified, _, _ = self._entries[url]
+        headers = {}
+        if etag: headers['If-None-Match'] = etag
+        if last_modified: headers['If-Modified-Since'] = last_modified
+        return headers
+
+    def check(self, url, response=None, content=None, content_hash=None):
+        """
+        Reports whether a URL's content is the same as on the previous fetch. Returns
+        (unchanged, entry), where entry holds the latest validators and content hash
+        for record(), or None when there is nothing new to record. Pass the HTTP
+        response and/or, for browser-rendered pages, the rendered content. Streamed
+        responses pass the content_hash computed while the body was written to disk.
+        """
+        previous = self._entries.get(url)
+        if response is not None and response.status_code == 304:
+            return previous is not None, None
+        etag = response.headers.get('ETag') if response is not None else None
+        last_modified = response.headers.get('Last-Modified') if response is not None else None
+        if content_hash is None:
+            content = response.content if content is None else content
+            content = content.encode('utf-8') if isinstance(content, str) else content
+            content_hash = hashlib.sha256(content).hexdigest()
+        return previous is not None and previous[2] == content_hash, (etag, last_modified, content_hash)
+
+    def record(self, url, entry, processed=True):
+        if entry is None: return
+        with self._lock:
+            self._entries[url] = self._dirty[url] = tuple(entry) + (processed,)
+
+    def save(self):
+        with self._lock:
+            dirty, self._dirty = self._dirty, {}
+        if not dirty: return
+        conn = database.get_db_connection()
+        if not conn: return
+        p_style = database.get_param_style()
+        now_func = "NOW()" if database.get_db_type() == 'postgres' else "datetime('now')"
+        if database.get_db_type() == 'postgres':
+            sql = f"INSERT INTO http_fetch_cache (url, etag, last_modified, content_hash, processed, fetched_at) VALUES ({p_style}, {p_style}, {p_style}, {p_style}, {p_style}, {now_func}) ON CONFLICT (url) DO UPDATE SET etag = EXCLUDED.etag, last_modified = EXCLUDED.last_modified, content_hash = EXCLUDED.content_hash, processed = EXCLUDED.processed, fetched_at = EXCLUDED.fetched_at"
+        else:
+            sql = f"INSERT OR REPLACE INTO http_fetch_cache (url, etag, last_modified, content_hash, processed, fetched_at) VALUES ({p_style}, {p_style}, {p_style}, {p_style}, {p_style}, {now_func})"
+        try:
+            cur = conn.cursor()
+            cur.executemany(sql, [(url,) + entry for url, entry in dirty.items()])
+            conn.commit()
+        finally:
+            conn.close()
 
-    Return ONLY a JSON object with a single key "document_urls", where the value is a list of the full, absolute URLs. Do not include duplicates. If no relevant documents are found, return an empty list.
+class PageFetch:
+    """
+    A crawled page's fetch-cache entries, held back until every document queued from
+    the page has been stored or skipped for good. A page with a transient download or
+    storage failure (5xx, timeout, connection error) is recorded as unprocessed and is
+    fetched and parsed again on the next run. changed reflects only the page's own
+    content against the last crawl, which is what the crawl frontier schedules on.
+    """
 
-    HTML Content:
-    ```html
-    {html_content}
-    ```
+    def __init__(self, fetch_cache):
+        self.fetch_cache = fetch_cache
+        self.changed = False  # whether the page's own content differs from the last crawl
+        self._entries = {}
+        self._pending = 1  # the page itself, released by done()
+        self._failed = False
+        self._lock = threading.Lock()
+
+    def hold(self, key, entry, unchanged):
+        """Holds a fetched content's entry; unchanged is check()'s verdict against the last crawl."""
+        if entry is None: return
+        self._entries[key] = entry
+        self.changed = self.changed or not unchanged
+
+    def document_queued(self):
+        """Counts one more queued document; returns the callback that reports its outcome."""
+        with self._lock:
+            self._pending += 1
+        return self.done
+
+    def fail(self):
+        with self._lock:
+            self._failed = True
+
+    def done(self, ok=True):
+        with self._lock:
+            self._pending -= 1
+            self._failed = self._failed or not ok
+            finished = self._pending == 0
+            complete = finished and not self._failed
+        if finished:
+            # Recorded either way, so the next crawl can tell whether the page itself changed.
+            for key, entry in self._entries.items():
+                self.fetch_cache.record(key, entry, processed=complete)
+
+class DocumentDownloader:
     """
+    Concurrent download stage for candidate documents. Page discovery submits URLs
+    onto a bounded queue; a pool of worker threads streams them to temp files, a
+    process pool extracts their text, and a single writer thread owns the database
+    connection used to store the results.
+    """
+
+    def __init__(self, workers=DOWNLOAD_WORKERS, limiter=None, fetch_cache=None):
+        self.limiter = limiter or HostRateLimiter()
+        self.fetch_cache = fetch_cache or FetchCache()
+        # Started before any thread so the extraction workers never inherit crawler state.
+        self.extraction_pool = document_extractor.ExtractionPool()
+        self.url_queue = queue.Queue(maxsize=workers * 4)
+        self.result_queue = queue.Queue()
+        self.stats = {'documents': 0, 'bytes': 0, 'errors': 0, 'skipped': 0, 'unchanged': 0, 'duplicates': 0}
+        self._stats_lock = threading.Lock()
+        self._seen = set()
+        self._waiters = {}  # doc_url -> on_done callbacks still waiting for its outcome
+        self._outcomes = {}  # doc_url -> True when stored (or skipped for good), False on failure
+        self._started_at = time.monotonic()
+        self._elapsed = None
+        self._workers = [threading.Thread(target=self._download_loop, daemon=True) for _ in range(workers)]
+        self._writer = threading.Thread(target=self._write_loop, daemon=True)
+        for thread in self._workers: thread.start()
+        self._writer.start()
+
+    def submit(self, agency_id, doc_type, doc_url, on_done=None):
+        """
+        Queues a document once per run. on_done(ok) is called when the document has been
+        stored or skipped for good (ok: dead links, unsupported or text-less files) or its
+        download or storage failed in a way worth retrying.
+        """
+        with self._stats_lock:
+            outcome = self._outcomes.get(doc_url)
+            if outcome is None and on_done:
+                self._waiters.setdefault(doc_url, []).append(on_done)
+            if doc_url in self._seen:
+                if outcome is not None and on_done: on_done(outcome)
+                return
+            self._seen.add(doc_url)
+        self.url_queue.put((agency_id, doc_type, doc_url))
+
+    def _finish(self, doc_url, ok, entry=None):
+        """Reports a document's outcome to its waiters; its fetch-cache entry is only recorded once it is stored."""
+        if ok: self.fetch_cache.record(doc_url, entry)
+        with self._stats_lock:
+            self._outcomes[doc_url] = ok
+            waiters = self._waiters.pop(doc_url, [])
+        for on_done in waiters: on_done(ok)
+
+    def close(self):
+        """Drains the queues, stops all threads and returns the throughput stats."""
+        for _ in self._workers: self.url_queue.put(None)
+        for thread in self._workers: thread.join()
+        self.extraction_pool.close()
+        self.result_queue.put(None)
+        self._writer.join()
+        self._elapsed = time.monotonic() - self._started_at
+        return self.stats
+
+    def report(self):
+        elapsed = self._elapsed if self._elapsed is not None else time.monotonic() - self._started_at
+        elapsed = max(elapsed, 1e-6)
+        print(f"  - Download stage: {self.stats['documents']} documents, {self.stats['bytes'] / 1e6:.1f} MB in {elapsed:.1f}s "
+              f"({self.stats['documents'] / elapsed:.2f} docs/sec, {self.stats['bytes'] / elapsed / 1e3:.1f} KB/sec); "
+              f"{self.stats['unchanged']} unchanged, {self.stats['duplicates']} near-duplicates, {self.stats['skipped']} skipped, {self.stats['errors']} errors.")
+
+    def _count(self, key, amount=1):
+        with self._stats_lock:
+            self.stats[key] += amount
+
+    def _download_loop(self):
+        while True:
+            item = self.url_queue.get()
+            if item is None: return
+            agency_id, doc_type, doc_url = item
+            print(f"        - Downloading document: {doc_url}")
+            try:
+                self._download(agency_id, doc_type, doc_url)
+            except requests.HTTPError as e:
+                status = e.response.status_code if e.response is not None else None
+                if status is not None and 400 <= status < 500 and status not in RETRYABLE_STATUS_CODES:
+                    # A dead link (404, 410, 403...) won't fix itself; it must not keep its page uncached.
+                    print(f"          - Skipping document that returned HTTP {status}: {doc_url}")
+                    self._count('skipped')
+                    self._finish(doc_url, True)
+                else:
+                    print(f"          - ERROR downloading document {doc_url}: {e}")
+                    self._count('errors')
+                    self._finish(doc_url, False)
+            except Exception as e:  # one bad document must never take a worker down
+                print(f"          - ERROR downloading document {doc_url}: {e}")
+                self._count('errors')
+                self._finish(doc_url, False)
+
+    def _download(self, agency_id, doc_type, doc_url):
+        response = fetch_with_retries(get_http_session(), doc_url, self.limiter, stream=True, headers=self.fetch_cache.conditional_headers(doc_url))
+        if response.status_code == 304:
+            response.close()
+            self._count('unchanged')
+            self._finish(doc_url, True)
+            return
+
+        fmt = document_extractor.detect_format(response.headers.get('Content-Type'), doc_url)
+        if not fmt:
+            response.close()
+            print(f"          - Skipping unsupported document type: {doc_url}")
+            self._count('skipped')
+            self._finish(doc_url, True)
+            return
+
+        hasher = hashlib.sha256()
+        path, size = document_extractor.stream_to_tempfile(response, fmt, hasher)
+        self._count('bytes', size)
+        if not path:
+            print(f"          - Skipping document larger than {document_extractor.MAX_DOCUMENT_BYTES // 1e6:.0f} MB: {doc_url}")
+            self._count('skipped')
+            self._finish(doc_url, True)
+            return
+        unchanged, entry = self.fetch_cache.check(doc_url, response, content_hash=hasher.hexdigest())
+        if unchanged:
+            os.remove(path)
+            self._count('unchanged')
+            self._finish(doc_url, True)
+            return
+
+        def on_extracted(text):
+            if text:
+                self.result_queue.put((agency_id, doc_type, doc_url, text, entry))
+            else:
+                # No text (image-only PDFs, parse failures, extraction timeouts) is final for
+                # this content; recording its hash skips it until the file itself changes.
+                self._count('skipped')
+                self._finish(doc_url, True, entry)
+        self.extraction_pool.submit(path, fmt, on_extracted)
+
+    def _write_loop(self):
+        conn = database.get_db_connection()
+        if not conn:
+            # Keep draining so the download workers never block on a full queue.
+            while (item := self.result_queue.get()) is not None:
+                self._count('errors')
+                self._finish(item[2], False)
+            return
+        cur = conn.cursor()
+        p_style = database.get_param_style()
+        is_postgres = database.get_db_type() == 'postgres'
+        now_func = "NOW()" if is_postgres else "datetime('now')"
+        columns = f"documents (agency_id, document_type, url, raw_text, canonical_document_id, scraped_date, publication_date) VALUES ({p_style}, {p_style}, {p_style}, {p_style}, {p_style}, {now_func}, {p_style})"
+        # documents.url is uniquely indexed, so a document stored concurrently by another run is skipped.
+        sql = f"INSERT INTO {columns} ON CONFLICT (url) DO NOTHING RETURNING document_id" if is_postgres else f"INSERT OR IGNORE INTO {columns}"
+        try:
+            while True:
+                item = self.result_queue.get()
+                if item is None: break
+                agency_id, doc_type, doc_url, text, entry = item
+                try:
+                    # A near-duplicate of a stored document is linked to it instead of keeping a second copy of its text.
+                    signature = dedupe.minhash_signature(text)
+                    canonical_id = dedupe.find_canonical(cur, signature, agency_id) if signature is not None else None
+                    stored_text = None if canonical_id else text
+                    cur.execute(sql, (agency_id, doc_type, doc_url, stored_text, canonical_id, datetime.now().date()))
+                    if is_postgres:
+                        row = cur.fetchone()
+                        document_id = row[0] if row else None
+                    else:
+                        document_id = cur.lastrowid if cur.rowcount else None
+                    if document_id and signature is not None and not canonical_id:
+                        dedupe.index_document(cur, document_id, signature)
+                    conn.commit()
+                    if not document_id: self._count('skipped')
+                    elif canonical_id: self._count('duplicates')
+                    else: self._count('documents')
+                    self._finish(doc_url, True, entry)
+                except Exception as e:
+                    conn.rollback()
+                    print(f"          - ERROR storing document {doc_url}: {e}")
+                    self._count('errors')
+                    self._finish(doc_url, False)
+        finally:
+            conn.close()
+
+def reduce_html_for_ai(html_content, page_url=None):
+    """
+    Reduces a page to its candidate links: one line per unique anchor with its
+    absolute href, link text and the nearest preceding heading. Scripts, styles and
+    layout markup never reach the model.
+    """
+    soup = BeautifulSoup(html_content, 'html.parser')
+    for tag in soup(['script', 'style', 'noscript', 'svg', 'iframe']):
+        tag.decompose()
+    lines, seen = [], set()
+    for a in soup.find_all('a', href=True):
+        href = a['href'].strip()
+        if not href or href.startswith(('#', 'javascript:', 'mailto:', 'tel:')): continue
+        href = urljoin(page_url, href) if page_url else href
+        if href in seen: continue
+        seen.add(href)
+        text = " ".join(a.get_text(" ", strip=True).split())[:AI_FINDER_MAX_TEXT_CHARS]
+        heading = a.find_previous(['h1', 'h2', 'h3', 'h4'])
+        heading_text = " ".join(heading.get_text(" ", strip=True).split())[:AI_FINDER_MAX_TEXT_CHARS] if heading else ""
+        lines.append(f"- {href} | text: {text or '(none)'} | section: {heading_text or '(none)'}")
+    return lines
+
+def chunk_lines(lines, max_chars):
+    """Groups lines into chunks whose joined length stays under max_chars."""
+    chunks, current, size = [], [], 0
+    for line in lines:
+        if current and size + len(line) + 1 > max_chars:
+            chunks.append(current)
+            current, size = [], 0
+        current.append(line)
+        size += len(line) + 1
+    if current: chunks.append(current)
+    return chunks
+
+def _load_cached_ai_links(page_hash):
+    conn = database.get_db_connection()
+    if not conn: return None
+    try:
+        cur = conn.cursor()
+        cur.execute(f"SELECT document_urls FROM ai_link_cache WHERE page_hash = {database.get_param_style()}", (page_hash,))
+        row = cur.fetchone()
+        return json.loads(row[0]) if row else None
+    finally:
+        conn.close()
+
+def _store_cached_ai_links(page_hash, urls):
+    conn = database.get_db_connection()
+    if not conn: return
     try:
-        response = requests.post(f"{OLLAMA_URL}/api/generate", json={"model": OLLAMA_MODEL, "prompt": prompt, "stream": False}, headers={'Content-Type': 'application/json'})
-        response.raise_for_status()
-
-        response_text = response.json().get('response', '{}').strip()
-        # Find the JSON part of the response, in case the LLM adds extra text
-        json_start = response_text.find('{')
-        json_end = response_text.rfind('}') + 1
-        if json_start == -1 or json_end == 0:
-            print("      - AI did not return a valid JSON object.")
-            return []
-
-        json_response = json.loads(response_text[json_start:json_end])
-        urls = json_response.get("document_urls", [])
-        print(f"      - AI identified {len(urls)} potential document links.")
-        return urls
+        cur = conn.cursor()
+        database.bulk_insert(cur, 'ai_link_cache', ('page_hash', 'document_urls'), [(page_hash, json.dumps(urls))], ignore_conflicts=True)
+        conn.commit()
+    finally:
+        conn.close()
+
+def _ask_ai_for_links(candidate_lines):
+    prompt = AI_FINDER_PROMPT.format(links="\n".join(candidate_lines))
+    response_text = (llm_client.generate(prompt, purpose='link_finder') or '{}').strip()
+    # Find the JSON part of the response, in case the LLM adds extra text
+    json_start = response_text.find('{')
+    json_end = response_text.rfind('}') + 1
+    if json_start == -1 or json_end == 0:
+        raise ValueError("AI did not return a valid JSON object.")
+    return json.loads(response_text[json_start:json_end]).get("document_urls", [])
+
+def find_document_links_with_ai(html_content, page_url=None):
+    """
+    Uses an LLM to find document links in the HTML of a page. Only the reduced list of
+    candidate anchors is sent, in chunks when it is long, and the result is cached on
+    the hash of the model, the prompt and that list, so an unchanged page never reaches
+    the model again while a prompt or model change asks afresh.
+    """
+    candidate_lines = reduce_html_for_ai(html_content, page_url)
+    if not candidate_lines: return []
+    prompt_hash = hashlib.sha256(AI_FINDER_PROMPT.encode('utf-8')).hexdigest()
+    page_hash = hashlib.sha256(f"{llm_client.OLLAMA_MODEL}\n{prompt_hash}\n".encode('utf-8') + "\n".join(candidate_lines).encode('utf-8')).hexdigest()
+    cached = _load_cached_ai_links(page_hash)
+    if cached is not None:
+        print(f"      - Reusing cached AI result ({len(cached)} document links).")
+        return cached
+
+    chunks = chunk_lines(candidate_lines, AI_FINDER_MAX_PROMPT_CHARS)
+    print(f"      - Using AI to find document links among {len(candidate_lines)} candidates ({len(chunks)} chunk(s))...")
+    known_urls = {line[2:].split(' | ', 1)[0] for line in candidate_lines}
+    urls = []
+    try:
+        for chunk in chunks:
+            urls.extend(url for url in _ask_ai_for_links(chunk) if url not in urls)
     except Exception as e:
         print(f"      - ERROR connecting to the AI model or parsing its response: {e}")
         return []
+    # Only keep links that were actually on the page; the model occasionally invents URLs.
+    urls = [url for url in urls if url in known_urls]
+    print(f"      - AI identified {len(urls)} potential document links.")
+    _store_cached_ai_links(page_hash, urls)
+    return urls
+
+def is_document_link(href):
+    """True for links to document formats the extraction stage can parse (PDF, DOCX, PPTX)."""
+    return href.split('#')[0].split('?')[0].strip().lower().endswith(document_extractor.SUPPORTED_EXTENSIONS)
+
+def discover_document_links(html_content, page_url, use_ai_finder=False):
+    """Returns the absolute URLs of candidate documents linked from a page's HTML."""
+    if use_ai_finder:
+        ai_urls = find_document_links_with_ai(html_content, page_url)
+        # Make sure URLs are absolute
+        return {urljoin(page_url, url) for url in ai_urls}
+    soup = BeautifulSoup(html_content, 'html.parser')
+    return {urljoin(page_url, a['href']) for a in soup.find_all('a', href=True) if is_document_link(a['href'])}
+
+def fetch_static_page(page_url, limiter, fetch_cache):
+    """
+    Fetches a page over plain HTTP with a conditional request. Returns (html, unchanged,
+    cache entry); html is None when the fetch fails, the URL isn't an HTML page, or the
+    page is unchanged and was fully processed last time, so it can be skipped.
+    """
+    try:
+        response = fetch_with_retries(get_http_session(), page_url, limiter, headers=fetch_cache.conditional_headers(page_url))
+    except requests.RequestException as e:
+        print(f"      - Static fetch failed for {page_url}: {e}")
+        return None, False, None
+    unchanged, entry = fetch_cache.check(page_url, response)
+    if unchanged and fetch_cache.is_processed(page_url):
+        return None, True, None
+    if 'html' not in response.headers.get('Content-Type', 'text/html').lower():
+        return None, unchanged, entry
+    return response.text, unchanged, entry
+
+def find_stored_urls(conn, urls):
+    """Returns the subset of urls already present in the documents table, using set-based lookups."""
+    urls = list(urls)
+    stored = set()
+    cur = conn.cursor()
+    p_style = database.get_param_style()
+    for i in range(0, len(urls), URL_LOOKUP_BATCH_SIZE):
+        batch = urls[i:i + URL_LOOKUP_BATCH_SIZE]
+        placeholders = ','.join(p_style for _ in batch)
+        cur.execute(f"SELECT url FROM documents WHERE url IN ({placeholders})", batch)
+        stored.update(row[0] for row in cur.fetchall())
+    return stored
+
+def queue_new_documents(conn, downloader, agency_id, doc_type, doc_urls, page=None):
+    """
+    Hands every link not already stored in the documents table to the download stage;
+    page, when given, waits for their outcomes before recording its fetch-cache entries.
+    """
+    stored = find_stored_urls(conn, doc_urls)
+    print(f"      - Found {len(doc_urls)} links to process ({len(stored)} already stored).")
+    for doc_url in doc_urls:
+        if doc_url not in stored:
+            downloader.submit(agency_id, doc_type, doc_url, page.document_queued() if page else None)
 
-def download_documents_from_url(driver, agency_id, conn, page_url, doc_type, use_ai_finder=False):
+def download_documents_from_url(driver, downloader, agency_id, conn, page_url, doc_type, use_ai_finder=False, page=None):
+    """
+    Renders a page in the browser, discovers candidate document links and hands the
+    new ones to the caller's download stage, which is shared across pages and closed
+    once by its owner. Returns the number of links found, or None when the rendered
+    page is unchanged according to page's fetch cache; its new cache entry is held on
+    page until the queued documents are stored.
+    """
     try:
-        driver.get(page_url)
-        time.sleep(2)  # Allow time for dynamic content to load
+        load_page(driver, page_url)
+        if page is not None:
+            rendered_key = FetchCache.rendered_key(page_url)
+            unchanged, entry = page.fetch_cache.check(rendered_key, content=driver.page_source)
+            if unchanged and page.fetch_cache.is_processed(rendered_key):
+                print("      - Rendered page unchanged since last crawl. Skipping link extraction.")
+                return None
+            page.hold(rendered_key, entry, unchanged)
 
-        doc_urls = []
         if use_ai_finder:
-            html_content = driver.page_source
-            ai_urls = find_document_links_with_ai(html_content)
-            # Make sure URLs are absolute
-            doc_urls = [urljoin(page_url, url) for url in ai_urls]
+            doc_urls = discover_document_links(driver.page_source, page_url, use_ai_finder=True)
         else:
-            # Fallback to simple PDF link finding
-            pdf_links = driver.find_elements(By.TAG_NAME, 'a')
-            doc_urls = {urljoin(page_url, link.get_attribute('href')) for link in pdf_links if link.get_attribute('href') and link.get_attribute('href').lower().endswith('.pdf')}
-
-        cur = conn.cursor()
-        p_style = database.get_param_style()
-
-        print(f"      - Found {len(doc_urls)} links to process.")
-        for doc_url in doc_urls:
-            cur.execute(f"SELECT 1 FROM documents WHERE url = {p_style}", (doc_url,))
-            if cur.fetchone(): continue
-
-            print(f"        - Downloading document: {doc_url}")
-            try:
-                response = requests.get(doc_url, headers={'User-Agent': USER_AGENT}, timeout=30)
-                response.raise_for_status()
+            # Fallback to simple document link finding
+            links = driver.find_elements(By.TAG_NAME, 'a')
+            hrefs = (link.get_attribute('href') for link in links)
+            doc_urls = {urljoin(page_url, href) for href in hrefs if href and is_document_link(href)}
 
-                # Basic check for PDF content type
-                if 'application/pdf' not in response.headers.get('Content-Type', ''):
-                    print("          - Skipping non-PDF link.")
-                    continue
-
-                text = extract_text_from_pdf(response.content)
-                if text:
-                    now_func = "NOW()" if database.get_db_type() == 'postgres' else "datetime('now')"
-                    sql = f"INSERT INTO documents (agency_id, document_type, url, raw_text, scraped_date, publication_date) VALUES ({p_style}, {p_style}, {p_style}, {p_style}, {now_func}, {p_style}) {database.get_on_conflict_clause()}"
-
-                    try:
-                        cur.execute(sql, (agency_id, doc_type, doc_url, text, datetime.now().date()))
-                    except Exception as e:
-                        if "UNIQUE constraint failed" in str(e): pass
-                        else: raise e
-                conn.commit()
-            except requests.RequestException as e:
-                print(f"          - ERROR downloading document: {e}")
-                pass
+        queue_new_documents(conn, downloader, agency_id, doc_type, doc_urls, page)
+        return len(doc_urls)
     except WebDriverException as e:
         print(f"      - ERROR accessing page {page_url}: {e}")
-        pass
+        if page is not None: page.fail()
+        return 0
 
-def scrape_all_agencies(target_agency_ids=None, use_ai_finder=False):
+def load_render_modes():
+    """Returns the remembered {page_url: 'static' | 'browser'} outcome of earlier crawls."""
+    conn = database.get_db_connection()
+    if not conn: return {}
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT page_url, render_mode FROM page_render_modes")
+        return dict(cur.fetchall())
+    finally:
+        conn.close()
+
+def save_render_modes(outcomes):
+    """Persists the render mode that worked for each crawled page."""
+    if not outcomes: return
+    conn = database.get_db_connection()
+    if not conn: return
+    p_style = database.get_param_style()
+    now_func = "NOW()" if database.get_db_type() == 'postgres' else "datetime('now')"
+    if database.get_db_type() == 'postgres':
+        sql = f"INSERT INTO page_render_modes (page_url, agency_id, render_mode, updated_at) VALUES ({p_style}, {p_style}, {p_style}, {now_func}) ON CONFLICT (page_url) DO UPDATE SET agency_id = EXCLUDED.agency_id, render_mode = EXCLUDED.render_mode, updated_at = EXCLUDED.updated_at"
+    else:
+        sql = f"INSERT OR REPLACE INTO page_render_modes (page_url, agency_id, render_mode, updated_at) VALUES ({p_style}, {p_style}, {p_style}, {now_func})"
+    try:
+        cur = conn.cursor()
+        cur.executemany(sql, [(page_url, agency_id, mode) for page_url, (agency_id, mode, _) in outcomes.items()])
+        conn.commit()
+    finally:
+        conn.close()
+
+def crawl_page(pool, downloader, conn, agency_id, page_url, doc_type, render_modes, outcomes, use_ai_finder=False):
+    """
+    Collects a page's document links over plain HTTP first, and falls back to a pooled
+    browser only for pages remembered as JS-heavy or where the static pass finds nothing.
+    The page's fetch-cache entries are recorded only once the documents it queued are stored.
+    """
+    page = PageFetch(downloader.fetch_cache)
+    ok = False
+    try:
+        if render_modes.get(page_url) != 'browser':
+            html_content, unchanged, entry = fetch_static_page(page_url, downloader.limiter, downloader.fetch_cache)
+            if unchanged and html_content is None and entry is None:
+                print(f"      - Page unchanged since last crawl. Skipping {page_url}")
+                outcomes[page_url] = (agency_id, 'static', False)
+                return
+            page.hold(page_url, entry, unchanged)
+            doc_urls = discover_document_links(html_content, page_url, use_ai_finder) if html_content else set()
+            if doc_urls:
+                queue_new_documents(conn, downloader, agency_id, doc_type, doc_urls, page)
+                outcomes[page_url] = (agency_id, 'static', page.changed)
+                ok = True
+                return
+            print(f"      - Static pass found no links. Rendering {page_url} in the browser.")
+
+        with pool.lease() as driver:
+            if not driver:
+                print(f"      - No WebDriver available. Skipping {page_url}")
+                return
+            found = download_documents_from_url(driver, downloader, agency_id, conn, page_url, doc_type, use_ai_finder, page)
+        # Only pin a page to the browser once rendering actually paid off; otherwise keep
+        # trying the cheap path first on the next run. An unchanged page keeps its mode.
+        # The frontier's changed flag comes from the page's own content, not from whether
+        # its documents downloaded.
+        if found is None: found = render_modes.get(page_url) == 'browser'
+        outcomes[page_url] = (agency_id, 'browser' if found else 'static', page.changed)
+        ok = True
+    finally:
+        page.done(ok)
+
+def crawl_planned_page(pool, downloader, page, render_modes, outcomes, deadline, use_ai_finder=False):
+    """Crawls one page from the crawl plan, unless the run's time budget is spent."""
+    agency_id, name, page_url, doc_type = page
+    if time.monotonic() > deadline: return
+    print(f"    - Checking '{name}' ({doc_type}) for documents...")
+    conn = database.get_db_connection()
+    if not conn: return
+    try:
+        crawl_page(pool, downloader, conn, agency_id, page_url, doc_type, render_modes, outcomes, use_ai_finder)
+    finally:
+        conn.close()
+
+def scrape_all_agencies(target_agency_ids=None, use_ai_finder=False, workers=CRAWL_WORKERS, page_budget=CRAWL_PAGE_BUDGET, time_budget_seconds=CRAWL_TIME_BUDGET_SECONDS):
+    """
+    Crawls agency planning and minutes pages for new documents. A full run visits
+    only pages that are due according to the crawl frontier, highest priority first,
+    within the page and time budgets. A targeted run visits every page of the given
+    agencies.
+    """
     print("  - Scraping agency documents...")
-    driver = setup_webdriver()
     conn = database.get_db_connection()
-    if not driver or not conn: return
+    if not conn: return
     cur = conn.cursor()
 
     if target_agency_ids:
@@ -139,17 +796,45 @@ def scrape_all_agencies(target_agency_ids=None, use_ai_finder=False):
         print("    - Scraping for all agencies.")
         cur.execute("SELECT agency_id, name, planning_url, minutes_url FROM agencies")
     agencies = cur.fetchall()
-
-    for agency_id, name, planning_url, minutes_url in agencies:
-        print(f"    - Checking '{name}' for documents...")
-        if planning_url:
-            download_documents_from_url(driver, agency_id, conn, planning_url, "Planning Document", use_ai_finder)
-        if minutes_url:
-            download_documents_from_url(driver, agency_id, conn, minutes_url, "Meeting Minutes", use_ai_finder)
-
-    driver.quit()
     conn.close()
 
+    pages = [(agency_id, name, page_url, doc_type)
+             for agency_id, name, planning_url, minutes_url in agencies
+             for page_url, doc_type in ((planning_url, "Planning Document"), (minutes_url, "Meeting Minutes")) if page_url]
+    if target_agency_ids:
+        pages = crawl_scheduler.plan_crawl(pages, due_only=False)
+    else:
+        pages = crawl_scheduler.plan_crawl(pages, page_budget=page_budget)
+
+    workers = max(1, min(workers, len(pages)))
+    print(f"    - Crawling {len(pages)} pages with {workers} parallel workers.")
+    deadline = time.monotonic() + time_budget_seconds
+    render_modes = load_render_modes()
+    outcomes = {}
+    pool = WebDriverPool(size=workers)
+    fetch_cache = FetchCache.load()
+    downloader = DocumentDownloader(fetch_cache=fetch_cache)
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            crawls = [executor.submit(crawl_planned_page, pool, downloader, page, render_modes, outcomes, deadline, use_ai_finder) for page in pages]
+            for crawl in crawls:
+                try:
+                    crawl.result()
+                except Exception as e:
+                    print(f"    - ERROR crawling page: {e}")
+    finally:
+        downloader.close()
+        pool.close()
+        save_render_modes(outcomes)
+        fetch_cache.save()
+        crawl_scheduler.record_visits({page_url: (agency_id, changed) for page_url, (agency_id, _, changed) in outcomes.items()})
+    downloader.report()
+    browser_pages = sum(1 for _, mode, _ in outcomes.values() if mode == 'browser')
+    changed_pages = sum(1 for _, _, changed in outcomes.values() if changed)
+    print(f"  - Render paths: {len(outcomes) - browser_pages} static pages, {browser_pages} browser-rendered pages; {changed_pages} changed.")
+    if len(outcomes) < len(pages):
+        print(f"  - Time budget reached; {len(pages) - len(outcomes)} planned pages deferred to the next run.")
+
 def scrape_news_for_agencies(target_agency_ids=None):
     print("  - Harvesting news articles...")
     api_key = os.environ.get('NEWS_API_KEY')
@@ -164,10 +849,9 @@ def scrape_news_for_agencies(target_agency_ids=None):
     if target_agency_ids:
         placeholders = ','.join(database.get_param_style() for _ in target_agency_ids)
         cur.execute(f"SELECT agency_id, name FROM agencies WHERE agency_id IN ({placeholders})", target_agency_ids)
+        agencies_to_query = cur.fetchall()
     else:
-        order_by = "RANDOM()" if database.get_db_type() == 'sqlite' else "RANDOM()"
-        cur.execute(f"SELECT agency_id, name FROM agencies ORDER BY {order_by} LIMIT 20")
-    agencies_to_query = cur.fetchall()
+        agencies_to_query = crawl_scheduler.pick_news_agencies(cur, limit=20)
 
     from_date = (datetime.now() - timedelta(days=30)).strftime('%Y-%m-%d')
     for agency_id, agency_name in agencies_to_query:
@@ -190,7 +874,77 @@ def scrape_news_for_agencies(target_agency_ids=None):
             pass
     if conn: conn.close()
 
-def scrape_historical_solicitations_from_sam(years=5):
+def register_sam_shards(conn, years):
+    """Creates a checkpoint row for every (year, NAICS) shard of the backfill that doesn't have one yet."""
+    current_year = datetime.now().year
+    shards = [(current_year - year_offset, ncode, 0, False) for year_offset in range(years) for ncode in ITS_NAICS_CODES]
+    cur = conn.cursor()
+    database.bulk_insert(cur, 'sam_backfill_checkpoints', ('target_year', 'ncode', 'next_offset', 'completed'), shards, ignore_conflicts=True)
+    # Earlier runs could mark a shard of a year that hasn't ended as completed; reopen those.
+    p_style = database.get_param_style()
+    cur.execute(f"UPDATE sam_backfill_checkpoints SET next_offset = 0, completed = {p_style} WHERE target_year >= {p_style} AND completed = {p_style}", (False, current_year, True))
+    conn.commit()
+    return {(year, ncode) for year, ncode, _, _ in shards}
+
+def reset_sam_checkpoints(conn):
+    cur = conn.cursor()
+    p_style = database.get_param_style()
+    cur.execute(f"UPDATE sam_backfill_checkpoints SET next_offset = 0, completed = {p_style}", (False,))
+    conn.commit()
+
+def backfill_sam_shard(target_year, ncode, offset, api_key, agency_index, limiter):
+    """
+    Pages through one (year, NAICS) shard starting at its checkpointed offset. Each page
+    and the advanced checkpoint are committed together, so a crash or network error
+    loses at most the page in flight and a re-run resumes where this one stopped.
+    Returns the number of new solicitations stored; ones already on file are not counted.
+    """
+    conn = database.get_db_connection()
+    if not conn: return 0
+    cur = conn.cursor()
+    p_style = database.get_param_style()
+    now_func = "NOW()" if database.get_db_type() == 'postgres' else "datetime('now')"
+    checkpoint_sql = f"UPDATE sam_backfill_checkpoints SET next_offset = {p_style}, completed = {p_style}, updated_at = {now_func} WHERE target_year = {p_style} AND ncode = {p_style}"
+    keywords_val = ncode if database.get_db_type() == 'sqlite' else [ncode]
+    stored = 0
+    try:
+        while True:
+            params = {'api_key': api_key, 'postedFrom': f"01/01/{target_year}", 'postedTo': f"12/31/{target_year}", 'ncode': ncode, 'limit': SAM_PAGE_SIZE, 'offset': offset}
+            try:
+                response = fetch_with_retries(get_http_session(), SAM_API_URL, limiter, params=params)
+                opportunities = response.json().get("opportunitiesData", [])
+            except (requests.RequestException, ValueError) as e:
+                print(f"    - ERROR fetching {target_year} NAICS {ncode} at offset {offset}; will resume here next run: {e}")
+                return stored
+
+            rows = [
+                (agency_index.match(opp.get('fullParentPathName')), opp.get('postedDate'), opp.get('title'), opp.get('uiLink'), keywords_val)
+                for opp in opportunities
+                if opp.get('postedDate') and opp.get('title') and opp.get('uiLink')
+            ]
+            inserted = database.bulk_insert(cur, 'historical_solicitations', ('agency_id', 'release_date', 'title', 'url', 'keywords'), rows, ignore_conflicts=True)
+            offset += len(opportunities)
+            caught_up = len(opportunities) < SAM_PAGE_SIZE
+            # A year that hasn't ended keeps receiving postings: its shard is never completed,
+            # and once caught up it starts again from offset 0 on the next run.
+            completed = caught_up and target_year < datetime.now().year
+            cur.execute(checkpoint_sql, (0 if caught_up and not completed else offset, completed, target_year, ncode))
+            conn.commit()
+            stored += inserted
+            if caught_up:
+                status = "Finished" if completed else "Caught up on the current year for"
+                print(f"  - {status} {target_year} NAICS {ncode} ({offset} opportunities).")
+                return stored
+    finally:
+        conn.close()
+
+def scrape_historical_solicitations_from_sam(years=5, workers=SAM_BACKFILL_WORKERS, restart=False):
+    """
+    Backfills historical_solicitations from SAM.gov. The work is split into
+    (year, NAICS) shards that run concurrently under one shared rate limit and
+    checkpoint their offset after every page, so the backfill can be resumed
+    after a crash. Pass restart=True to discard the checkpoints and start over.
+    """
     print("--- Scraping Historical Solicitations from SAM.gov ---")
     api_key = os.environ.get('SAM_API_KEY')
     if not api_key or 'YOUR_SAM_API_KEY' in api_key:
@@ -199,55 +953,31 @@ def scrape_historical_solicitations_from_sam(years=5):
 
     conn = database.get_db_connection()
     if not conn: return
-    cur = conn.cursor()
-
-    ITS_NAICS_CODES = ["541512", "541330", "541715", "334511"]
-    today = datetime.now()
-
-    for year_offset in range(years):
-        target_year = today.year - year_offset
-        posted_from = f"01/01/{target_year}"
-        posted_to = f"12/31/{target_year}"
-        print(f"  - Fetching data for year: {target_year}")
-
-        for ncode in ITS_NAICS_CODES:
-            offset = 0
-            while True:
-                params = {'api_key': api_key, 'postedFrom': posted_from, 'postedTo': posted_to, 'ncode': ncode, 'limit': 1000, 'offset': offset}
-                try:
-                    response = requests.get("https://api.sam.gov/opportunities/v2/search", params=params)
-                    response.raise_for_status()
-                    data = response.json()
-                    opportunities = data.get("opportunitiesData", [])
-                    if not opportunities: break
-
-                    for opp in opportunities:
-                        like_op = "LIKE" if database.get_db_type() == 'sqlite' else "ILIKE"
-                        cur.execute(f"SELECT agency_id FROM agencies WHERE name {like_op} {database.get_param_style()}", (f"%{opp.get('fullParentPathName', '')}%",))
-                        agency_result = cur.fetchone()
-                        agency_id = agency_result[0] if agency_result else None
-                        release_date = opp.get('postedDate')
-                        title = opp.get('title')
-                        url = opp.get('uiLink')
-
-                        if release_date and title and url:
-                            sql = f"INSERT {database.get_on_conflict_clause()} INTO historical_solicitations (agency_id, release_date, title, url, keywords) VALUES ({database.get_param_style()}, {database.get_param_style()}, {database.get_param_style()}, {database.get_param_style()}, {database.get_param_style()})"
-                            keywords_val = ncode if database.get_db_type() == 'sqlite' else [ncode]
-                            cur.execute(sql, (agency_id, release_date, title, url, keywords_val))
-
-                    conn.commit()
-                    if len(opportunities) < 1000: break
-                    offset += 1000
-                    time.sleep(1)
-                except requests.RequestException as e:
-                    print(f"    - ERROR fetching data for NAICS {ncode}: {e}")
-                    break
-    conn.close()
-    print("--- Historical scraping complete. ---")
+    try:
+        agency_index = AgencyNameIndex.build(conn)
+        if restart: reset_sam_checkpoints(conn)
+        wanted = register_sam_shards(conn, years)
+        cur = conn.cursor()
+        cur.execute(f"SELECT target_year, ncode, next_offset FROM sam_backfill_checkpoints WHERE completed = {database.get_param_style()} ORDER BY target_year DESC, ncode", (False,))
+        pending = [row for row in cur.fetchall() if (row[0], row[1]) in wanted]
+    finally:
+        conn.close()
+
+    print(f"  - {len(pending)} of {len(wanted)} shards pending; running {workers} at a time.")
+    limiter = HostRateLimiter(max_per_host=workers, min_delay=SAM_MIN_REQUEST_INTERVAL_SECONDS)
+    stored = 0
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        shards = [executor.submit(backfill_sam_shard, year, ncode, offset, api_key, agency_index, limiter) for year, ncode, offset in pending]
+        for shard in shards:
+            try:
+                stored += shard.result()
+            except Exception as e:
+                print(f"    - ERROR in backfill shard: {e}")
+    print(f"--- Historical scraping complete. Stored {stored} solicitations this run. ---")
 
 if __name__ == '__main__':
     if len(sys.argv) > 1 and sys.argv[1] == '--historical':
-        scrape_historical_solicitations_from_sam()
+        scrape_historical_solicitations_from_sam(restart='--restart' in sys.argv)
     else:
         print("Running standard scrapers...")
         scrape_all_agencies()
@@ -0,0 +1,127 @@
+import re
+from app import database
+
+# Full-text search over documents, extracted-entity context sentences and news.
+# PostgreSQL ranks generated tsvector columns (GIN-indexed); SQLite ranks FTS5 tables
+# kept in sync by triggers. Both indexes are defined in database_setup and are
+# updated by the database itself on every insert, so ingest code needs no changes.
+SOURCES = ('documents', 'entities', 'news')
+SNIPPET_WORDS = 24
+# Dropped from queries on both databases (PostgreSQL's english config ignores them anyway),
+# so natural-language questions don't match on "which" or "the".
+STOP_WORDS = frozenset("""
+    a an and are as at be by can do does for from has have how i in is it its me my of on or our
+    should so that the their them there these they this to was we were what when where which who
+    will with would you your about any all into over than then
+""".split())
+# ts_headline re-parses the text it is given; only the start of a long document is highlighted.
+HEADLINE_SOURCE_CHARS = 200000
+
+_POSTGRES_QUERIES = {
+    'documents': """
+        hits AS (
+            SELECT d.document_id, ts_rank_cd(d.search_vector, q.query) AS score
+            FROM documents d, q WHERE d.search_vector @@ q.query {agency_filter}
+            ORDER BY score DESC LIMIT {limit}
+        )
+        SELECT 'documents', d.document_id, d.agency_id, d.document_type, d.url,
+               ts_headline('english', left(d.raw_text, {headline_chars}), q.query, '{headline_options}'), hits.score
+        FROM hits JOIN documents d ON d.document_id = hits.document_id, q
+    """,
+    'entities': """
+        hits AS (
+            SELECT e.entity_id, ts_rank_cd(e.search_vector, q.query) AS score
+            FROM extracted_entities e JOIN documents d ON e.source_type = 'document' AND d.document_id = e.source_id, q
+            WHERE e.search_vector @@ q.query {agency_filter}
+            ORDER BY score DESC LIMIT {limit}
+        )
+        SELECT 'entities', e.entity_id, d.agency_id, e.entity_text || ' (' || e.entity_label || ')', d.url,
+               ts_headline('english', coalesce(e.context_sentence, ''), q.query, '{headline_options}'), hits.score
+        FROM hits JOIN extracted_entities e ON e.entity_id = hits.entity_id JOIN documents d ON d.document_id = e.source_id, q
+    """,
+    'news': """
+        hits AS (
+            SELECT d.article_id, ts_rank_cd(d.search_vector, q.query) AS score
+            FROM news_articles d, q WHERE d.search_vector @@ q.query {agency_filter}
+            ORDER BY score DESC LIMIT {limit}
+        )
+        SELECT 'news', d.article_id, d.agency_id, d.title, d.article_url,
+               ts_headline('english', coalesce(d.content, d.title, ''), q.query, '{headline_options}'), hits.score
+        FROM hits JOIN news_articles d ON d.article_id = hits.article_id, q
+    """,
+}
+
+# bm25() is lower-is-better, so it is negated to give a higher-is-better score.
+_SQLITE_QUERIES = {
+    'documents': """
+        SELECT 'documents', d.document_id, d.agency_id, d.document_type, d.url,
+               snippet(documents_fts, 0, '**', '**', ' ... ', {snippet_words}), -bm25(documents_fts) AS score
+        FROM documents_fts JOIN documents d ON d.document_id = documents_fts.rowid
+        WHERE documents_fts MATCH ? {agency_filter}
+        ORDER BY bm25(documents_fts) LIMIT {limit}
+    """,
+    'entities': """
+        SELECT 'entities', e.entity_id, d.agency_id, e.entity_text || ' (' || e.entity_label || ')', d.url,
+               snippet(entities_fts, 1, '**', '**', ' ... ', {snippet_words}), -bm25(entities_fts) AS score
+        FROM entities_fts JOIN extracted_entities e ON e.entity_id = entities_fts.rowid
+        JOIN documents d ON e.source_type = 'document' AND d.document_id = e.source_id
+        WHERE entities_fts MATCH ? {agency_filter}
+        ORDER BY bm25(entities_fts) LIMIT {limit}
+    """,
+    'news': """
+        SELECT 'news', d.article_id, d.agency_id, d.title, d.article_url,
+               snippet(news_fts, 1, '**', '**', ' ... ', {snippet_words}), -bm25(news_fts) AS score
+        FROM news_fts JOIN news_articles d ON d.article_id = news_fts.rowid
+        WHERE news_fts MATCH ? {agency_filter}
+        ORDER BY bm25(news_fts) LIMIT {limit}
+    """,
+}
+
+RESULT_FIELDS = ('source', 'id', 'agency_id', 'title', 'url', 'snippet', 'score')
+
+def query_terms(text):
+    return [term for term in re.findall(r"\w+", (text or "").lower()) if term not in STOP_WORDS]
+
+def _fts5_query(terms, match_any):
+    # Each term is quoted so user input can never be read as FTS5 query syntax.
+    return (' OR ' if match_any else ' ').join(f'"{term}"' for term in terms)
+
+def search(query, sources=SOURCES, agency_ids=None, limit=20, match_any=False, snippet_words=SNIPPET_WORDS, conn=None):
+    """
+    Ranked full-text search. Returns up to `limit` hits per source as dicts with
+    source, id, agency_id, title, url, snippet (matches wrapped in **) and score,
+    best first. By default every term must match; with match_any, any term may.
+    agency_ids restricts results to those agencies; snippet_words sets the snippet
+    length. Scores are comparable across sources within one database type.
+    """
+    terms = query_terms(query)
+    if not terms or agency_ids is not None and len(agency_ids) == 0: return []
+    own_conn = conn is None
+    conn = conn or database.get_db_connection()
+    if not conn: return []
+
+    p_style = database.get_param_style()
+    is_postgres = database.get_db_type() == 'postgres'
+    agency_ids = list(agency_ids) if agency_ids is not None else None
+    agency_filter = f"AND d.agency_id IN ({', '.join(p_style for _ in agency_ids)})" if agency_ids else ""
+    hits = []
+    try:
+        cur = conn.cursor()
+        for source in sources:
+            if is_postgres:
+                # plainto_tsquery ANDs the stemmed terms; for match_any the operators are swapped to OR.
+                tsquery = "replace(plainto_tsquery('english', %s)::text, '&', '|')::tsquery" if match_any else "plainto_tsquery('english', %s)"
+                sql = f"WITH q AS (SELECT {tsquery} AS query), " + _POSTGRES_QUERIES[source].format(
+                    agency_filter=agency_filter, limit=int(limit), headline_chars=HEADLINE_SOURCE_CHARS,
+                    headline_options=f"StartSel=**, StopSel=**, MaxWords={int(snippet_words)}, MinWords={max(1, int(snippet_words) // 3)}, MaxFragments=2")
+                params = [" ".join(terms)] + (agency_ids or [])
+            else:
+                # FTS5 snippets are limited to 64 tokens.
+                sql = _SQLITE_QUERIES[source].format(agency_filter=agency_filter, limit=int(limit), snippet_words=min(int(snippet_words), 64))
+                params = [_fts5_query(terms, match_any)] + (agency_ids or [])
+            cur.execute(sql, params)
+            hits.extend(dict(zip(RESULT_FIELDS, row)) for row in cur.fetchall())
+    finally:
+        if own_conn: conn.close()
+    hits.sort(key=lambda hit: hit['score'], reverse=True)
+    return hits
@@ -0,0 +1,103 @@
+import numpy as np
+import pandas as pd
+from app import feature_store, rollup
+
+# Point-in-time feature panels and outcome labels for every (agency, snapshot date)
+# pair, built from one pull of the history and shared by train.py and the backtester.
+# Agency and day are packed into one sortable int64 key (agency_index * _DAY_SPAN + day),
+# so per-agency lookups for every snapshot become a single searchsorted over all agencies.
+_DAY_SPAN = np.int64(1_000_000)
+
+def day_numbers(dates):
+    return (pd.to_datetime(dates).values.astype('datetime64[D]').astype(np.int64))
+
+def _agency_day_keys(agency_index, days):
+    return agency_index.astype(np.int64) * _DAY_SPAN + days
+
+def _grid_keys(agency_count, snapshot_days):
+    return _agency_day_keys(np.repeat(np.arange(agency_count), len(snapshot_days)), np.tile(snapshot_days, agency_count))
+
+def load_signal_history(conn):
+    """Validated signal counts per agency and publication day, read from the feature store."""
+    feature_store.refresh(conn)
+    signals_df = feature_store.read_daily_counts(conn).rename(columns={'signal_date': 'publication_date'})
+    signals_df['publication_date'] = pd.to_datetime(signals_df['publication_date'])
+    return signals_df
+
+def load_history(conn):
+    """Everything a feature panel and its labels are built from, in one pull: agencies, signals, solicitations and the roll-up operator."""
+    agencies_df = pd.read_sql("SELECT agency_id, name FROM agencies ORDER BY agency_id", conn)
+    solicitations_df = pd.read_sql("SELECT agency_id, release_date FROM historical_solicitations WHERE release_date IS NOT NULL", conn)
+    solicitations_df['release_date'] = pd.to_datetime(solicitations_df['release_date'])
+    return {
+        'agencies': agencies_df,
+        'signals': load_signal_history(conn),
+        'solicitations': solicitations_df,
+        'rollup_operator': rollup.rollup_operator(conn, agencies_df['agency_id'].to_numpy()),
+    }
+
+def snapshot_features(agency_ids, snapshot_days, signals_df, feature_names):
+    """
+    Cumulative signal counts strictly before each snapshot, for every (agency, snapshot)
+    pair, as {feature: array} in agency-major order, the same as engineer_features(as_of_date).
+    """
+    position = pd.Index(agency_ids)
+    signals_df = signals_df[signals_df['agency_id'].isin(position)]
+    event_agency = position.get_indexer(signals_df['agency_id'])
+    event_keys = _agency_day_keys(event_agency, day_numbers(signals_df['publication_date']))
+    order = np.argsort(event_keys, kind='stable')
+    event_keys, event_agency = event_keys[order], event_agency[order]
+
+    grid_agency = np.repeat(np.arange(len(position)), len(snapshot_days))
+    grid_keys = _grid_keys(len(position), snapshot_days)
+    # Last event strictly before the snapshot day; it only counts if it belongs to the same agency.
+    last = np.searchsorted(event_keys, grid_keys, side='left') - 1
+    valid = last >= 0
+    valid[valid] = event_agency[last[valid]] == grid_agency[valid]
+
+    features = {}
+    for name in feature_names:
+        counts = signals_df[name].to_numpy()[order]
+        running = pd.Series(counts).groupby(event_agency).cumsum().to_numpy() if len(counts) else counts
+        values = np.zeros(len(grid_keys), dtype=np.float32)
+        values[valid] = running[last[valid]]
+        features[name] = values
+    return features
+
+def feature_panel(history, snapshot_days):
+    """Signal and roll-up features as {feature: (agencies x snapshots) float32 array}."""
+    agency_ids = history['agencies']['agency_id'].to_numpy()
+    grid_shape = (len(agency_ids), len(snapshot_days))
+    features = snapshot_features(agency_ids, snapshot_days, history['signals'], list(feature_store.FEATURE_CONDITIONS))
+    features = {name: values.reshape(grid_shape) for name, values in features.items()}
+    # Roll-ups for every snapshot at once: the operator multiplies an (agencies x snapshots) matrix per feature.
+    rolled = rollup.rollup_features(history['rollup_operator'], features)
+    features.update({name: values.astype(np.float32) for name, values in rolled.items()})
+    return features
+
+def _release_keys(position, solicitations_df):
+    solicitations_df = solicitations_df[solicitations_df['agency_id'].isin(position)]
+    return np.sort(_agency_day_keys(position.get_indexer(solicitations_df['agency_id']), day_numbers(solicitations_df['release_date'])))
+
+def outcome_labels(agency_ids, snapshot_days, solicitations_df, window_days):
+    """1 where the agency released a solicitation in (snapshot, snapshot + window_days], else 0."""
+    position = pd.Index(agency_ids)
+    release_keys = _release_keys(position, solicitations_df)
+    grid_keys = _grid_keys(len(position), snapshot_days)
+    releases = np.searchsorted(release_keys, grid_keys + window_days, side='right') - np.searchsorted(release_keys, grid_keys, side='right')
+    return (releases > 0).astype(np.int8)
+
+def days_to_next_release(agency_ids, snapshot_days, solicitations_df):
+    """Days from each snapshot to the agency's next solicitation release after it, NaN when there is none."""
+    position = pd.Index(agency_ids)
+    release_keys = _release_keys(position, solicitations_df)
+    grid_agency = np.repeat(np.arange(len(position)), len(snapshot_days))
+    grid_keys = _grid_keys(len(position), snapshot_days)
+    following = np.searchsorted(release_keys, grid_keys, side='right')
+    found = np.flatnonzero(following < len(release_keys))
+    # The following release only counts if it belongs to the same agency.
+    same_agency = release_keys[following[found]] // _DAY_SPAN == grid_agency[found]
+    found = found[same_agency]
+    days = np.full(len(grid_keys), np.nan)
+    days[found] = release_keys[following[found]] - grid_keys[found]
+    return days
@@ -0,0 +1,82 @@
+import json
+import time
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# A stand-in for the Ollama API, for exercising app.llm_client (caching, concurrency
+# limits, metrics, streaming) without a model:
+#   python scripts/ollama_stub_server.py --port 11500 --delay 0.5
+#   OLLAMA_URL=http://localhost:11500 python -m app.scraper
+
+def canned_response(prompt):
+    """Deterministic answer: link-finder prompts get a JSON object, everything else Markdown."""
+    if '"document_urls"' in prompt:
+        urls = [line[2:].split(' | ', 1)[0] for line in prompt.splitlines() if line.strip().startswith('- http')]
+        return json.dumps({"document_urls": [url.strip() for url in urls if url.strip().lower().endswith('.pdf')]})
+    return f"**Stub answer.** The prompt had {len(prompt.split())} words."
+
+class StubHandler(BaseHTTPRequestHandler):
+    # Streamed answers use chunked transfer encoding, as Ollama does.
+    protocol_version = 'HTTP/1.1'
+    delay = 0.0
+    token_delay = 0.0
+
+    def do_GET(self):
+        if self.path == '/api/tags':
+            self._send_json({"models": [{"name": "stub"}]})
+        else:
+            self.send_error(404)
+
+    def do_POST(self):
+        if self.path != '/api/generate':
+            self.send_error(404)
+            return
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        prompt = body.get('prompt', '')
+        time.sleep(self.delay)
+        text = canned_response(prompt)
+        tokens = text.split(' ')
+        stats = {"model": body.get('model', 'stub'), "done": True, "prompt_eval_count": len(prompt.split()), "eval_count": len(tokens)}
+        if body.get('stream', True):
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/x-ndjson')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            for i, token in enumerate(tokens):
+                piece = token if i == 0 else f" {token}"
+                self._send_chunk({"model": stats["model"], "response": piece, "done": False})
+                time.sleep(self.token_delay)
+            self._send_chunk(dict(stats, response=""))
+            self.wfile.write(b"0\r\n\r\n")
+        else:
+            self._send_json(dict(stats, response=text))
+
+    def _send_chunk(self, payload):
+        data = (json.dumps(payload) + "\n").encode('utf-8')
+        self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b"\r\n")
+        self.wfile.flush()
+
+    def _send_json(self, payload):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        print(f"[stub] {self.address_string()} {format % args}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a minimal Ollama-compatible /api/generate endpoint.")
+    parser.add_argument("--port", type=int, default=11500)
+    parser.add_argument("--delay", type=float, default=0.0, help="Seconds to wait before answering each request.")
+    parser.add_argument("--token-delay", type=float, default=0.02, help="Seconds between streamed tokens.")
+    args = parser.parse_args()
+    StubHandler.delay = args.delay
+    StubHandler.token_delay = args.token_delay
+    print(f"Ollama stub listening on http://localhost:{args.port}")
+    ThreadingHTTPServer(('', args.port), StubHandler).serve_forever()
+
+if __name__ == '__main__':
+    main()
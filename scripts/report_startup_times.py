@@ -0,0 +1,63 @@
+import sys
+import os
+import json
+import argparse
+import subprocess
+
+# Entry points are imported from the project root, as cron and gunicorn do.
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# Modules imported by the scheduled jobs and long-lived services.
+ENTRY_MODULES = [
+    'app.scraper',
+    'app.nlp_processor',
+    'app.prediction_model',
+    'app.agent_tasks',
+    'app.conversation_agent',
+    'app.report_generator',
+    'train',
+]
+
+PROBE = """
+import json, resource, sys, time
+started = time.perf_counter()
+import {module}
+imported = time.perf_counter() - started
+result = {{'import_seconds': imported, 'spacy_loaded': 'spacy' in sys.modules}}
+if {prewarm} and hasattr({module}, 'prewarm'):
+    started = time.perf_counter()
+    {module}.prewarm()
+    result['prewarm_seconds'] = time.perf_counter() - started
+result['max_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+print(json.dumps(result))
+"""
+
+def measure(module, prewarm=False):
+    """Imports a module in a fresh interpreter and returns its startup measurements."""
+    code = PROBE.format(module=module, prewarm=prewarm)
+    proc = subprocess.run([sys.executable, '-c', code], cwd=PROJECT_ROOT, capture_output=True, text=True)
+    if proc.returncode != 0:
+        return {'error': proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else f"exit code {proc.returncode}"}
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+def main():
+    """
+    Reports how long each scheduler entry point takes to import, its peak RSS, and
+    whether importing it pulled in spaCy.
+    """
+    parser = argparse.ArgumentParser(description="Measure startup time of the scheduler entry points.")
+    parser.add_argument("modules", nargs="*", default=ENTRY_MODULES, help="Modules to measure (default: all entry points).")
+    parser.add_argument("--prewarm", action="store_true", help="Also time prewarm() for modules that provide it.")
+    args = parser.parse_args()
+
+    print(f"{'module':<26} {'import (s)':>10} {'prewarm (s)':>11} {'max RSS (MB)':>12}  spaCy loaded")
+    for module in args.modules:
+        result = measure(module, args.prewarm)
+        if 'error' in result:
+            print(f"{module:<26} ERROR: {result['error']}")
+            continue
+        prewarm = f"{result['prewarm_seconds']:.2f}" if 'prewarm_seconds' in result else "-"
+        print(f"{module:<26} {result['import_seconds']:>10.2f} {prewarm:>11} {result['max_rss_mb']:>12.0f}  {'yes' if result['spacy_loaded'] else 'no'}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+import os
+import json
+import random
+import argparse
+from datetime import date, datetime, timedelta
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# A stand-in for the SAM.gov opportunities search API, for exercising the historical
+# backfill (paging, checkpoints, resume after errors) without an API key or quota:
+#   python scripts/sam_stub_server.py --port 8000 --recordings data/sam_recordings
+#   SAM_API_URL=http://localhost:8000/opportunities/v2/search SAM_API_KEY=stub python -m app.scraper --historical
+# --recordings is a directory of saved search responses (JSON with "opportunitiesData"),
+# e.g. from curl "https://api.sam.gov/opportunities/v2/search?api_key=...&postedFrom=01/01/2024&postedTo=12/31/2024&ncode=541512&limit=1000&offset=0".
+# Their opportunities are merged and re-paged for whatever the client asks. Without it,
+# --per-shard synthetic opportunities are generated for every (year, NAICS) query.
+SEARCH_PATH = '/opportunities/v2/search'
+DEFAULT_AGENCIES = [
+    "TRANSPORTATION, DEPARTMENT OF.FEDERAL HIGHWAY ADMINISTRATION",
+    "TRANSPORTATION, DEPARTMENT OF.FEDERAL TRANSIT ADMINISTRATION",
+    "TRANSPORTATION, DEPARTMENT OF.ITS JOINT PROGRAM OFFICE",
+]
+
+def load_recordings(directory):
+    """Every opportunity in the saved responses under directory, de-duplicated by noticeId (or uiLink)."""
+    opportunities = {}
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith('.json'): continue
+        with open(os.path.join(directory, name), encoding='utf-8') as f:
+            for opp in json.load(f).get('opportunitiesData', []):
+                opportunities[opp.get('noticeId') or opp.get('uiLink')] = opp
+    return list(opportunities.values())
+
+def synthetic_opportunities(year, ncode, count, agencies):
+    """Deterministic opportunities for one (year, NAICS) query, none posted after today."""
+    rng = random.Random(f"{year}-{ncode}")
+    start = date(year, 1, 1)
+    last_day = min(date(year, 12, 31), date.today())
+    span = (last_day - start).days
+    if span < 0: return []
+    opportunities = []
+    for i in range(count):
+        posted = start + timedelta(days=rng.randint(0, span))
+        opportunities.append({
+            "noticeId": f"stub-{year}-{ncode}-{i}",
+            "title": f"Intelligent transportation systems services ({ncode}) #{i}",
+            "postedDate": posted.isoformat(),
+            "naicsCode": ncode,
+            "fullParentPathName": agencies[i % len(agencies)],
+            "uiLink": f"https://sam.gov/opp/stub-{year}-{ncode}-{i}/view",
+        })
+    return sorted(opportunities, key=lambda opp: (opp["postedDate"], opp["noticeId"]))
+
+def _posted_date(value):
+    return datetime.strptime(value, '%m/%d/%Y').date().isoformat()
+
+class StubHandler(BaseHTTPRequestHandler):
+    recorded = None  # list of opportunities when replaying recordings
+    per_shard = 0
+    agencies = DEFAULT_AGENCIES
+    fail_rate = 0.0
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != SEARCH_PATH:
+            self.send_error(404)
+            return
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        if not query.get('api_key'):
+            self._send_json({"error": {"code": "API_KEY_MISSING"}}, status=403)
+            return
+        if random.random() < self.fail_rate:
+            self.send_error(503)
+            return
+        try:
+            posted_from, posted_to = _posted_date(query['postedFrom']), _posted_date(query['postedTo'])
+            limit, offset = int(query.get('limit', 1)), int(query.get('offset', 0))
+        except (KeyError, ValueError):
+            self._send_json({"error": {"code": "INVALID_PARAMETERS"}}, status=400)
+            return
+        ncode = query.get('ncode')
+        if self.recorded is not None:
+            matches = [
+                opp for opp in self.recorded
+                if posted_from <= str(opp.get('postedDate', ''))[:10] <= posted_to
+                and (not ncode or str(opp.get('naicsCode', '')) == ncode)
+            ]
+        else:
+            matches = [
+                opp for year in range(int(posted_from[:4]), int(posted_to[:4]) + 1)
+                for opp in synthetic_opportunities(year, ncode or '000000', self.per_shard, self.agencies)
+                if posted_from <= opp['postedDate'] <= posted_to
+            ]
+        self._send_json({"totalRecords": len(matches), "limit": limit, "offset": offset, "opportunitiesData": matches[offset:offset + limit]})
+
+    def _send_json(self, payload, status=200):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        print(f"[stub] {self.address_string()} {format % args}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a minimal SAM.gov-compatible opportunities search endpoint.")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--recordings", help="Directory of saved SAM.gov search responses to replay.")
+    parser.add_argument("--per-shard", type=int, default=2500, help="Synthetic opportunities per (year, NAICS) query when not replaying recordings.")
+    parser.add_argument("--agency", action="append", help="fullParentPathName for synthetic opportunities; repeatable.")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Fraction of requests answered with 503, to exercise retries and resume.")
+    args = parser.parse_args()
+    if args.recordings:
+        StubHandler.recorded = load_recordings(args.recordings)
+        print(f"Replaying {len(StubHandler.recorded)} recorded opportunities from {args.recordings}")
+    StubHandler.per_shard = args.per_shard
+    StubHandler.agencies = args.agency or DEFAULT_AGENCIES
+    StubHandler.fail_rate = args.fail_rate
+    print(f"SAM.gov stub listening on http://localhost:{args.port}{SEARCH_PATH}")
+    ThreadingHTTPServer(('', args.port), StubHandler).serve_forever()
+
+if __name__ == '__main__':
+    main()
@@ -1,64 +1,230 @@
+import os
+import sys
+import json
+import shutil
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import pandas as pd
 import xgboost as xgb
-from datetime import timedelta
-from sklearn.model_selection import train_test_split
-from sklearn.metrics import accuracy_score, precision_score, recall_score, roc_auc_score
-from app import database, prediction_model
+from sklearn.metrics import accuracy_score, precision_score, recall_score, roc_auc_score, log_loss
+from app import database, training_data
 
 PREDICTION_WINDOW_DAYS = 365
-
-def create_training_dataset():
+SHORT_WINDOW_DAYS = 182
+SNAPSHOT_START = '2011-01-01'
+SNAPSHOT_END = '2023-01-01'
+# Any pandas frequency: '6MS' for half-yearly snapshots (the default), 'D' for daily ones.
+SNAPSHOT_FREQ = os.environ.get('TRAINING_SNAPSHOT_FREQ', '6MS')
+OUTCOME_WINDOWS = {'outcome_6_months': SHORT_WINDOW_DAYS, 'outcome': PREDICTION_WINDOW_DAYS}
+
+# Tuning mode (python train.py --tune): random search with time-ordered CV and early stopping.
+TUNING_TRIALS = int(os.environ.get('TUNING_TRIALS', 20))
+TUNING_FOLDS = int(os.environ.get('TUNING_FOLDS', 4))
+TUNING_PARALLEL_TRIALS = int(os.environ.get('TUNING_PARALLEL_TRIALS', 2))
+TUNING_THREADS = int(os.environ.get('TUNING_THREADS', os.cpu_count() or 1))  # split evenly across parallel trials
+MAX_BOOST_ROUNDS = 1000
+EARLY_STOPPING_ROUNDS = 50
+MAX_BIN = 256  # fixed, so the quantised fold matrices are valid for every trial
+SEARCH_SPACE = {
+    'max_depth': [3, 4, 6, 8],
+    'learning_rate': [0.03, 0.05, 0.1, 0.2],
+    'min_child_weight': [1, 5, 10],
+    'subsample': [0.7, 0.85, 1.0],
+    'colsample_bytree': [0.6, 0.8, 1.0],
+    'reg_lambda': [1.0, 5.0, 10.0],
+}
+ARTIFACT_DIR = 'app/models'
+
+def create_training_dataset(snapshot_freq=SNAPSHOT_FREQ):
+    """
+    Builds one training row per agency per snapshot date from a single pull of signal
+    counts and solicitations: cumulative features before the snapshot plus 6- and
+    12-month outcome labels, all computed with sorted-array lookups.
+    """
     print("--- Creating Training Dataset from Historical Data ---")
     conn = database.get_db_connection()
     if not conn: exit("DB Connection Failed.")
-
-    solicitations_df = pd.read_sql("SELECT agency_id, release_date FROM historical_solicitations", conn)
-    solicitations_df['release_date'] = pd.to_datetime(solicitations_df['release_date'])
-
-    # We create a snapshot for every agency at the start of each quarter
-    time_snapshots = pd.to_datetime(pd.date_range(start='2011-01-01', end='2023-01-01', freq='6M'))
-    training_examples = []
-
-    for snapshot_date in time_snapshots:
-        print(f"  - Generating features for snapshot: {snapshot_date.date()}")
-        features_snapshot = prediction_model.engineer_features(as_of_date=str(snapshot_date.date()))
-        if features_snapshot.empty: continue
-        features_snapshot['snapshot_date'] = snapshot_date
-
-        def get_outcome(row):
-            future_releases = solicitations_df[
-                (solicitations_df['agency_id'] == row['agency_id']) &
-                (solicitations_df['release_date'] > row['snapshot_date']) &
-                (solicitations_df['release_date'] <= row['snapshot_date'] + timedelta(days=PREDICTION_WINDOW_DAYS))
-            ]
-            return 1 if not future_releases.empty else 0
-
-        features_snapshot['outcome'] = features_snapshot.apply(get_outcome, axis=1)
-        training_examples.append(features_snapshot)
-
-    conn.close()
-    if not training_examples:
-        print("Error: No training examples generated. Ensure historical_solicitations table is populated.")
+    try:
+        history = training_data.load_history(conn)
+    finally:
+        conn.close()
+    agencies_df, solicitations_df = history['agencies'], history['solicitations']
+
+    time_snapshots = pd.date_range(start=SNAPSHOT_START, end=SNAPSHOT_END, freq=snapshot_freq)
+    if agencies_df.empty or len(time_snapshots) == 0:
+        print("Error: No training examples generated. Ensure the agencies table is populated.")
         return pd.DataFrame()
-
-    full_training_df = pd.concat(training_examples, ignore_index=True)
+    print(f"  - Generating features for {len(time_snapshots)} snapshots x {len(agencies_df)} agencies ({snapshot_freq})...")
+
+    agency_ids = agencies_df['agency_id'].to_numpy()
+    snapshot_days = training_data.day_numbers(time_snapshots)
+    features = training_data.feature_panel(history, snapshot_days)
+    full_training_df = pd.DataFrame({
+        'agency_id': np.repeat(agency_ids, len(time_snapshots)),
+        'name': np.repeat(agencies_df['name'].to_numpy(), len(time_snapshots)),
+        **{name: values.ravel() for name, values in features.items()},
+        'snapshot_date': np.tile(time_snapshots.values, len(agency_ids)),
+    })
+    for column, window_days in OUTCOME_WINDOWS.items():
+        full_training_df[column] = training_data.outcome_labels(agency_ids, snapshot_days, solicitations_df, window_days)
+    if solicitations_df.empty:
+        print("  - Warning: historical_solicitations is empty, so every outcome label is 0.")
+
+    full_training_df = full_training_df.sort_values(['snapshot_date', 'agency_id'], kind='stable').reset_index(drop=True)
     full_training_df.to_csv('training_data.csv')
     return full_training_df
 
+def feature_columns(df):
+    return [col for col in df.columns if '_mentions' in col or '_count' in col]
+
+def time_series_folds(snapshot_dates, n_folds=TUNING_FOLDS, gap_days=PREDICTION_WINDOW_DAYS):
+    """
+    Expanding-window folds over snapshot rows as [(train_rows, valid_rows)]. The snapshot
+    dates are cut into n_folds + 1 consecutive blocks; fold k validates on block k + 1 and
+    trains on earlier snapshots whose outcome window closed before that block starts.
+    """
+    snapshot_dates = pd.to_datetime(pd.Series(snapshot_dates)).to_numpy()
+    blocks = np.array_split(np.unique(snapshot_dates), n_folds + 1)
+    folds = []
+    for block in blocks[1:]:
+        if len(block) == 0: continue
+        cutoff = block[0] - np.timedelta64(gap_days, 'D')
+        train_rows = np.flatnonzero(snapshot_dates <= cutoff)
+        valid_rows = np.flatnonzero((snapshot_dates >= block[0]) & (snapshot_dates <= block[-1]))
+        if len(train_rows): folds.append((train_rows, valid_rows))
+    return folds
+
+def sample_params(rng):
+    return {name: values[rng.randint(len(values))] for name, values in SEARCH_SPACE.items()}
+
+def _positive_weight(y):
+    positives = int(y.sum())
+    return (len(y) - positives) / positives if positives else 1.0
+
+def build_fold_matrices(X, y, features, folds):
+    """Quantised training and plain validation matrices for each (train_rows, valid_rows) fold."""
+    return [
+        (xgb.QuantileDMatrix(X[train_rows], label=y[train_rows], feature_names=features, max_bin=MAX_BIN),
+         xgb.DMatrix(X[valid_rows], label=y[valid_rows], feature_names=features), y[valid_rows])
+        for train_rows, valid_rows in folds
+    ]
+
+def run_trial(params, fold_data, nthread, seed=42):
+    """Cross-validates one parameter set on the cached fold matrices; returns mean AUC, mean logloss and rounds."""
+    aucs, losses, rounds = [], [], []
+    for dtrain, dvalid, y_valid in fold_data:
+        booster = xgb.train(
+            dict(params, objective='binary:logistic', eval_metric=['auc', 'logloss'], tree_method='hist',
+                 max_bin=MAX_BIN, nthread=nthread, seed=seed, scale_pos_weight=_positive_weight(dtrain.get_label())),
+            dtrain, num_boost_round=MAX_BOOST_ROUNDS, evals=[(dvalid, 'valid')],
+            early_stopping_rounds=EARLY_STOPPING_ROUNDS, verbose_eval=False)
+        probs = booster.predict(dvalid, iteration_range=(0, booster.best_iteration + 1))
+        if 0 < y_valid.sum() < len(y_valid): aucs.append(roc_auc_score(y_valid, probs))
+        losses.append(log_loss(y_valid, probs, labels=[0, 1]))
+        rounds.append(booster.best_iteration + 1)
+    return {'auc': float(np.mean(aucs)) if aucs else float('nan'), 'logloss': float(np.mean(losses)),
+            'fold_auc': [float(a) for a in aucs], 'rounds': int(np.mean(rounds))}
+
+def run_trials(trials, X, y, features, folds, nthread, seed, total):
+    """
+    One tuning worker: quantises its own copy of the fold matrices, so no DMatrix is
+    used from two threads at once, then runs its (index, params) trials in order.
+    """
+    fold_data = build_fold_matrices(X, y, features, folds)
+    results = []
+    for index, params in trials:
+        scores = run_trial(params, fold_data, nthread, seed)
+        results.append(dict(scores, trial=index, params=params))
+        print(f"  - Trial {index + 1}/{total}: AUC {scores['auc']:.3f}, logloss {scores['logloss']:.4f}, {scores['rounds']} rounds, {params}")
+    return results
+
+def tune_and_train(trials=TUNING_TRIALS, n_folds=TUNING_FOLDS, parallel_trials=TUNING_PARALLEL_TRIALS, threads=TUNING_THREADS, seed=42):
+    """
+    Random search over SEARCH_SPACE with time-ordered cross-validation and early stopping.
+    The candidates are split across parallel_trials worker threads, each with its own
+    quantised fold matrices (QuantileDMatrix) and threads // parallel_trials xgboost
+    threads. Boosters are seeded and ties are broken by trial order, so a fixed seed
+    always picks the same parameters. The best parameters are refit on all rows and
+    saved as a versioned artifact with its CV metrics.
+    """
+    df = create_training_dataset()
+    if df.empty: return
+    features = feature_columns(df)
+    X = df[features].to_numpy(dtype=np.float32)
+    y = df['outcome'].to_numpy()
+
+    folds = time_series_folds(df['snapshot_date'], n_folds)
+    if not folds:
+        print("Error: Not enough snapshot dates for time-ordered folds.")
+        return
+    print(f"\n--- Tuning: {trials} trials x {len(folds)} time-ordered folds ---")
+    for train_rows, valid_rows in folds:
+        print(f"  - Fold: train {len(train_rows)} rows up to {df['snapshot_date'].iloc[train_rows].max():%Y-%m-%d}, validate {len(valid_rows)} rows from {df['snapshot_date'].iloc[valid_rows].min():%Y-%m-%d}")
+
+    rng = np.random.RandomState(seed)
+    candidates = [sample_params(rng) for _ in range(trials)]
+    parallel_trials = max(1, min(parallel_trials, trials))
+    nthread = max(1, threads // parallel_trials)
+    shares = [list(enumerate(candidates))[worker::parallel_trials] for worker in range(parallel_trials)]
+    results = []
+    with ThreadPoolExecutor(max_workers=parallel_trials) as executor:
+        futures = [executor.submit(run_trials, share, X, y, features, folds, nthread, seed, trials) for share in shares]
+        for future in futures:
+            results.extend(future.result())
+    results.sort(key=lambda result: (-np.nan_to_num(result['auc'], nan=-1.0), result['logloss'], result['trial']))
+    best = results[0]
+    print(f"  - Best: AUC {best['auc']:.3f}, logloss {best['logloss']:.4f} with {best['params']}")
+
+    print("\n--- Training Final Predictive Model ---")
+    model = xgb.XGBClassifier(**best['params'], n_estimators=best['rounds'], objective='binary:logistic', eval_metric='logloss',
+                              tree_method='hist', max_bin=MAX_BIN, n_jobs=threads, random_state=seed, scale_pos_weight=_positive_weight(y))
+    model.fit(df[features], y)
+    version = datetime.now().strftime('%Y%m%d-%H%M%S')
+    metadata = {
+        'version': version, 'created_at': datetime.now().isoformat(timespec='seconds'),
+        'features': features, 'params': best['params'], 'n_estimators': best['rounds'],
+        'cv': {'folds': len(folds), 'auc': best['auc'], 'logloss': best['logloss'], 'fold_auc': best['fold_auc']},
+        'training_rows': len(df), 'snapshot_range': [f"{df['snapshot_date'].min():%Y-%m-%d}", f"{df['snapshot_date'].max():%Y-%m-%d}"],
+        'trials': [{'params': r['params'], 'auc': r['auc'], 'logloss': r['logloss'], 'rounds': r['rounds']} for r in results],
+    }
+    save_artifact(model, metadata)
+
+def save_artifact(model, metadata):
+    """
+    Writes app/models/xgb_model_<version>.json and its metrics file, and installs the
+    model as app/xgb_model.json, the file live scoring loads. The version is also
+    stored on the booster so prediction runs record which model produced them.
+    """
+    os.makedirs(ARTIFACT_DIR, exist_ok=True)
+    model.get_booster().set_attr(version=metadata['version'])
+    model_path = os.path.join(ARTIFACT_DIR, f"xgb_model_{metadata['version']}.json")
+    model.save_model(model_path)
+    with open(os.path.join(ARTIFACT_DIR, f"xgb_model_{metadata['version']}_metrics.json"), 'w') as f:
+        json.dump(metadata, f, indent=2)
+    shutil.copyfile(model_path, 'app/xgb_model.json')
+    print(f"  - Model artifact saved to {model_path} (CV AUC {metadata['cv']['auc']:.3f}) and installed as app/xgb_model.json")
+
 def train_and_evaluate():
     df = create_training_dataset()
     if df.empty: return
 
-    features = [col for col in df.columns if '_mentions' in col or '_count' in col]
+    features = feature_columns(df)
     X = df[features]
     y = df['outcome']
 
-    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42, stratify=y)
+    # Hold out the latest snapshots; training stops a full outcome window before them so no label overlaps the test period.
+    folds = time_series_folds(df['snapshot_date'], n_folds=4)
+    if not folds:
+        print("Error: Not enough snapshot dates for a time-ordered train/test split.")
+        return
+    train_rows, test_rows = folds[-1]
+    X_train, X_test, y_train, y_test = X.iloc[train_rows], X.iloc[test_rows], y.iloc[train_rows], y.iloc[test_rows]
 
     pos_weight = (y_train == 0).sum() / (y_train == 1).sum() if (y_train == 1).sum() > 0 else 1
 
     print("\\n--- Training Final Predictive Model ---")
-    model = xgb.XGBClassifier(use_label_encoder=False, eval_metric='logloss', scale_pos_weight=pos_weight)
+    model = xgb.XGBClassifier(eval_metric='logloss', scale_pos_weight=pos_weight)
     model.fit(X_train, y_train)
     model.save_model('app/xgb_model.json')
     print("  - Model artifact saved to app/xgb_model.json")
@@ -69,4 +235,5 @@ def train_and_evaluate():
     print(f"  - Accuracy: {accuracy_score(y_test, preds):.2f}, Precision: {precision_score(y_test, preds):.2f}, Recall: {recall_score(y_test, preds):.2f}, AUC-ROC: {roc_auc_score(y_test, probs):.2f}")
 
 if __name__ == '__main__':
-    train_and_evaluate()
+    if '--tune' in sys.argv: tune_and_train()
+    else: train_and_evaluate()